@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+独立去重服务
+把 MessageDeduplicator 作为单独的进程运行，通过 NATS request/reply 提供"检查并添加"接口，
+多个 analyze_agent 副本共用一份 bge-m3 模型和 FAISS 索引，副本之间的重复消息也能识别
+
+请求: subject 为 deduplication.remote.subject（默认 dedup.check），消息体为原始消息 JSON
+      （带 Content-Type: application/msgpack 头时为 msgpack）
+回复: {"duplicate": bool, "similarity": float, "record": {...} 或 null, "stats": {...}}，
+      处理失败时为 {"error": "..."}
+
+服务在 max_wait_ms 内收集请求（最多 max_batch 条），一次向量化后按到达顺序逐条判定并插入，
+同一批内后到的消息也会与先到的消息比较
+
+用法:
+    python dedup_service.py [--config config.yml]
+
+analyze_agent 配置 deduplication.backend: remote 后使用 RemoteDeduplicator 作为去重后端
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec, metrics
+from common.logging_util import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBJECT = 'dedup.check'
+
+# 回复中保留的原消息文本长度
+RECORD_TEXT_LIMIT = 200
+
+SERVICE_REQUESTS = metrics.counter('dedup_service_requests_total', '去重服务处理的请求数', ['result'])
+SERVICE_BATCH_SIZE = metrics.histogram(
+    'dedup_service_batch_size', '每批处理的请求数', buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+SERVICE_BATCH_SECONDS = metrics.histogram('dedup_service_batch_seconds', '每批请求的处理耗时（秒）')
+REMOTE_ERRORS = metrics.counter('analyze_remote_dedup_errors_total', '去重服务请求失败（按不重复处理）的次数')
+
+@dataclass
+class RemoteRecord:
+    """去重服务返回的相似消息（只包含通知需要的字段）"""
+    message_id: str
+    chat_id: str
+    text: str
+    timestamp: float
+
+def encode_reply(is_duplicate: bool, record: Any, similarity: float, stats: Dict[str, Any]) -> bytes:
+    """编码一条去重结果，record 为 MessageRecord 或 None"""
+    reply = {
+        'duplicate': bool(is_duplicate),
+        'similarity': float(similarity),
+        'record': {
+            'message_id': record.message_id,
+            'chat_id': record.chat_id,
+            'text': record.text[:RECORD_TEXT_LIMIT],
+            'timestamp': float(record.timestamp)
+        } if record is not None else None,
+        'stats': stats
+    }
+    return codec.dumps(reply)
+
+def decode_reply(data: bytes) -> Tuple[bool, Optional[RemoteRecord], float, Dict[str, Any]]:
+    """解码去重结果，服务端返回错误时抛出 RuntimeError"""
+    reply = codec.loads(data)
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    record = RemoteRecord(**reply['record']) if reply.get('record') else None
+    return reply['duplicate'], record, reply.get('similarity', 0.0), reply.get('stats', {})
+
+class DedupService:
+    """在 NATS 上提供批量去重的服务端"""
+    
+    def __init__(self, deduplicator, nats_client, subject: str = DEFAULT_SUBJECT,
+                 max_batch: int = 32, max_wait_ms: float = 5.0):
+        """
+        Args:
+            deduplicator: MessageDeduplicator 实例（需要已初始化）
+            nats_client: NATS 连接
+            subject: 请求 subject
+            max_batch: 每批最多处理的请求数
+            max_wait_ms: 收到第一个请求后等待更多请求的时间
+        """
+        self.deduplicator = deduplicator
+        self.nats_client = nats_client
+        self.subject = subject
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._subscription = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        self._subscription = await self.nats_client.subscribe(self.subject, cb=self._on_request)
+        self._task = asyncio.create_task(self._batch_loop())
+        logger.info(f"去重服务已启动: subject={self.subject}, max_batch={self.max_batch}, max_wait={self.max_wait * 1000:.0f}ms")
+    
+    async def stop(self):
+        if self._subscription:
+            await self._subscription.unsubscribe()
+            self._subscription = None
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _on_request(self, msg):
+        self._queue.put_nowait(msg)
+    
+    async def _next_batch(self) -> List[Any]:
+        """取出第一个请求后，在 max_wait 内继续收集，直到 max_batch 条"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _batch_loop(self):
+        while True:
+            batch = await self._next_batch()
+            start = time.perf_counter()
+            try:
+                await self.process_batch(batch)
+            except Exception as e:
+                logger.error(f"去重批处理失败: {e}", exc_info=True)
+            SERVICE_BATCH_SIZE.observe(len(batch))
+            SERVICE_BATCH_SECONDS.observe(time.perf_counter() - start)
+    
+    def _stats_snapshot(self) -> Dict[str, Any]:
+        """随回复返回的统计（不遍历缓存，每批计算一次）"""
+        return {**self.deduplicator.stats, 'cache_size': len(self.deduplicator.message_records)}
+    
+    async def process_batch(self, batch: List[Any]):
+        """解码一批请求，一次向量化后逐条回复"""
+        requests, messages = [], []
+        for msg in batch:
+            try:
+                messages.append(codec.decode(msg.data, msg.headers))
+                requests.append(msg)
+            except codec.DecodeError as e:
+                SERVICE_REQUESTS.labels('invalid').inc()
+                await msg.respond(codec.dumps({'error': f"消息解码失败: {e}"}))
+        if not messages:
+            return
+        
+        try:
+            results = await self.deduplicator.check_and_add_many(messages)
+        except Exception as e:
+            error = codec.dumps({'error': str(e)})
+            for msg in requests:
+                SERVICE_REQUESTS.labels('error').inc()
+                await msg.respond(error)
+            raise
+        
+        stats = self._stats_snapshot()
+        for msg, (is_duplicate, record, similarity) in zip(requests, results):
+            SERVICE_REQUESTS.labels('duplicate' if is_duplicate else 'unique').inc()
+            await msg.respond(encode_reply(is_duplicate, record, similarity, stats))
+
+class RemoteDeduplicator:
+    """
+    去重服务的客户端，接口与 MessageDeduplicator 相同（check_and_add / get_stats / cleanup）
+    
+    服务不可用或超时时按不重复处理，避免去重服务故障导致消息被丢弃
+    """
+    
+    def __init__(self, nats_client, subject: str = DEFAULT_SUBJECT, timeout: float = 5.0):
+        self.nats_client = nats_client
+        self.subject = subject
+        self.timeout = timeout
+        self.stats = {'requests': 0, 'errors': 0}
+        self._remote_stats: Dict[str, Any] = {}
+    
+    async def check_and_add(self, message_data: Dict[str, Any]) -> Tuple[bool, Optional[RemoteRecord], float]:
+        self.stats['requests'] += 1
+        payload = codec.dumps(message_data)
+        try:
+            reply = await self.nats_client.request(self.subject, payload, timeout=self.timeout)
+            is_duplicate, record, similarity, self._remote_stats = decode_reply(reply.data)
+        except Exception as e:
+            self.stats['errors'] += 1
+            REMOTE_ERRORS.inc()
+            if self.stats['errors'] == 1 or self.stats['errors'] % 100 == 0:
+                logger.warning(f"去重服务请求失败，按不重复处理（累计 {self.stats['errors']} 次）: {type(e).__name__} {e}")
+            return False, None, 0.0
+        return is_duplicate, record, similarity
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """最近一次回复中的服务端统计，加上客户端请求计数"""
+        return {
+            'total_messages': 0,
+            'duplicates_found': 0,
+            'cache_size': 0,
+            **self._remote_stats,
+            'backend': 'remote',
+            'remote_requests': self.stats['requests'],
+            'remote_errors': self.stats['errors']
+        }
+    
+    async def cleanup(self):
+        """缓存由去重服务保存，客户端无需清理"""
+
+async def serve(config_file: str):
+    """加载模型并运行去重服务，直到收到 SIGINT / SIGTERM"""
+    import nats
+    from deduplication import ensure_model_available, get_deduplicator, cleanup_deduplicator
+    
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    setup_logging(config.get('logging', {}))
+    
+    dedup_config = config.get('deduplication', {})
+    remote_config = dedup_config.get('remote', {})
+    service_config = dedup_config.get('service', {})
+    model_name = dedup_config.get('model_name', 'BAAI/bge-m3')
+    
+    async def load_deduplicator():
+        if not await ensure_model_available(model_name):
+            raise RuntimeError(f"去重模型不可用: {model_name}")
+        return await get_deduplicator(dedup_config)
+    
+    # 模型加载与 NATS 连接并发进行
+    start = time.perf_counter()
+    deduplicator, nats_client = await asyncio.gather(
+        load_deduplicator(),
+        nats.connect(servers=config.get('nats', {}).get('servers', ['nats://localhost:4222']))
+    )
+    logger.info(f"🚀 去重服务初始化完成，耗时 {time.perf_counter() - start:.2f}s")
+    
+    service = DedupService(
+        deduplicator,
+        nats_client,
+        subject=remote_config.get('subject', DEFAULT_SUBJECT),
+        max_batch=service_config.get('max_batch', 32),
+        max_wait_ms=service_config.get('max_wait_ms', 5)
+    )
+    await service.start()
+    metrics_server = await metrics.start_metrics_server(
+        {**config.get('metrics', {}), 'port': service_config.get('metrics_port', 9104)}, default_port=9104
+    )
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("正在停止去重服务...")
+        await service.stop()
+        if metrics_server:
+            await metrics_server.stop()
+        await nats_client.drain()
+        await cleanup_deduplicator()
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='独立去重服务（NATS request/reply）')
+    parser.add_argument('--config', default='config.yml', help='analyze_agent 配置文件（NATS 地址和去重配置）')
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.config))
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ import logging
 import time
 import hashlib
 import os
+import sys
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, timedelta
 from dataclasses import dataclass
@@ -20,8 +21,17 @@ import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import metrics
+
 logger = logging.getLogger(__name__)
 
+EMBEDDING_BATCH_SIZE = metrics.histogram(
+    'analyze_embedding_batch_size', '每次向量化的文本数', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+EMBEDDING_SECONDS = metrics.histogram('analyze_embedding_seconds', '向量化耗时（秒）')
+
 @dataclass
 class MessageRecord:
     """消息记录"""
@@ -77,12 +87,19 @@ class MessageDeduplicator:
             'cache_misses': 0
         }
         
+        # 初始化各阶段耗时（秒）
+        self.load_timings: Dict[str, float] = {}
+        
         logger.info(f"初始化消息去重器: model={model_name}, threshold={similarity_threshold}, window={time_window_hours}h")
     
     async def initialize(self):
-        """异步初始化"""
-        await self._load_model()
-        self._load_cache()
+        """
+        异步初始化
+        
+        模型和缓存文件在线程池中并发加载，两者都完成后用缓存中的向量重建 FAISS 索引
+        """
+        cache_data, _ = await asyncio.gather(self._read_cache(), self._load_model())
+        self._restore_cache(cache_data)
         logger.info("消息去重器初始化完成")
     
     async def _load_model(self):
@@ -99,23 +116,17 @@ class MessageDeduplicator:
         self.model_loading = True
         try:
             logger.info(f"开始加载句向量模型: {self.model_name}")
-            start_time = time.time()
-            
-            # 在线程池中加载模型以避免阻塞
-            loop = asyncio.get_event_loop()
-            self.model = await loop.run_in_executor(
-                None, 
-                lambda: SentenceTransformer(self.model_name)
-            )
+            start_time = time.perf_counter()
             
-            # 获取向量维度
-            test_vector = self.model.encode(["test"], normalize_embeddings=True)
-            self.vector_dimension = test_vector.shape[1]
+            # 在线程池中加载模型并预热一次推理，避免阻塞事件循环
+            loop = asyncio.get_running_loop()
+            self.model, self.vector_dimension = await loop.run_in_executor(None, self._create_model)
             
             # 初始化FAISS索引
             self.faiss_index = faiss.IndexFlatIP(self.vector_dimension)  # 内积索引（归一化后等价于余弦相似度）
             
-            load_time = time.time() - start_time
+            load_time = time.perf_counter() - start_time
+            self.load_timings['model'] = load_time
             logger.info(f"模型加载完成: 维度={self.vector_dimension}, 耗时={load_time:.2f}s")
             
         except Exception as e:
@@ -124,17 +135,39 @@ class MessageDeduplicator:
         finally:
             self.model_loading = False
     
-    def _load_cache(self):
-        """加载缓存文件"""
+    def _create_model(self) -> Tuple[SentenceTransformer, int]:
+        """加载模型并获取向量维度（在工作线程中执行，首次推理同时完成预热）"""
+        model = SentenceTransformer(self.model_name)
+        test_vector = model.encode(["test"], normalize_embeddings=True)
+        return model, test_vector.shape[1]
+    
+    async def _read_cache(self) -> Optional[Dict[str, Any]]:
+        """在线程池中读取缓存文件，不存在或读取失败时返回 None"""
         cache_path = Path(self.cache_file)
         if not cache_path.exists():
             logger.info("缓存文件不存在，从空缓存开始")
+            return None
+        
+        def _read():
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, _read)
+        except Exception as e:
+            logger.error(f"缓存加载失败: {e}")
+            return None
+        finally:
+            self.load_timings['cache_read'] = time.perf_counter() - start_time
+    
+    def _restore_cache(self, cache_data: Optional[Dict[str, Any]]):
+        """用缓存数据恢复消息记录并重建 FAISS 索引"""
+        if cache_data is None:
             return
         
+        start_time = time.perf_counter()
         try:
-            with open(cache_path, 'rb') as f:
-                cache_data = pickle.load(f)
-            
             self.message_records = cache_data.get('message_records', [])
             self.stats = cache_data.get('stats', self.stats)
             
@@ -157,6 +190,7 @@ class MessageDeduplicator:
                     if self.vector_dimension:
                         self.faiss_index = faiss.IndexFlatIP(self.vector_dimension)
             
+            self.load_timings['cache_index'] = time.perf_counter() - start_time
             logger.info(f"缓存加载完成: {len(self.message_records)} 条记录")
             
         except Exception as e:
@@ -209,6 +243,14 @@ class MessageDeduplicator:
             # 最后的降级方案
             return message_data.get('data', {}).get('text', '')
     
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """批量向量化（归一化后内积等于余弦相似度）"""
+        start = time.perf_counter()
+        vectors = self.model.encode(texts, normalize_embeddings=True)
+        EMBEDDING_SECONDS.observe(time.perf_counter() - start)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        return vectors
+    
     def _generate_message_id(self, message_data: Dict[str, Any]) -> str:
         """生成消息ID"""
         # 优先使用原始message_id
@@ -287,7 +329,6 @@ class MessageDeduplicator:
         
         # 生成消息ID
         message_id = self._generate_message_id(message_data)
-        chat_id = str(message_data.get('data', {}).get('chat_id', ''))
         
         # 清理过期记录
         self._cleanup_old_records()
@@ -295,13 +336,13 @@ class MessageDeduplicator:
         # 检查是否已存在相同ID的消息
         if message_id in self.message_index_map:
             existing_record = self.message_records[self.message_index_map[message_id]]
-            logger.info(f"发现完全相同的消息: {message_id}")
+            logger.info("发现完全相同的消息: %s", message_id)
             self.stats['cache_hits'] += 1
             return True, existing_record, 1.0
         
         # 生成向量
         try:
-            vector = self.model.encode([text], normalize_embeddings=True)[0]
+            vector = self._encode([text])[0]
         except Exception as e:
             logger.error(f"向量化失败: {e}")
             return False, None, 0.0
@@ -310,30 +351,53 @@ class MessageDeduplicator:
         if not self.message_records:
             self.stats['cache_misses'] += 1
             processing_time = (time.time() - start_time) * 1000
-            logger.debug(f"首条消息，无需去重检查，耗时: {processing_time:.1f}ms")
+            logger.debug("首条消息，无需去重检查，耗时: %.1fms", processing_time)
             return False, None, 0.0
         
-        # 使用FAISS搜索最相似的向量
+        max_similarity, most_similar_record = self._find_similar(vector)
+        processing_time = (time.time() - start_time) * 1000
+        
+        # 判断是否重复
+        is_duplicate = max_similarity >= self.similarity_threshold
+        
+        if is_duplicate:
+            self.stats['duplicates_found'] += 1
+            logger.info("发现重复消息: 相似度=%.3f, 原消息ID=%s, 耗时: %.1fms", max_similarity, most_similar_record.message_id, processing_time)
+            logger.debug("原文本: %.100s...", most_similar_record.text)
+            logger.debug("新文本: %.100s...", text)
+        else:
+            self.stats['cache_misses'] += 1
+            logger.debug("消息不重复: 最高相似度=%.3f, 耗时: %.1fms", max_similarity, processing_time)
+        
+        return is_duplicate, most_similar_record, max_similarity
+    
+    def _find_similar(self, vector: np.ndarray) -> Tuple[float, Optional[MessageRecord]]:
+        """
+        使用FAISS搜索时间窗口内最相似的记录
+        
+        Returns:
+            (最高相似度, 对应记录)，没有可比较的记录时为 (0.0, None)
+        """
         try:
             # 检查FAISS索引状态
             if self.faiss_index is None:
                 logger.error("FAISS索引未初始化")
-                return False, None, 0.0
+                return 0.0, None
             
             # 检查索引中的向量数量
             if self.faiss_index.ntotal == 0:
                 logger.debug("FAISS索引为空，无法进行相似度搜索")
-                return False, None, 0.0
+                return 0.0, None
             
             # 检查向量维度
             if vector.shape[0] != self.vector_dimension:
                 logger.error(f"向量维度不匹配: 期望{self.vector_dimension}, 实际{vector.shape[0]}")
-                return False, None, 0.0
+                return 0.0, None
             
             k = min(10, len(self.message_records), self.faiss_index.ntotal)
             if k <= 0:
                 logger.debug("没有可搜索的向量")
-                return False, None, 0.0
+                return 0.0, None
             
             similarities, indices = self.faiss_index.search(
                 vector.reshape(1, -1).astype(np.float32), 
@@ -343,14 +407,15 @@ class MessageDeduplicator:
             # 检查搜索结果
             if similarities.shape[0] == 0 or indices.shape[0] == 0:
                 logger.debug("FAISS搜索返回空结果")
-                return False, None, 0.0
+                return 0.0, None
             
             if similarities.shape[1] == 0 or indices.shape[1] == 0:
                 logger.debug("FAISS搜索未找到任何相似向量")
-                return False, None, 0.0
+                return 0.0, None
             
             max_similarity = 0.0
             most_similar_record = None
+            current_time = time.time()
             
             for similarity, idx in zip(similarities[0], indices[0]):
                 if idx == -1:  # FAISS返回-1表示无效索引
@@ -364,33 +429,18 @@ class MessageDeduplicator:
                 record = self.message_records[idx]
                 
                 # 检查时间窗口
-                current_time = time.time()
                 if current_time - record.timestamp > self.time_window_hours * 3600:
                     continue
                 
                 if similarity > max_similarity:
-                    max_similarity = similarity
+                    max_similarity = float(similarity)
                     most_similar_record = record
             
-            processing_time = (time.time() - start_time) * 1000
-            
-            # 判断是否重复
-            is_duplicate = max_similarity >= self.similarity_threshold
-            
-            if is_duplicate:
-                self.stats['duplicates_found'] += 1
-                logger.info(f"发现重复消息: 相似度={max_similarity:.3f}, 原消息ID={most_similar_record.message_id}, 耗时: {processing_time:.1f}ms")
-                logger.debug(f"原文本: {most_similar_record.text[:100]}...")
-                logger.debug(f"新文本: {text[:100]}...")
-            else:
-                self.stats['cache_misses'] += 1
-                logger.debug(f"消息不重复: 最高相似度={max_similarity:.3f}, 耗时: {processing_time:.1f}ms")
-            
-            return is_duplicate, most_similar_record, max_similarity
+            return max_similarity, most_similar_record
             
         except Exception as e:
             logger.error(f"相似度搜索失败: {e}")
-            return False, None, 0.0
+            return 0.0, None
     
     async def add_message(self, message_data: Dict[str, Any]) -> bool:
         """
@@ -411,61 +461,116 @@ class MessageDeduplicator:
                 return False
             
             message_id = self._generate_message_id(message_data)
-            chat_id = str(message_data.get('data', {}).get('chat_id', ''))
             
             # 检查是否已存在
             if message_id in self.message_index_map:
-                logger.debug(f"消息已存在，跳过添加: {message_id}")
+                logger.debug("消息已存在，跳过添加: %s", message_id)
                 return False
             
             # 生成向量
-            vector = self.model.encode([text], normalize_embeddings=True)[0]
-            
-            # 创建记录
-            record = MessageRecord(
-                message_id=message_id,
-                chat_id=chat_id,
-                text=text,
-                vector=vector,
-                timestamp=time.time(),
-                original_message=message_data
-            )
-            
-            # 添加到缓存
-            self.message_records.append(record)
-            self.message_index_map[message_id] = len(self.message_records) - 1
-            
-            # 添加到FAISS索引
-            if self.faiss_index is not None:
-                try:
-                    # 检查向量维度
-                    if vector.shape[0] != self.vector_dimension:
-                        logger.error(f"向量维度不匹配: 期望{self.vector_dimension}, 实际{vector.shape[0]}")
-                        return False
-                    
-                    self.faiss_index.add(vector.reshape(1, -1).astype(np.float32))
-                    logger.debug(f"向量已添加到FAISS索引，当前索引大小: {self.faiss_index.ntotal}")
-                except Exception as e:
-                    logger.error(f"添加向量到FAISS索引失败: {e}")
-                    return False
-            
-            self.stats['total_messages'] += 1
-            
-            # 检查缓存大小限制
-            if len(self.message_records) > self.max_cache_size:
-                self._cleanup_old_records()
-            
-            # 定期保存缓存
-            if self.stats['total_messages'] % 100 == 0:
-                self._save_cache()
-            
-            logger.debug(f"消息已添加到缓存: {message_id}, 缓存大小: {len(self.message_records)}")
-            return True
+            vector = self._encode([text])[0]
+            return self._insert_record(message_id, text, vector, message_data)
             
         except Exception as e:
             logger.error(f"添加消息失败: {e}")
             return False
     
+    def _insert_record(self, message_id: str, text: str, vector: np.ndarray, message_data: Dict[str, Any]) -> bool:
+        """把已向量化的消息加入缓存和FAISS索引"""
+        # 检查向量维度
+        if self.faiss_index is not None and vector.shape[0] != self.vector_dimension:
+            logger.error(f"向量维度不匹配: 期望{self.vector_dimension}, 实际{vector.shape[0]}")
+            return False
+        
+        # 创建记录
+        record = MessageRecord(
+            message_id=message_id,
+            chat_id=str(message_data.get('data', {}).get('chat_id', '')),
+            text=text,
+            vector=vector,
+            timestamp=time.time(),
+            original_message=message_data
+        )
+        
+        # 添加到FAISS索引
+        if self.faiss_index is not None:
+            try:
+                self.faiss_index.add(vector.reshape(1, -1).astype(np.float32))
+                logger.debug("向量已添加到FAISS索引，当前索引大小: %d", self.faiss_index.ntotal)
+            except Exception as e:
+                logger.error(f"添加向量到FAISS索引失败: {e}")
+                return False
+        
+        # 添加到缓存
+        self.message_records.append(record)
+        self.message_index_map[message_id] = len(self.message_records) - 1
+        self.stats['total_messages'] += 1
+        
+        # 检查缓存大小限制
+        if len(self.message_records) > self.max_cache_size:
+            self._cleanup_old_records()
+        
+        # 定期保存缓存
+        if self.stats['total_messages'] % 100 == 0:
+            self._save_cache()
+        
+        logger.debug("消息已添加到缓存: %s, 缓存大小: %d", message_id, len(self.message_records))
+        return True
+    
+    async def check_and_add(self, message_data: Dict[str, Any]) -> Tuple[bool, Optional[MessageRecord], float]:
+        """检查消息是否重复，不重复时加入缓存（一次向量化）"""
+        return (await self.check_and_add_many([message_data]))[0]
+    
+    async def check_and_add_many(self, messages: List[Dict[str, Any]]) -> List[Tuple[bool, Optional[MessageRecord], float]]:
+        """
+        批量检查并添加消息，所有文本在一次向量化调用中完成
+        
+        按顺序处理，批内后面的消息也会与前面刚加入的消息比较。向量化在线程池中执行，
+        查找和插入在事件循环中连续完成（中间没有 await），并发调用之间不会互相漏判
+        
+        Returns:
+            每条消息的 (is_duplicate, similar_record, similarity_score)
+        """
+        await self._load_model()
+        self._cleanup_old_records()
+        
+        results: List[Tuple[bool, Optional[MessageRecord], float]] = [(False, None, 0.0)] * len(messages)
+        pending = []
+        for index, message_data in enumerate(messages):
+            text = self._extract_text(message_data)
+            if text and len(text.strip()) >= 10:
+                pending.append((index, self._generate_message_id(message_data), text, message_data))
+        if not pending:
+            return results
+        
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                None, self._encode, [text for _, _, text, _ in pending]
+            )
+        except Exception as e:
+            logger.error(f"向量化失败: {e}")
+            return results
+        
+        for (index, message_id, text, message_data), vector in zip(pending, vectors):
+            existing = self.message_index_map.get(message_id)
+            if existing is not None:
+                self.stats['cache_hits'] += 1
+                results[index] = (True, self.message_records[existing], 1.0)
+                continue
+            
+            similarity, record = self._find_similar(vector)
+            if similarity >= self.similarity_threshold:
+                self.stats['duplicates_found'] += 1
+                logger.info("发现重复消息: 相似度=%.3f, 原消息ID=%s", similarity, record.message_id)
+                results[index] = (True, record, similarity)
+                continue
+            
+            self.stats['cache_misses'] += 1
+            self._insert_record(message_id, text, vector, message_data)
+            results[index] = (False, record, similarity)
+        
+        return results
+    
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
         current_time = time.time()
@@ -620,8 +725,8 @@ async def ensure_model_available(model_name: str) -> bool:
         bool: 模型是否可用
     """
     try:
-        # 首先检查模型是否存在
-        if check_model_exists(model_name):
+        # 首先检查模型是否存在（导入 transformers 和读取缓存目录较慢，在线程池中执行）
+        if await asyncio.get_running_loop().run_in_executor(None, check_model_exists, model_name):
             return True
         
         # 判断是否为本地路径
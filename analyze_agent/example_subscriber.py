@@ -5,13 +5,18 @@
 """
 
 import asyncio
-import json
 import logging
+import sys
 from datetime import datetime
+from pathlib import Path
 from typing import Dict, Any
 
 import nats
 
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -59,7 +64,7 @@ class CryptoSignalProcessor:
         """处理通知消息"""
         try:
             self.signal_count += 1
-            notification_data = json.loads(msg.data.decode())
+            notification_data = codec.decode(msg.data, msg.headers)
             
             # 提取数据
             original_msg = notification_data.get('data', {}).get('original_message', {})
@@ -280,7 +285,6 @@ async def main():
     return 0
 
 if __name__ == '__main__':
-    import sys
     try:
         exit_code = asyncio.run(main())
         sys.exit(exit_code)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+JetStream 拉取消费者
+analyze_agent 重启或加载模型期间到达的消息保存在 stream 中，启动后从 durable consumer 的确认位置继续处理:
+- 按批拉取，本地并发数和服务端 max_ack_pending 共同限流，LLM 变慢时不会无限积压在进程内存中
+- 通知发布后才确认（通知和 ACK 走同一个连接，服务端先收到通知再收到 ACK）
+- 处理失败时按 backoff 延迟 NAK 重新投递，最后一次投递仍失败时转发到死信 subject 后 TERM
+- 配置起始序号或时间时，只在 consumer 不存在或起始位置变化时重建，多个副本重复启动不会反复重放
+- 配置改回 all / new / last 时保留已有 consumer 的投递位置，不会从头重放
+- 重建时记录旧 consumer 已投递到的 stream 序号，重放这之前的消息时按重新投递处理（跳过去重，
+  否则已加入去重缓存的消息会被判为与自己重复）
+"""
+
+import asyncio
+import logging
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import metrics
+
+logger = logging.getLogger(__name__)
+
+# 死信消息附加的头
+HEADER_DEAD_LETTER_SUBJECT = 'X-Dead-Letter-Subject'
+HEADER_DEAD_LETTER_SEQUENCE = 'X-Dead-Letter-Sequence'
+HEADER_DEAD_LETTER_DELIVERIES = 'X-Dead-Letter-Deliveries'
+HEADER_DEAD_LETTER_ERROR = 'X-Dead-Letter-Error'
+
+ACKS = metrics.counter('analyze_jetstream_acks_total', 'JetStream 消息的处理结果', ['result'])
+IN_FLIGHT = metrics.gauge('analyze_jetstream_in_flight', '已拉取、正在处理的 JetStream 消息数')
+FETCH_SIZE = metrics.histogram(
+    'analyze_jetstream_fetch_size', '每次拉取到的消息数', buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+
+# 需要在起始位置变化时重建 consumer 的投递策略
+START_POLICIES = ('by_start_sequence', 'by_start_time')
+# consumer metadata 中记录重放边界的键（重启后 consumer 不重建，从服务端读回）
+METADATA_REPLAY_UNTIL = 'replay_until_seq'
+
+def durable_name(name: str) -> str:
+    """durable 名称不能包含 . * > 和空白"""
+    return ''.join('_' if ch in '.*> \t' else ch for ch in name)
+
+def parse_start_time(value: Any) -> Optional[datetime]:
+    """
+    将起始时间解析为 UTC datetime
+    
+    配置中可以是 RFC 3339 字符串（'2024-05-01T08:00:00+08:00'）或 YAML 解析出的 datetime，
+    服务端返回的时间已归一化为 UTC，可能带纳秒。不带时区的时间按 UTC 处理
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        # datetime 只支持微秒精度，截掉多余的小数位
+        text = re.sub(r'(\.\d{6})\d+', r'\1', value.strip()).replace('Z', '+00:00')
+        value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+class JetStreamConsumer:
+    """durable 拉取消费者，多个副本使用同一个 durable 名称时由服务端分配消息"""
+    
+    def __init__(self, nats_client, subjects: List[str], config: Dict[str, Any],
+                 handler: Callable[[Any, bool], Awaitable[None]]):
+        """
+        Args:
+            nats_client: NATS 连接
+            subjects: 消费的 subject（需要被 stream 覆盖）
+            config: nats.jetstream 配置
+            handler: handler(msg, redelivered)，成功返回，失败抛出异常；
+                     redelivered 表示消息已经处理过（重新投递或重放），不再做去重检查
+        """
+        self.nats_client = nats_client
+        self.subjects = subjects
+        self.handler = handler
+        self.stream = config.get('stream', 'MESSAGES')
+        self.durable = durable_name(config.get('durable', 'analyze_agent'))
+        self.batch = max(1, config.get('batch', 10))
+        self.fetch_timeout = config.get('fetch_timeout', 5)
+        self.concurrency = max(1, config.get('concurrency', 4))
+        self.max_ack_pending = config.get('max_ack_pending', 100)
+        self.ack_wait = config.get('ack_wait', 60)
+        self.max_deliver = max(1, config.get('max_deliver', 5))
+        self.backoff = list(config.get('backoff', [5, 30, 120])) or [0]
+        self.dead_letter_subject = config.get('dead_letter_subject', '')
+        self.deliver_policy = config.get('deliver_policy', 'all')
+        self.start_sequence = config.get('start_sequence', 0)
+        self.start_time = parse_start_time(config.get('start_time', ''))
+        # 不超过该 stream 序号的消息已投递给重建前的 consumer
+        self.replay_until = 0
+        
+        self.stats = {'fetched': 0, 'acked': 0, 'nacked': 0, 'dead_lettered': 0, 'replayed': 0}
+        self._subscription = None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._fetch_task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    def _consumer_config(self):
+        from nats.js.api import AckPolicy, ConsumerConfig, DeliverPolicy
+        
+        config = ConsumerConfig(
+            durable_name=self.durable,
+            ack_policy=AckPolicy.EXPLICIT,
+            ack_wait=self.ack_wait,
+            max_deliver=self.max_deliver,
+            max_ack_pending=self.max_ack_pending,
+            deliver_policy=DeliverPolicy(self.deliver_policy)
+        )
+        # 多个 subject 需要 NATS 2.10 的 filter_subjects
+        if len(self.subjects) == 1:
+            config.filter_subject = self.subjects[0]
+        else:
+            config.filter_subjects = list(self.subjects)
+        if self.deliver_policy == 'by_start_sequence':
+            config.opt_start_seq = self.start_sequence
+        elif self.deliver_policy == 'by_start_time':
+            config.opt_start_time = self.start_time
+        if self.replay_until:
+            config.metadata = {METADATA_REPLAY_UNTIL: str(self.replay_until)}
+        return config
+    
+    @staticmethod
+    def _replay_until(info) -> int:
+        """已有 consumer metadata 中记录的重放边界"""
+        try:
+            return int((info.config.metadata or {}).get(METADATA_REPLAY_UNTIL, 0))
+        except (TypeError, ValueError):
+            return 0
+    
+    @staticmethod
+    def _policy(existing) -> str:
+        return getattr(existing.deliver_policy, 'value', existing.deliver_policy)
+    
+    def _start_changed(self, existing) -> bool:
+        """已有 consumer 的起始位置与配置不同"""
+        if self._policy(existing) != self.deliver_policy:
+            return True
+        if self.deliver_policy == 'by_start_sequence':
+            return existing.opt_start_seq != self.start_sequence
+        if self.deliver_policy == 'by_start_time':
+            return parse_start_time(existing.opt_start_time) != self.start_time
+        return False
+    
+    def _update_config(self, existing):
+        """
+        更新已有 consumer 时使用的配置
+        
+        服务端不允许修改投递策略。配置改回 all / new / last 时沿用已有 consumer 的投递策略和起始位置，
+        只更新 max_ack_pending、ack_wait 等可修改的配置，确认位置保持不变
+        """
+        config = self._consumer_config()
+        if self._policy(existing) != self.deliver_policy:
+            config.deliver_policy = existing.deliver_policy
+            config.opt_start_seq = existing.opt_start_seq
+            config.opt_start_time = existing.opt_start_time
+        return config
+    
+    async def start(self):
+        """创建或更新 durable consumer 并开始拉取"""
+        from nats.js.errors import NotFoundError
+        
+        js = self.nats_client.jetstream()
+        try:
+            info = await js.consumer_info(self.stream, self.durable)
+        except NotFoundError:
+            info = None
+        if info is not None:
+            self.replay_until = self._replay_until(info)
+        
+        config = self._consumer_config()
+        if info is not None and self._start_changed(info.config):
+            if self.deliver_policy in START_POLICIES:
+                # 旧 consumer 已投递的消息已经通过去重并加入缓存，重放时跳过去重
+                self.replay_until = max(self.replay_until, info.delivered.stream_seq)
+                logger.warning(f"JetStream 起始位置变化，重建 consumer {self.durable}（从 {self.deliver_policy} "
+                               f"{self.start_sequence or self.start_time} 开始重放，"
+                               f"stream 序号不超过 {self.replay_until} 的消息跳过去重）")
+                await js.delete_consumer(self.stream, self.durable)
+                info = None
+                config = self._consumer_config()
+            else:
+                config = self._update_config(info.config)
+                logger.info(f"JetStream consumer {self.durable} 已存在（投递策略 {self._policy(info.config)}），"
+                            f"保留确认位置，不按 {self.deliver_policy} 重放")
+        
+        # 已存在时更新 max_ack_pending、ack_wait 等可修改的配置，投递位置保持不变
+        info = await js.add_consumer(self.stream, config=config)
+        logger.info(f"JetStream consumer {self.stream}/{self.durable}: 待处理 {info.num_pending} 条，"
+                    f"未确认 {info.num_ack_pending} 条，已确认到 stream 序号 {info.ack_floor.stream_seq}")
+        
+        self._subscription = await js.pull_subscribe_bind(durable=self.durable, stream=self.stream)
+        IN_FLIGHT.set_function(lambda: len(self._tasks))
+        self._running = True
+        self._fetch_task = asyncio.create_task(self._fetch_loop())
+    
+    async def stop(self, timeout: float = 30):
+        """停止拉取，等待正在处理的消息完成（超时未完成的消息由服务端在 ack_wait 后重新投递）"""
+        self._running = False
+        if self._fetch_task:
+            self._fetch_task.cancel()
+            await asyncio.gather(self._fetch_task, return_exceptions=True)
+            self._fetch_task = None
+        if self._tasks:
+            logger.info(f"等待 {len(self._tasks)} 条 JetStream 消息处理完成...")
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        if self._subscription:
+            await self._subscription.unsubscribe()
+            self._subscription = None
+    
+    async def _fetch_loop(self):
+        while self._running:
+            # 至少有一个空闲处理槽位才拉取，每次最多拉取空闲槽位数
+            await self._slots.acquire()
+            free = 1
+            while free < min(self.batch, self.concurrency) and not self._slots.locked():
+                await self._slots.acquire()
+                free += 1
+            
+            try:
+                msgs = await self._subscription.fetch(free, timeout=self.fetch_timeout)
+            except asyncio.TimeoutError:
+                msgs = []
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"JetStream 拉取失败: {e}")
+                msgs = []
+                await asyncio.sleep(1)
+            
+            if msgs:
+                FETCH_SIZE.observe(len(msgs))
+                self.stats['fetched'] += len(msgs)
+            for msg in msgs:
+                free -= 1
+                task = asyncio.create_task(self._process(msg))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            for _ in range(free):
+                self._slots.release()
+    
+    async def _process(self, msg):
+        """处理一条消息并释放处理槽位"""
+        try:
+            await self.process(msg)
+        except Exception as e:
+            # ACK/NAK 发送失败（连接断开等），服务端在 ack_wait 后重新投递
+            logger.error(f"JetStream 消息确认失败: {e}")
+        finally:
+            self._slots.release()
+    
+    async def process(self, msg):
+        """调用 handler，成功 ACK，失败 NAK 或转发死信"""
+        deliveries = msg.metadata.num_delivered
+        replayed = msg.metadata.sequence.stream <= self.replay_until
+        if replayed:
+            self.stats['replayed'] += 1
+        progress = asyncio.create_task(self._keep_in_progress(msg))
+        try:
+            await self.handler(msg, deliveries > 1 or replayed)
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            progress.cancel()
+        
+        if error is not None:
+            await self._on_failure(msg, deliveries, error)
+            return
+        await msg.ack()
+        self.stats['acked'] += 1
+        ACKS.labels('ack').inc()
+    
+    async def _keep_in_progress(self, msg):
+        """处理时间接近 ack_wait 时发送 +WPI，避免 LLM 较慢的消息被重复投递"""
+        interval = max(1.0, self.ack_wait / 2)
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await msg.in_progress()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"发送 in_progress 失败: {e}")
+    
+    async def _on_failure(self, msg, deliveries: int, error: Exception):
+        sequence = msg.metadata.sequence.stream
+        if deliveries < self.max_deliver:
+            delay = self.backoff[min(deliveries, len(self.backoff)) - 1]
+            logger.warning(f"处理消息失败（stream 序号 {sequence}，第 {deliveries}/{self.max_deliver} 次投递），"
+                           f"{delay}s 后重新投递: {error}")
+            await msg.nak(delay=delay)
+            self.stats['nacked'] += 1
+            ACKS.labels('nak').inc()
+            return
+        
+        logger.error(f"处理消息失败（stream 序号 {sequence}，已投递 {deliveries} 次），转发到死信: {error}")
+        if self.dead_letter_subject:
+            headers = dict(msg.headers or {})
+            headers.update({
+                HEADER_DEAD_LETTER_SUBJECT: msg.subject,
+                HEADER_DEAD_LETTER_SEQUENCE: str(sequence),
+                HEADER_DEAD_LETTER_DELIVERIES: str(deliveries),
+                HEADER_DEAD_LETTER_ERROR: str(error)[:500].replace('\r', ' ').replace('\n', ' ')
+            })
+            try:
+                await self.nats_client.publish(self.dead_letter_subject, msg.data, headers=headers)
+            except Exception as e:
+                # 死信发布失败时不 TERM，ack_wait 后由服务端决定是否再投递
+                logger.error(f"发布死信失败: {e}")
+                return
+        await msg.term()
+        self.stats['dead_lettered'] += 1
+        ACKS.labels('dead_letter').inc()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, 'in_flight': len(self._tasks)}
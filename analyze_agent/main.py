@@ -5,10 +5,14 @@ Analyze Agent - 多Agent消息分析系统
 """
 
 import asyncio
+import hashlib
+import importlib
 import json
 import logging
+import sys
 import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 from datetime import datetime
@@ -17,15 +21,37 @@ import yaml
 import nats
 from pydantic import BaseModel, Field
 
-# LangChain imports
-from langchain.schema import BaseMessage, HumanMessage
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_deepseek import ChatDeepSeek
+# LangChain 在 LLMManager 中延迟导入: 提供商集成按配置导入（见 LLM_PROVIDERS），
+# 消息类型来自提供商集成已经依赖的 langchain_core
 
-# 导入去重模块
-from deduplication import get_deduplicator, cleanup_deduplicator, ensure_model_available
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.logging_util import EventLogger, lazy, setup_logging, truncate
+from common import codec, metrics
+from common.tracing import TraceContext
+
+# 通知消息的 NATS 头，notification 可以在解析消息体之前完成过滤
+HEADER_TYPE = 'X-Type'
+HEADER_SOURCE = 'X-Source'
+HEADER_SENTIMENT = 'X-Sentiment'
+HEADER_SCORE = 'X-Score'
+
+# NATS 头只使用 ASCII，情绪用英文代码表示
+SENTIMENT_CODES = {'利多': 'bullish', '利空': 'bearish', '中性': 'neutral'}
+
+# LLM 提供商 -> (模块, 类名)，只导入配置中使用的一个
+LLM_PROVIDERS = {
+    'ollama': ('langchain_ollama', 'ChatOllama'),
+    'openai': ('langchain_openai', 'ChatOpenAI'),
+    'anthropic': ('langchain_anthropic', 'ChatAnthropic'),
+    'deepseek': ('langchain_deepseek', 'ChatDeepSeek')
+}
+
+# 精简通知格式保留的原始消息字段（notification 格式化消息时使用的字段）
+COMPACT_ORIGINAL_FIELDS = (
+    'message_id', 'chat_id', 'chat_title', 'username', 'first_name',
+    'list_url', 'tweet_url', 'tweet_id'
+)
 
 # 配置日志
 logging.basicConfig(
@@ -33,6 +59,27 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+events = EventLogger(logger)
+
+# 指标（/metrics 接口）
+MESSAGES_RECEIVED = metrics.counter('analyze_messages_received_total', '收到的消息数', ['source'])
+DUPLICATES_SKIPPED = metrics.counter('analyze_duplicates_total', '判定为重复而跳过分析的消息数')
+MESSAGE_ERRORS = metrics.counter('analyze_message_errors_total', '处理失败的消息数')
+NOTIFICATIONS_PUBLISHED = metrics.counter('analyze_notifications_published_total', '已发布的通知数', ['kind'])
+NOTIFICATION_BYTES = metrics.counter('analyze_notification_bytes_total', '已发布通知的消息体字节数')
+STAGE_SECONDS = metrics.histogram(
+    'analyze_stage_seconds',
+    '各阶段耗时（秒）: dedup=去重检查, agents=Agent 分析, publish=发布通知, total=单条消息处理总耗时',
+    ['stage']
+)
+LLM_SECONDS = metrics.histogram(
+    'analyze_llm_seconds', 'LLM 调用耗时（秒）', ['provider'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+)
+LLM_ERRORS = metrics.counter('analyze_llm_errors_total', 'LLM 调用失败次数', ['provider'])
+
+class AnalysisFailedError(RuntimeError):
+    """所有 Agent 都分析失败（LLM 不可用等），JetStream 模式下消息等待重新投递"""
 
 class Config:
     """配置管理器"""
@@ -53,11 +100,7 @@ class Config:
     
     def _setup_logging(self):
         """设置日志配置"""
-        log_config = self.config.get('logging', {})
-        level = getattr(logging, log_config.get('level', 'INFO'))
-        format_str = log_config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        
-        logging.basicConfig(level=level, format=format_str, force=True)
+        setup_logging(self.config.get('logging', {}))
     
     def get_nats_config(self) -> Dict[str, Any]:
         """获取NATS配置"""
@@ -74,6 +117,14 @@ class Config:
     def get_deduplication_config(self) -> Dict[str, Any]:
         """获取去重配置"""
         return self.config.get('deduplication', {})
+    
+    def get_metrics_config(self) -> Dict[str, Any]:
+        """获取指标接口配置"""
+        return self.config.get('metrics', {})
+    
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """获取链路追踪配置"""
+        return self.config.get('tracing', {})
 
 class SentimentAnalysisResult(BaseModel):
     """情绪分析结果模型"""
@@ -81,6 +132,18 @@ class SentimentAnalysisResult(BaseModel):
     理由: str = Field(description="判断理由")
     情绪评分: float = Field(description="情绪评分，范围-1.0到1.0")
 
+def load_chat_model_class(provider: str):
+    """导入 LLM 提供商对应的 LangChain 聊天模型类"""
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"不支持的LLM提供商: {provider}")
+    
+    module_name, class_name = LLM_PROVIDERS[provider]
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(f"LLM提供商 {provider} 需要安装 {module_name.replace('_', '-')}: {e}") from e
+    return getattr(module, class_name)
+
 class LLMManager:
     """LLM管理器，支持多种LLM提供商"""
     
@@ -91,9 +154,13 @@ class LLMManager:
     
     def _initialize_llm(self):
         """初始化LLM实例"""
+        chat_model = load_chat_model_class(self.provider)
+        from langchain_core.messages import HumanMessage
+        self._human_message = HumanMessage
+        
         if self.provider == 'ollama':
             ollama_config = self.config.get('ollama', {})
-            return ChatOllama(
+            return chat_model(
                 base_url=ollama_config.get('base_url', 'http://localhost:11434'),
                 model=ollama_config.get('model', 'llama3.1:8b'),
                 temperature=ollama_config.get('temperature', 0.1),
@@ -102,8 +169,9 @@ class LLMManager:
         
         elif self.provider == 'openai':
             openai_config = self.config.get('openai', {})
-            return ChatOpenAI(
+            return chat_model(
                 api_key=openai_config.get('api_key'),
+                base_url=openai_config.get('base_url'),
                 model=openai_config.get('model', 'gpt-4o-mini'),
                 temperature=openai_config.get('temperature', 0.1),
                 max_tokens=openai_config.get('max_tokens', 1000),
@@ -112,7 +180,7 @@ class LLMManager:
         
         elif self.provider == 'anthropic':
             anthropic_config = self.config.get('anthropic', {})
-            return ChatAnthropic(
+            return chat_model(
                 api_key=anthropic_config.get('api_key'),
                 model=anthropic_config.get('model', 'claude-3-haiku-20240307'),
                 temperature=anthropic_config.get('temperature', 0.1),
@@ -122,24 +190,24 @@ class LLMManager:
         
         elif self.provider == 'deepseek':
             deepseek_config = self.config.get('deepseek', {})
-            return ChatDeepSeek(
+            return chat_model(
                 api_key=deepseek_config.get('api_key'),
                 model=deepseek_config.get('model', 'deepseek-chat'),
                 temperature=deepseek_config.get('temperature', 0.1),
                 max_tokens=deepseek_config.get('max_tokens', 1000),
                 timeout=deepseek_config.get('timeout', 30)
             )
-        
-        else:
-            raise ValueError(f"不支持的LLM提供商: {self.provider}")
     
     async def generate_response(self, prompt: str) -> str:
         """生成LLM响应"""
+        start = time.perf_counter()
         try:
-            messages = [HumanMessage(content=prompt)]
+            messages = [self._human_message(content=prompt)]
             response = await self.llm.ainvoke(messages)
+            LLM_SECONDS.labels(self.provider).observe(time.perf_counter() - start)
             return response.content
         except Exception as e:
+            LLM_ERRORS.labels(self.provider).inc()
             logger.error(f"LLM调用失败: {e}")
             raise
 
@@ -198,18 +266,13 @@ class SentimentAnalysisAgent(BaseAgent):
         
         try:
             # 输出正在分析的文本信息
-            logger.info(f"🤖 {self.name} 开始分析...")
-            logger.info(f"📊 分析文本长度: {len(raw_text)} 字符")
-            if len(raw_text) <= 200:
-                logger.info(f"📊 分析文本: {raw_text}")
-            else:
-                logger.info(f"📊 分析文本: {raw_text[:200]}... [已截断]")
+            events.debug(f"🤖 {self.name} 开始分析", provider=self.llm_manager.provider,
+                         length=len(raw_text), text=lazy(truncate, raw_text, 200))
             
             # 构建提示词
             prompt = self._build_prompt(raw_text)
             
             # 调用LLM
-            logger.info(f"🔄 调用 {self.llm_manager.provider} LLM 进行情绪分析...")
             response = await self.llm_manager.generate_response(prompt)
             
             # 解析响应
@@ -218,10 +281,8 @@ class SentimentAnalysisAgent(BaseAgent):
             processing_time = int((time.time() - start_time) * 1000)
             
             # 输出分析结果
-            logger.info(f"✅ 情绪分析完成!")
-            logger.info(f"📈 分析结果: {result.情绪} (评分: {result.情绪评分:.2f})")
-            logger.info(f"💭 分析理由: {result.理由}")
-            logger.info(f"⏱️  处理耗时: {processing_time}ms")
+            events.info("✅ 情绪分析完成", sentiment=result.情绪, score=result.情绪评分,
+                        reason=result.理由, elapsed_ms=processing_time)
             
             return self._format_result(result, message_data, processing_time)
             
@@ -310,7 +371,7 @@ class SentimentAnalysisAgent(BaseAgent):
             # 再次清理
             response = response.strip()
             
-            logger.debug(f"清理后的响应: {response[:200]}...")
+            logger.debug("清理后的响应: %s", lazy(truncate, response, 200))
             
             # 解析JSON
             data = json.loads(response)
@@ -511,19 +572,122 @@ class AnalyzeAgent:
     """主分析系统"""
     
     def __init__(self, config_file: str = "config.yml"):
+        # 启动各阶段耗时（秒），并发执行的阶段时间会重叠
+        self.startup_timings: Dict[str, float] = {}
+        
         self.config = Config(config_file)
-        self.llm_manager = LLMManager(self.config.get_llm_config())
+        with self._startup_phase('llm'):
+            self.llm_manager = LLMManager(self.config.get_llm_config())
         self.agent_manager = AgentManager(self.config, self.llm_manager)
         self.nats_client = None
         self.running = False
         self.deduplicator = None
+        self.subscriptions = []
+        self.jetstream_consumer = None
+        self.metrics_server = None
+        
+        # 链路追踪: 在上游的 X-Trace 头后追加接收、去重、LLM 完成和发布时间
+        self.tracing_enabled = self.config.get_tracing_config().get('enabled', True)
+        
+        # 通知消息体格式（json / msgpack），订阅的消息按 Content-Type 头自动识别
+        self.notification_wire_format = codec.check_format(
+            self.config.get_nats_config().get('notification_wire_format', codec.FORMAT_JSON)
+        )
+        
+        # 通知消息大小统计
+        self.notification_stats = {
+            'count': 0,
+            'total_bytes': 0,
+            'max_bytes': 0,
+            'last_bytes': 0
+        }
+    
+    @contextmanager
+    def _startup_phase(self, name: str):
+        """记录一个启动阶段的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_timings[name] = time.perf_counter() - start
+    
+    def _log_startup_timings(self):
+        phases = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.startup_timings.items() if name != 'total')
+        logger.info(f"🚀 启动完成，耗时 {self.startup_timings.get('total', 0.0):.2f}s ({phases})")
     
     async def initialize(self):
-        """初始化NATS连接和去重器"""
-        # 检测和初始化去重器
+        """
+        初始化NATS连接和去重器
+        
+        去重模块导入、模型加载、缓存读取都在线程池中执行，与 NATS 连接并发进行
+        """
+        nats_config = self.config.get_nats_config()
+        if not nats_config.get('enabled', False):
+            raise ValueError("NATS未启用，请检查配置文件")
+        
+        self._check_queue_group(nats_config)
+        
+        with self._startup_phase('total'):
+            if self._dedup_backend() == 'remote':
+                # 远程去重后端通过 NATS 请求去重服务，需要先建立连接
+                await self._connect_nats(nats_config)
+                await self.initialize_deduplicator()
+            else:
+                await asyncio.gather(self.initialize_deduplicator(), self._connect_nats(nats_config))
+        self._log_startup_timings()
+    
+    def _check_queue_group(self, nats_config: Dict[str, Any]):
+        """
+        队列组订阅时每条消息只投递给其中一个副本，进程内去重器只能看到本副本收到的消息，
+        相似消息落在不同副本时会被重复分析和通知，因此多副本必须使用共享的远程去重服务
+        """
+        if not nats_config.get('queue_group'):
+            return
+        dedup_config = self.config.get_deduplication_config()
+        if dedup_config.get('enabled', False) and self._dedup_backend() != 'remote':
+            raise ValueError(
+                f"使用队列组 {nats_config['queue_group']} 时去重后端必须为 remote（dedup_service.py），"
+                "否则不同副本之间的重复消息无法识别"
+            )
+    
+    def _dedup_backend(self) -> str:
+        """去重后端: local（进程内模型和索引）或 remote（独立去重服务）"""
+        backend = self.config.get_deduplication_config().get('backend', 'local')
+        if backend not in ('local', 'remote'):
+            raise ValueError(f"不支持的去重后端: {backend}，可选 local / remote")
+        return backend
+    
+    async def _connect_nats(self, nats_config: Dict[str, Any]):
+        """连接NATS服务器"""
+        with self._startup_phase('nats'):
+            try:
+                self.nats_client = await nats.connect(
+                    servers=nats_config.get('servers', ['nats://localhost:4222'])
+                )
+                logger.info("NATS连接成功")
+            except Exception as e:
+                logger.error(f"NATS连接失败: {e}")
+                raise
+    
+    async def initialize_deduplicator(self):
+        """按配置初始化去重器（离线回放时不连接 NATS，单独调用）"""
         dedup_config = self.config.get_deduplication_config()
-        if dedup_config.get('enabled', False):
+        if dedup_config.get('enabled', False) and self._dedup_backend() == 'remote':
+            from dedup_service import DEFAULT_SUBJECT, RemoteDeduplicator
+            remote_config = dedup_config.get('remote', {})
+            self.deduplicator = RemoteDeduplicator(
+                self.nats_client,
+                subject=remote_config.get('subject', DEFAULT_SUBJECT),
+                timeout=remote_config.get('timeout', 5)
+            )
+            logger.info(f"使用远程去重服务: {self.deduplicator.subject}")
+        elif dedup_config.get('enabled', False):
             logger.info("检测消息去重配置...")
+            loop = asyncio.get_running_loop()
+            
+            # sentence_transformers / torch 导入需要数秒，在线程池中导入，不阻塞同时进行的 NATS 连接
+            with self._startup_phase('dedup.import'):
+                deduplication = await loop.run_in_executor(None, importlib.import_module, 'deduplication')
             
             # 获取模型名称
             model_name = dedup_config.get('model_name', 'BAAI/bge-m3')
@@ -531,34 +695,22 @@ class AnalyzeAgent:
             
             # 检查并确保模型可用
             logger.info("检查去重模型可用性...")
-            model_available = await ensure_model_available(model_name)
+            with self._startup_phase('dedup.model_check'):
+                model_available = await deduplication.ensure_model_available(model_name)
             
             if not model_available:
                 logger.error(f"去重模型不可用: {model_name}")
                 logger.error("请检查网络连接或模型路径，或在配置中禁用去重功能")
                 raise RuntimeError(f"去重模型不可用: {model_name}")
             
-            # 初始化去重器（此时模型已确保可用）
+            # 初始化去重器（此时模型已确保可用，模型和缓存文件并发加载）
             logger.info("初始化消息去重器...")
-            self.deduplicator = await get_deduplicator(dedup_config)
+            self.deduplicator = await deduplication.get_deduplicator(dedup_config)
+            for name, seconds in self.deduplicator.load_timings.items():
+                self.startup_timings[f'dedup.{name}'] = seconds
             logger.info("消息去重器初始化完成")
         else:
             logger.info("消息去重功能已禁用")
-        
-        # 初始化NATS连接
-        nats_config = self.config.get_nats_config()
-        
-        if not nats_config.get('enabled', False):
-            raise ValueError("NATS未启用，请检查配置文件")
-        
-        try:
-            self.nats_client = await nats.connect(
-                servers=nats_config.get('servers', ['nats://localhost:4222'])
-            )
-            logger.info("NATS连接成功")
-        except Exception as e:
-            logger.error(f"NATS连接失败: {e}")
-            raise
     
     async def start_monitoring(self):
         """开始监控消息"""
@@ -570,10 +722,24 @@ class AnalyzeAgent:
         
         logger.info(f"开始监控NATS subjects: {subjects}")
         
-        # 订阅所有配置的subject
-        for subject in subjects:
-            await self.nats_client.subscribe(subject, cb=self._message_handler)
-            logger.info(f"已订阅subject: {subject}")
+        jetstream_config = nats_config.get('jetstream', {})
+        if jetstream_config.get('enabled', False):
+            # JetStream 拉取消费，通知发布后才确认，失败的消息重新投递
+            from jetstream_consumer import JetStreamConsumer
+            self.jetstream_consumer = JetStreamConsumer(self.nats_client, subjects, jetstream_config, self._jetstream_handler)
+            await self.jetstream_consumer.start()
+        else:
+            # 配置队列组时多个副本分担消息，每条消息只由其中一个副本处理
+            queue_group = nats_config.get('queue_group') or ''
+            
+            # 订阅所有配置的subject
+            for subject in subjects:
+                self.subscriptions.append(await self.nats_client.subscribe(subject, queue=queue_group, cb=self._message_handler))
+                logger.info(f"已订阅subject: {subject}" + (f" (队列组: {queue_group})" if queue_group else ""))
+        
+        # 指标接口
+        self._register_metrics()
+        self.metrics_server = await metrics.start_metrics_server(self.config.get_metrics_config(), default_port=9102)
         
         self.running = True
         logger.info("消息监控已启动，等待消息...")
@@ -590,183 +756,266 @@ class AnalyzeAgent:
             logger.info("收到停止信号")
         finally:
             self.running = False
+            if self.jetstream_consumer:
+                await self.jetstream_consumer.stop()
+            if self.metrics_server:
+                await self.metrics_server.stop()
             if self.nats_client:
-                await self.nats_client.close()
+                # drain 先退订，再处理完订阅缓冲区中已收到的消息，缩容时队列组不会丢消息
+                await self.nats_client.drain()
             # 清理去重器
             if self.deduplicator:
-                await cleanup_deduplicator()
+                await self.deduplicator.cleanup()
+    
+    def _register_metrics(self):
+        """注册抓取时读取的订阅缓冲深度和去重缓存大小"""
+        pending = metrics.gauge('analyze_nats_pending_messages', 'NATS 订阅中等待处理的消息数', ['subject'])
+        for subscription in self.subscriptions:
+            pending.labels(subscription.subject).set_function(lambda subscription=subscription: subscription.pending_msgs)
+        
+        # 远程去重后端的索引指标由去重服务自己暴露
+        if hasattr(self.deduplicator, 'faiss_index'):
+            deduplicator = self.deduplicator
+            metrics.gauge('analyze_faiss_index_size', 'FAISS 索引中的向量数').set_function(
+                lambda: deduplicator.faiss_index.ntotal if deduplicator.faiss_index is not None else 0
+            )
+            metrics.gauge('analyze_dedup_cache_size', '去重缓存中的消息数').set_function(
+                lambda: len(deduplicator.message_records)
+            )
     
     async def _message_handler(self, msg):
-        """处理接收到的消息"""
+        """core NATS 订阅回调，处理失败只记录日志（消息不会重新投递）"""
         try:
-            # 添加调试信息
-            logger.info(f"收到NATS消息 [subject: {msg.subject}], 大小: {len(msg.data)} bytes")
-            
-            # 解析消息
-            message_data = json.loads(msg.data.decode())
-            
-            logger.info(f"解析消息成功: type={message_data.get('type')}, source={message_data.get('source')}")
-            
-            # 处理telegram和twitter消息
-            source = message_data.get('source')
-            if source not in ['telegram', 'twitter']:
-                logger.info(f"跳过不支持的消息源: source={source}")
-                return
-            
-            # 提取并输出原文和来源信息
-            data = message_data.get('data', {})
-            text = data.get('text', '') or data.get('raw_text', '')
-            username = data.get('username', '') or data.get('user_id', '')
-            chat_title = data.get('chat_title', '') if source == 'telegram' else ''
-            list_url = data.get('list_url', '') if source == 'twitter' else ''
-            message_id = data.get('message_id', '')
-            
-            # 调试：显示所有可能的文本字段
-            logger.debug(f"🔍 调试文本字段:")
-            logger.debug(f"   data.text: '{data.get('text', '')}'")
-            logger.debug(f"   data.raw_text: '{data.get('raw_text', '')}'")
-            logger.debug(f"   data.extracted_data.raw_text: '{data.get('extracted_data', {}).get('raw_text', '')}'")
-            
-            # 输出消息来源和原文信息
-            logger.info("=" * 80)
-            logger.info(f"📨 消息来源: {source.upper()}")
-            logger.info(f"🆔 消息ID: {message_id}")
-            if source == 'telegram':
-                logger.info(f"👤 用户: {username}")
-                if chat_title:
-                    logger.info(f"💬 群组: {chat_title}")
-            elif source == 'twitter':
-                logger.info(f"👤 用户: @{username}")
-                if list_url:
-                    logger.info(f"📋 列表: {list_url}")
-            
-            # 输出原文内容
-            if text:
-                logger.info(f"📝 原文内容:")
-                # 如果文本太长，截断显示
-                if len(text) > 500:
-                    logger.info(f"   {text[:500]}...")
-                    logger.info(f"   [文本长度: {len(text)} 字符，已截断显示]")
-                else:
-                    logger.info(f"   {text}")
-            else:
-                logger.info("📝 原文内容: [无文本内容]")
-            
-            logger.info("=" * 80)
-            
-            logger.info(f"开始处理{source}消息: {message_data.get('type')}")
+            await self.handle_message(msg)
+        except Exception as e:
+            MESSAGE_ERRORS.inc()
+            logger.error(f"处理消息失败: {e}", exc_info=True)
+    
+    async def _jetstream_handler(self, msg, redelivered: bool):
+        """JetStream 消费回调，异常交给 JetStreamConsumer 决定重新投递或转发死信"""
+        try:
+            await self.handle_message(msg, redelivered=redelivered, require_analysis=True)
+        except Exception:
+            MESSAGE_ERRORS.inc()
+            raise
+    
+    async def handle_message(self, msg, redelivered: bool = False, require_analysis: bool = False):
+        """
+        处理一条消息: 去重、Agent 分析、发布通知，任何一步失败都抛出异常
+        
+        Args:
+            msg: NATS 消息（core 或 JetStream）
+            redelivered: JetStream 重新投递或重放的消息（已经处理过），跳过去重检查
+            require_analysis: 所有 Agent 都分析失败时抛出 AnalysisFailedError 等待重新投递，而不是发布错误结果
+        """
+        trace = TraceContext.from_headers(msg.headers).mark('analyze.received') if self.tracing_enabled else None
+        start = time.perf_counter()
+        
+        # 解析消息
+        message_data = codec.decode(msg.data, msg.headers)
+        
+        # 处理telegram和twitter消息
+        source = message_data.get('source')
+        if source not in ['telegram', 'twitter']:
+            events.debug("跳过不支持的消息源", subject=msg.subject, source=source)
+            return
+        MESSAGES_RECEIVED.labels(source).inc()
+        
+        # 输出消息来源和原文信息（一条结构化日志，原文按 logging.sampling 采样）
+        data = message_data.get('data', {})
+        text = data.get('text', '') or data.get('raw_text', '')
+        events.info(
+            "📨 收到消息",
+            source=source,
+            type=message_data.get('type'),
+            message_id=data.get('message_id'),
+            user=data.get('username') or data.get('user_id'),
+            chat=data.get('chat_title') if source == 'telegram' else None,
+            list=data.get('list_url') if source == 'twitter' else None,
+            bytes=len(msg.data),
+            text=lazy(truncate, text, 500)
+        )
+        
+        # 消息去重检查（重新投递或重放的消息第一次投递时已经通过去重并加入缓存，再检查会被判为与自己重复）
+        if self.deduplicator and not redelivered:
+            dedup_start = time.perf_counter()
+            # 检查与加入缓存共用一次向量化
+            is_duplicate, similar_record, similarity_score = await self.deduplicator.check_and_add(message_data)
+            STAGE_SECONDS.labels('dedup').observe(time.perf_counter() - dedup_start)
             
-            # 消息去重检查
-            if self.deduplicator:
-                is_duplicate, similar_record, similarity_score = await self.deduplicator.check_duplicate(message_data)
+            if is_duplicate:
+                DUPLICATES_SKIPPED.inc()
+                stats = self.deduplicator.get_stats()
+                events.info("检测到重复消息，跳过处理", similarity=float(similarity_score),
+                            total=stats['total_messages'], duplicates=stats['duplicates_found'],
+                            cache_size=stats['cache_size'])
                 
-                if is_duplicate:
-                    logger.info(f"检测到重复消息，跳过处理: 相似度={similarity_score:.3f}")
-                    
-                    # 记录去重统计信息
-                    stats = self.deduplicator.get_stats()
-                    logger.info(f"去重统计: 总消息={stats['total_messages']}, 重复={stats['duplicates_found']}, 缓存大小={stats['cache_size']}")
-                    
-                    # 发送去重通知
-                    await self._send_duplicate_notification(message_data, similar_record, similarity_score)
-                    return
-                
-                # 添加消息到去重缓存
-                await self.deduplicator.add_message(message_data)
-            
-            # 使用Agent处理消息
-            analysis_result = await self.agent_manager.process_message(message_data)
-            
-            logger.info(f"Agent处理完成，生成 {len(analysis_result['analysis_results'])} 个结果")
-            
-            # 输出分析结果
-            for result in analysis_result['analysis_results']:
-                result_json = json.dumps(result, ensure_ascii=False, separators=(',', ':'))
-                print(f"[{datetime.now().isoformat()}] {result_json}")
+                # 发送去重通知
+                await self._send_duplicate_notification(message_data, similar_record, similarity_score)
+                return
             
-            # 发送通知消息到 messages.notification subject
-            await self._send_notification(message_data, analysis_result)
-                
-        except Exception as e:
-            logger.error(f"处理消息失败: {e}", exc_info=True)
+            if trace is not None:
+                trace.mark('analyze.dedup')
+        
+        # 使用Agent处理消息
+        agents_start = time.perf_counter()
+        analysis_result = await self.agent_manager.process_message(message_data)
+        STAGE_SECONDS.labels('agents').observe(time.perf_counter() - agents_start)
+        if trace is not None:
+            trace.mark('analyze.llm')
+        
+        events.debug("Agent处理完成", results=len(analysis_result['analysis_results']))
+        
+        summary = analysis_result['summary']
+        if require_analysis and summary['total_agents'] and not summary['successful_analyses']:
+            raise AnalysisFailedError(f"{summary['failed_analyses']} 个Agent分析失败")
+        
+        # 输出分析结果
+        for result in analysis_result['analysis_results']:
+            print(f"[{datetime.now().isoformat()}] {codec.dumps_str(result)}")
+        
+        # 发送通知消息到 messages.notification subject
+        await self._send_notification(message_data, analysis_result, trace)
+        STAGE_SECONDS.labels('total').observe(time.perf_counter() - start)
     
     async def _send_duplicate_notification(self, message_data: Dict[str, Any], similar_record, similarity_score: float):
-        """发送重复消息通知"""
-        try:
-            nats_config = self.config.get_nats_config()
-            notification_subject = nats_config.get('notification_subject', 'messages.notification')
-            
-            # 确保similarity_score是Python原生float类型，避免numpy类型序列化问题
-            similarity_score_float = float(similarity_score) if similarity_score is not None else 0.0
-            
-            # 构建重复消息通知
-            notification_message = {
-                'type': 'messages.duplicate',
-                'timestamp': int(time.time() * 1000),
-                'source': 'analyze_agent',
-                'sender': 'deduplication_agent',
-                'data': {
-                    'message': message_data,
-                    'duplicate_info': {
-                        'is_duplicate': True,
-                        'similarity_score': similarity_score_float,
-                        'original_message_id': similar_record.message_id if similar_record else None,
-                        'original_timestamp': float(similar_record.timestamp) if similar_record else None,
-                        'detection_time': datetime.now().isoformat()
-                    },
-                    'stats': self._sanitize_stats(self.deduplicator.get_stats() if self.deduplicator else {})
+        """发送重复消息通知，发布失败时抛出异常（由调用方记录并决定是否重试）"""
+        nats_config = self.config.get_nats_config()
+        notification_subject = nats_config.get('notification_subject', 'messages.notification')
+        
+        # 构建重复消息通知
+        notification_message = {
+            'type': 'messages.duplicate',
+            'timestamp': int(time.time() * 1000),
+            'source': 'analyze_agent',
+            'sender': 'deduplication_agent',
+            'data': {
+                'message': message_data,
+                'duplicate_info': {
+                    'is_duplicate': True,
+                    'similarity_score': similarity_score if similarity_score is not None else 0.0,
+                    'original_message_id': similar_record.message_id if similar_record else None,
+                    'original_timestamp': float(similar_record.timestamp) if similar_record else None,
+                    'detection_time': datetime.now().isoformat()
+                },
+                'stats': self.deduplicator.get_stats() if self.deduplicator else {}
+            }
+        }
+        
+        # 发送到NATS（相似度和统计中的 numpy 类型由 common.codec 直接序列化）
+        payload = codec.encode(notification_message, self.notification_wire_format)
+        headers = {HEADER_TYPE: 'messages.duplicate', HEADER_SOURCE: 'analyze_agent',
+                   **codec.content_headers(self.notification_wire_format)}
+        await self.nats_client.publish(notification_subject, payload, headers=headers)
+        NOTIFICATIONS_PUBLISHED.labels('duplicate').inc()
+        
+        events.debug("重复消息通知已发送", subject=notification_subject)
+    
+    def _notification_headers(self, analysis_result: Dict[str, Any]) -> Dict[str, str]:
+        """构建通知消息的 NATS 头：类型、来源、情绪和评分"""
+        sentiment = analysis_result['summary'].get('overall_sentiment', '中性')
+        score = analysis_result['summary'].get('overall_score', 0.0)
+        for result in analysis_result['analysis_results']:
+            if result.get('agent_type') == 'sentiment_analysis':
+                sentiment = result.get('result', {}).get('sentiment', sentiment)
+                score = result.get('result', {}).get('score', score)
+                break
+        
+        return {
+            HEADER_TYPE: 'messages.notification',
+            HEADER_SOURCE: 'analyze_agent',
+            HEADER_SENTIMENT: SENTIMENT_CODES.get(sentiment, 'unknown'),
+            HEADER_SCORE: f"{float(score):.4f}",
+            **codec.content_headers(self.notification_wire_format)
+        }
+    
+    def _build_compact_notification(self, original_message: Dict[str, Any], analysis_result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        构建精简通知: 只保留 notification 格式化消息需要的字段，
+        完整的原始消息可以通过 ref_id 在 telegramstream/twitter 的消息流中查找
+        """
+        source = original_message.get('source', 'unknown')
+        data = original_message.get('data', {})
+        
+        compact_data = {field: data[field] for field in COMPACT_ORIGINAL_FIELDS if data.get(field) is not None}
+        compact_data['raw_text'] = data.get('raw_text') or data.get('text', '')
+        
+        # 币种只保留符号字符串，不带 CoinGecko 市场数据
+        symbols = []
+        for symbol in data.get('extracted_data', {}).get('symbols', []) + data.get('crypto_symbols', []):
+            symbol_str = symbol.get('symbol', '') if isinstance(symbol, dict) else str(symbol)
+            if symbol_str and symbol_str.upper() not in symbols:
+                symbols.append(symbol_str.upper())
+        compact_data['extracted_data'] = {'symbols': symbols}
+        
+        analysis_results = [
+            {
+                'agent_type': result.get('agent_type'),
+                'result': {
+                    key: result.get('result', {}).get(key)
+                    for key in ('sentiment', 'score', 'reason') if key in result.get('result', {})
                 }
             }
-            
-            # 发送到NATS
-            notification_json = json.dumps(notification_message, ensure_ascii=False, separators=(',', ':'))
-            await self.nats_client.publish(notification_subject, notification_json.encode())
-            
-            logger.debug(f"重复消息通知已发送到 {notification_subject}")
-            
-        except Exception as e:
-            logger.error(f"发送重复消息通知失败: {e}")
-    
-    def _sanitize_stats(self, stats: Dict[str, Any]) -> Dict[str, Any]:
-        """清理统计数据中的numpy类型，确保JSON序列化兼容"""
-        import numpy as np
-        
-        sanitized = {}
-        for key, value in stats.items():
-            if isinstance(value, (np.integer, np.floating)):
-                sanitized[key] = value.item()  # 转换为Python原生类型
-            elif isinstance(value, np.ndarray):
-                sanitized[key] = value.tolist()  # 转换为Python列表
-            elif isinstance(value, dict):
-                sanitized[key] = self._sanitize_stats(value)  # 递归处理嵌套字典
-            elif isinstance(value, list):
-                sanitized[key] = [self._sanitize_value(item) for item in value]
-            else:
-                sanitized[key] = value
-        return sanitized
-    
-    def _sanitize_value(self, value):
-        """清理单个值中的numpy类型"""
-        import numpy as np
-        
-        if isinstance(value, (np.integer, np.floating)):
-            return value.item()
-        elif isinstance(value, np.ndarray):
-            return value.tolist()
-        elif isinstance(value, dict):
-            return self._sanitize_stats(value)
-        elif isinstance(value, list):
-            return [self._sanitize_value(item) for item in value]
+            for result in analysis_result['analysis_results']
+        ]
+        
+        summary = analysis_result['summary']
+        return {
+            'ref_id': self._message_ref_id(original_message),
+            'original_message': {
+                'type': original_message.get('type'),
+                'source': source,
+                'data': compact_data
+            },
+            'analysis_results': analysis_results,
+            'summary': {
+                'overall_sentiment': summary.get('overall_sentiment'),
+                'overall_score': summary.get('overall_score')
+            }
+        }
+    
+    def _message_ref_id(self, original_message: Dict[str, Any]) -> str:
+        """
+        原始消息的引用 ID（也是 notification 的幂等键）
+        
+        缺少 chat_id / message_id（或推文 ID）时使用原始消息内容的哈希，
+        避免不同消息得到相同的 telegram:None:None
+        """
+        source = original_message.get('source', 'unknown')
+        data = original_message.get('data', {})
+        if source == 'twitter':
+            ident = data.get('tweet_id') or data.get('tweet_url') or data.get('message_id')
+        elif data.get('chat_id') is not None and data.get('message_id') is not None:
+            ident = f"{data['chat_id']}:{data['message_id']}"
         else:
-            return value
+            ident = None
+        
+        if not ident:
+            ident = hashlib.sha1(codec.dumps(original_message, sort_keys=True)).hexdigest()
+        return f"{source}:{ident}"
     
-    async def _send_notification(self, original_message: Dict[str, Any], analysis_result: Dict[str, Any]):
-        """发送通知消息到 messages.notification subject"""
-        try:
-            nats_config = self.config.get_nats_config()
-            notification_subject = nats_config.get('notification_subject', 'messages.notification')
-            
-            # 添加去重统计信息到通知中
+    def _record_notification_size(self, size: int):
+        """记录通知消息大小"""
+        stats = self.notification_stats
+        stats['count'] += 1
+        stats['total_bytes'] += size
+        stats['last_bytes'] = size
+        stats['max_bytes'] = max(stats['max_bytes'], size)
+        if stats['count'] % 100 == 0:
+            logger.info(
+                f"📊 通知消息大小: {stats['count']} 条, 平均 {stats['total_bytes'] / stats['count']:.0f} bytes, "
+                f"最大 {stats['max_bytes']} bytes"
+            )
+    
+    async def _send_notification(self, original_message: Dict[str, Any], analysis_result: Dict[str, Any],
+                                 trace: Optional[TraceContext] = None):
+        """发送通知消息到 messages.notification subject，发布失败时抛出异常"""
+        nats_config = self.config.get_nats_config()
+        notification_subject = nats_config.get('notification_subject', 'messages.notification')
+        
+        if nats_config.get('notification_format', 'full') == 'compact':
+            notification_data = self._build_compact_notification(original_message, analysis_result)
+        else:
             notification_data = {
                 'original_message': original_message,
                 'analysis_results': analysis_result['analysis_results'],
@@ -775,26 +1024,30 @@ class AnalyzeAgent:
             
             # 如果启用了去重，添加去重统计信息
             if self.deduplicator:
-                notification_data['deduplication_stats'] = self._sanitize_stats(self.deduplicator.get_stats())
-            
-            # 构建通知消息
-            notification_message = {
-                'type': 'messages.notification',
-                'timestamp': int(time.time() * 1000),
-                'source': 'analyze_agent',
-                'sender': 'analyze_agent',
-                'data': notification_data
-            }
-            
-            # 发送到NATS
-            notification_json = json.dumps(notification_message, ensure_ascii=False, separators=(',', ':'))
-            await self.nats_client.publish(notification_subject, notification_json.encode())
-            
-            logger.info(f"通知消息已发送到 {notification_subject}")
-            logger.debug(f"通知消息内容: {notification_json[:200]}...")
-            
-        except Exception as e:
-            logger.error(f"发送通知消息失败: {e}")
+                notification_data['deduplication_stats'] = self.deduplicator.get_stats()
+        
+        # 构建通知消息
+        notification_message = {
+            'type': 'messages.notification',
+            'timestamp': int(time.time() * 1000),
+            'source': 'analyze_agent',
+            'sender': 'analyze_agent',
+            'data': notification_data
+        }
+        
+        # 发送到NATS
+        payload = codec.encode(notification_message, self.notification_wire_format)
+        headers = self._notification_headers(analysis_result)
+        if trace is not None:
+            trace.mark('analyze.published').inject(headers)
+        publish_start = time.perf_counter()
+        await self.nats_client.publish(notification_subject, payload, headers=headers)
+        STAGE_SECONDS.labels('publish').observe(time.perf_counter() - publish_start)
+        NOTIFICATIONS_PUBLISHED.labels('analysis').inc()
+        NOTIFICATION_BYTES.inc(len(payload))
+        self._record_notification_size(len(payload))
+        
+        events.info("通知消息已发送", subject=notification_subject, bytes=len(payload))
 
 async def main():
     """主函数"""
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+精简通知格式和 ref_id 测试（不初始化 LLM，不连接 NATS）
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from main import AnalyzeAgent
+
+# 只测试通知构建，跳过 __init__ 中的 LLM 初始化
+agent = AnalyzeAgent.__new__(AnalyzeAgent)
+
+ANALYSIS_RESULT = {
+    'analysis_results': [{
+        'agent_type': 'sentiment_analysis',
+        'result': {'sentiment': '利多', 'score': 0.85, 'reason': '突破', 'raw_response': '...'},
+        'timestamp': '2024-05-01T00:00:00'
+    }],
+    'summary': {'overall_sentiment': '利多', 'overall_score': 0.85, 'agents': 1}
+}
+
+def _telegram(text: str = '🚀 BTC突破10万美元！', **fields):
+    data = {
+        'message_id': 12345, 'chat_id': -1001234567890, 'chat_title': 'Crypto Signals',
+        'username': 'crypto_trader', 'text': text, 'raw_text': text,
+        'entities': [{'type': 'bold', 'offset': 0, 'length': 2}],
+        'extracted_data': {'symbols': [{'symbol': 'btc', 'id': 'bitcoin', 'current_price': 100000}, 'BTC', 'eth']}
+    }
+    data.update(fields)
+    return {'type': 'telegram.message', 'source': 'telegram', 'data': data}
+
+def test_compact_notification():
+    """只保留格式化需要的字段，币种压缩为大写符号"""
+    compact = agent._build_compact_notification(_telegram(), ANALYSIS_RESULT)
+    
+    assert compact['ref_id'] == 'telegram:-1001234567890:12345'
+    data = compact['original_message']['data']
+    assert 'entities' not in data and 'text' not in data
+    assert data['raw_text'] == '🚀 BTC突破10万美元！' and data['chat_title'] == 'Crypto Signals'
+    assert data['extracted_data'] == {'symbols': ['BTC', 'ETH']}
+    assert compact['analysis_results'] == [{
+        'agent_type': 'sentiment_analysis', 'result': {'sentiment': '利多', 'score': 0.85, 'reason': '突破'}
+    }]
+    assert compact['summary'] == {'overall_sentiment': '利多', 'overall_score': 0.85}
+    print("✅ 精简通知字段")
+
+def test_message_ref_id():
+    """ref_id 使用 chat_id:message_id 或推文 ID，缺少时退回到内容哈希"""
+    assert agent._message_ref_id({'source': 'twitter', 'data': {'tweet_id': '1790', 'message_id': 7}}) == 'twitter:1790'
+    assert agent._message_ref_id(_telegram(chat_id=0, message_id=0)) == 'telegram:0:0'
+    
+    for missing in ({'message_id': None}, {'chat_id': None}):
+        first = agent._message_ref_id(_telegram('消息 A', **missing))
+        assert first.startswith('telegram:') and 'None' not in first, first
+        assert first == agent._message_ref_id(_telegram('消息 A', **missing)), "同一条消息的 ref_id 应保持不变"
+        assert first != agent._message_ref_id(_telegram('消息 B', **missing)), "不同消息不能共用 ref_id"
+    
+    tweet = agent._message_ref_id({'source': 'twitter', 'data': {'text': '没有 ID 的推文'}})
+    assert tweet.startswith('twitter:') and 'None' not in tweet, tweet
+    print("✅ ref_id 退回内容哈希")
+
+if __name__ == '__main__':
+    try:
+        test_compact_notification()
+        test_message_ref_id()
+        print("\n🎉 所有精简通知测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
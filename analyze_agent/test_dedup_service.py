@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+独立去重服务测试（不加载模型，用按文本判重的简单去重器代替 MessageDeduplicator）
+"""
+
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from dedup_service import DedupService, RemoteDeduplicator, RemoteRecord, decode_reply, encode_reply
+
+@dataclass
+class Record:
+    message_id: str
+    chat_id: str
+    text: str
+    timestamp: float
+
+class TextDeduplicator:
+    """文本完全相同即为重复，记录每次 check_and_add_many 的批大小"""
+    
+    def __init__(self):
+        self.message_records = []
+        self.stats = {'total_messages': 0, 'duplicates_found': 0}
+        self.batches = []
+    
+    async def check_and_add_many(self, messages):
+        self.batches.append(len(messages))
+        results = []
+        for message in messages:
+            text = message['data']['text']
+            record = next((r for r in self.message_records if r.text == text), None)
+            if record:
+                self.stats['duplicates_found'] += 1
+                results.append((True, record, 1.0))
+            else:
+                self.message_records.append(Record(str(message['data']['message_id']), 'c1', text, time.time()))
+                self.stats['total_messages'] += 1
+                results.append((False, None, 0.0))
+        return results
+
+class FakeMsg:
+    def __init__(self, data: bytes, headers=None):
+        self.data = data
+        self.headers = headers
+        self.reply = None
+    
+    async def respond(self, data: bytes):
+        self.reply = data
+
+def _message(message_id: int, text: str) -> bytes:
+    return json.dumps({'source': 'telegram', 'data': {'message_id': message_id, 'text': text}}).encode()
+
+def test_reply_round_trip():
+    """回复编码解码，原文截断，服务端错误抛出异常"""
+    record = Record('m1', 'c1', 'x' * 500, 1700000000.5)
+    is_duplicate, decoded, similarity, stats = decode_reply(encode_reply(True, record, 0.93, {'cache_size': 3}))
+    assert is_duplicate and similarity == 0.93 and stats == {'cache_size': 3}
+    assert decoded == RemoteRecord('m1', 'c1', 'x' * 200, 1700000000.5), decoded
+    
+    assert decode_reply(encode_reply(False, None, 0.1, {}))[:2] == (False, None)
+    try:
+        decode_reply(b'{"error":"boom"}')
+        assert False, "错误回复应该抛出异常"
+    except RuntimeError:
+        pass
+    print("✅ 回复编码")
+
+async def _run_batching():
+    deduplicator = TextDeduplicator()
+    service = DedupService(deduplicator, nats_client=None, max_batch=4, max_wait_ms=20)
+    task = asyncio.create_task(service._batch_loop())
+    
+    msgs = [FakeMsg(_message(i, f"BTC 突破新高 {i % 3}")) for i in range(6)] + [FakeMsg(b'not json')]
+    for msg in msgs:
+        await service._on_request(msg)
+    while any(msg.reply is None for msg in msgs):
+        await asyncio.sleep(0.005)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return deduplicator, msgs
+
+def test_batching():
+    """排队的请求合并为一次 check_and_add_many，每个请求都收到自己的回复"""
+    deduplicator, msgs = asyncio.run(_run_batching())
+    assert deduplicator.batches == [4, 2], deduplicator.batches
+    
+    replies = [json.loads(msg.reply) for msg in msgs]
+    assert [reply['duplicate'] for reply in replies[:6]] == [False, False, False, True, True, True], replies
+    assert replies[3]['record']['message_id'] == '0', replies[3]
+    assert replies[5]['stats']['cache_size'] == 3, replies[5]
+    assert 'error' in replies[6], replies[6]
+    print("✅ 请求批量合并")
+
+class FakeNats:
+    def __init__(self, responder):
+        self.responder = responder
+    
+    async def request(self, subject, payload, timeout):
+        return await self.responder(subject, payload)
+
+async def _run_remote():
+    service = DedupService(TextDeduplicator(), nats_client=None)
+    
+    async def responder(subject, payload):
+        msg = FakeMsg(payload)
+        await service.process_batch([msg])
+        return FakeMsg(msg.reply)
+    
+    async def unavailable(subject, payload):
+        raise asyncio.TimeoutError()
+    
+    remote = RemoteDeduplicator(FakeNats(responder))
+    first = await remote.check_and_add({'data': {'message_id': 1, 'text': 'ETH 升级完成'}})
+    second = await remote.check_and_add({'data': {'message_id': 2, 'text': 'ETH 升级完成'}})
+    
+    remote.nats_client = FakeNats(unavailable)
+    failed = await remote.check_and_add({'data': {'message_id': 3, 'text': 'SOL'}})
+    return first, second, failed, remote.get_stats()
+
+def test_remote_backend():
+    """客户端接口与进程内去重器一致，服务不可用时按不重复处理"""
+    first, second, failed, stats = asyncio.run(_run_remote())
+    assert first == (False, None, 0.0), first
+    assert second[0] and second[1].message_id == '1' and second[2] == 1.0, second
+    assert failed == (False, None, 0.0), failed
+    assert stats['backend'] == 'remote' and stats['remote_errors'] == 1 and stats['duplicates_found'] == 1, stats
+    print("✅ 远程去重后端")
+
+if __name__ == '__main__':
+    try:
+        test_reply_round_trip()
+        test_batching()
+        test_remote_backend()
+        print("\n🎉 所有去重服务测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+JetStream 拉取消费者测试（不连接 NATS，用记录 ACK/NAK/TERM 的消息对象代替 JetStream 消息）
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from datetime import datetime, timezone
+
+from nats.js.api import ConsumerConfig, DeliverPolicy
+from nats.js.errors import NotFoundError
+
+from jetstream_consumer import (HEADER_DEAD_LETTER_DELIVERIES, HEADER_DEAD_LETTER_ERROR, HEADER_DEAD_LETTER_SEQUENCE,
+                                HEADER_DEAD_LETTER_SUBJECT, JetStreamConsumer, durable_name, parse_start_time)
+
+class FakeMsg:
+    def __init__(self, sequence: int, deliveries: int = 1, data: bytes = b'{}'):
+        self.subject = 'telegram.messages'
+        self.data = data
+        self.headers = {'X-Type': 'telegram'}
+        self.metadata = SimpleNamespace(num_delivered=deliveries, sequence=SimpleNamespace(stream=sequence))
+        self.result = None
+        self.nak_delay = None
+        self.progress = 0
+    
+    async def ack(self):
+        self.result = 'ack'
+    
+    async def nak(self, delay=None):
+        self.result, self.nak_delay = 'nak', delay
+    
+    async def term(self):
+        self.result = 'term'
+    
+    async def in_progress(self):
+        self.progress += 1
+
+class FakeNats:
+    def __init__(self):
+        self.published = []
+    
+    async def publish(self, subject, data, headers=None):
+        self.published.append((subject, data, headers))
+
+CONFIG = {'max_deliver': 3, 'backoff': [2, 10], 'dead_letter_subject': 'analyze.dead_letter', 'ack_wait': 60}
+
+async def _run_ack_nak_dead_letter():
+    nats_client = FakeNats()
+    
+    async def handler(msg, redelivered):
+        handled.append((msg.metadata.sequence.stream, redelivered))
+        if msg.data == b'bad':
+            raise ValueError('LLM 不可用')
+    
+    handled = []
+    consumer = JetStreamConsumer(nats_client, ['telegram.messages'], CONFIG, handler)
+    msgs = [FakeMsg(1), FakeMsg(2, deliveries=1, data=b'bad'), FakeMsg(3, deliveries=2, data=b'bad'),
+            FakeMsg(4, deliveries=3, data=b'bad')]
+    for msg in msgs:
+        await consumer.process(msg)
+    return consumer, nats_client, handled, msgs
+
+def test_ack_nak_dead_letter():
+    """成功 ACK，失败按 backoff NAK，最后一次投递失败转发死信后 TERM"""
+    consumer, nats_client, handled, msgs = asyncio.run(_run_ack_nak_dead_letter())
+    assert handled == [(1, False), (2, False), (3, True), (4, True)], handled
+    assert [msg.result for msg in msgs] == ['ack', 'nak', 'nak', 'term'], [msg.result for msg in msgs]
+    assert (msgs[1].nak_delay, msgs[2].nak_delay) == (2, 10)
+    
+    assert len(nats_client.published) == 1
+    subject, data, headers = nats_client.published[0]
+    assert subject == 'analyze.dead_letter' and data == b'bad', nats_client.published
+    assert headers['X-Type'] == 'telegram' and headers[HEADER_DEAD_LETTER_SUBJECT] == 'telegram.messages'
+    assert headers[HEADER_DEAD_LETTER_SEQUENCE] == '4' and headers[HEADER_DEAD_LETTER_DELIVERIES] == '3'
+    assert headers[HEADER_DEAD_LETTER_ERROR] == 'LLM 不可用', headers
+    assert consumer.get_stats() == {'fetched': 0, 'acked': 1, 'nacked': 2, 'dead_lettered': 1, 'replayed': 0,
+                                   'in_flight': 0}
+    print("✅ ACK / NAK / 死信")
+
+class FakePullSubscription:
+    """按请求的数量返回消息，记录每次 fetch 的 batch"""
+    
+    def __init__(self, total: int):
+        self.remaining = list(range(1, total + 1))
+        self.requests = []
+    
+    async def fetch(self, batch, timeout):
+        self.requests.append(batch)
+        if not self.remaining:
+            await asyncio.sleep(0.01)
+            raise asyncio.TimeoutError()
+        taken, self.remaining = self.remaining[:batch], self.remaining[batch:]
+        return [FakeMsg(sequence) for sequence in taken]
+    
+    async def unsubscribe(self):
+        pass
+
+async def _run_flow_control():
+    active, peak, done = 0, 0, []
+    
+    async def handler(msg, redelivered):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        done.append(msg.metadata.sequence.stream)
+    
+    consumer = JetStreamConsumer(FakeNats(), ['telegram.messages'], {'batch': 10, 'concurrency': 3}, handler)
+    consumer._subscription = FakePullSubscription(total=20)
+    consumer._running = True
+    consumer._fetch_task = asyncio.create_task(consumer._fetch_loop())
+    while len(done) < 20:
+        await asyncio.sleep(0.005)
+    consumer._subscription, subscription = None, consumer._subscription
+    await consumer.stop()
+    return peak, sorted(done), subscription.requests
+
+def test_flow_control():
+    """每次拉取不超过空闲槽位数，同时处理的消息数不超过 concurrency"""
+    peak, done, requests = asyncio.run(_run_flow_control())
+    assert done == list(range(1, 21)), done
+    assert peak == 3, peak
+    assert requests[0] == 3 and max(requests) == 3, requests
+    print("✅ 拉取限流")
+
+def test_start_position():
+    """起始位置变化时才需要重建 consumer"""
+    existing = SimpleNamespace(deliver_policy=SimpleNamespace(value='by_start_sequence'), opt_start_seq=100,
+                               opt_start_time=None)
+    
+    def consumer(**config):
+        return JetStreamConsumer(FakeNats(), ['telegram.messages'], config, handler=None)
+    
+    assert consumer(deliver_policy='all')._start_changed(existing)
+    assert not consumer(deliver_policy='by_start_sequence', start_sequence=100)._start_changed(existing)
+    assert consumer(deliver_policy='by_start_sequence', start_sequence=250)._start_changed(existing)
+    assert consumer(deliver_policy='by_start_time', start_time='2024-05-01T08:00:00Z')._start_changed(existing)
+    assert durable_name('analyze.agent *1') == 'analyze_agent__1'
+    
+    # 配置中的时区写法与服务端归一化后的 UTC 时间（纳秒精度）表示同一时刻
+    utc = datetime(2024, 5, 1, 0, 0, tzinfo=timezone.utc)
+    assert parse_start_time('2024-05-01T08:00:00+08:00') == utc
+    assert parse_start_time('2024-05-01T00:00:00.000000000Z') == utc
+    assert parse_start_time(datetime(2024, 5, 1, 0, 0)) == utc
+    assert parse_start_time('') is None
+    by_time = SimpleNamespace(deliver_policy=DeliverPolicy.BY_START_TIME, opt_start_seq=None, opt_start_time=utc)
+    assert not consumer(deliver_policy='by_start_time', start_time='2024-05-01T08:00:00+08:00')._start_changed(by_time)
+    assert consumer(deliver_policy='by_start_time', start_time='2024-05-01T09:00:00+08:00')._start_changed(by_time)
+    print("✅ 起始位置")
+
+class FakeJetStream:
+    """记录 consumer 的创建、更新和删除，模拟服务端拒绝修改投递策略"""
+    
+    def __init__(self, existing: ConsumerConfig = None):
+        self.existing = existing
+        self.deleted = 0
+        self.added = []
+        self.delivered = 0  # 已有 consumer 投递到的 stream 序号
+    
+    async def consumer_info(self, stream, durable):
+        if self.existing is None:
+            raise NotFoundError()
+        return SimpleNamespace(config=self.existing, delivered=SimpleNamespace(stream_seq=self.delivered))
+    
+    async def delete_consumer(self, stream, durable):
+        self.deleted += 1
+        self.existing = None
+    
+    async def add_consumer(self, stream, config):
+        if self.existing is not None and config.deliver_policy != self.existing.deliver_policy:
+            raise ValueError('deliver policy can not be updated')
+        self.added.append(config)
+        self.existing = config
+        return SimpleNamespace(num_pending=0, num_ack_pending=0, ack_floor=SimpleNamespace(stream_seq=0))
+    
+    async def pull_subscribe_bind(self, durable, stream):
+        return FakePullSubscription(total=0)
+
+class FakeJetStreamNats(FakeNats):
+    def __init__(self, js: FakeJetStream):
+        super().__init__()
+        self.js = js
+    
+    def jetstream(self):
+        return self.js
+
+async def _start(js: FakeJetStream, **config):
+    consumer = JetStreamConsumer(FakeJetStreamNats(js), ['telegram.messages'], config, handler=None)
+    await consumer.start()
+    await consumer.stop()
+    return js.added[-1]
+
+def test_start_policy_switch():
+    """重放后改回 all: 保留已有 consumer 的投递策略，不删除重建也不被服务端拒绝"""
+    async def run():
+        js = FakeJetStream()
+        replay = await _start(js, deliver_policy='by_start_sequence', start_sequence=100)
+        assert replay.deliver_policy == DeliverPolicy.BY_START_SEQUENCE and replay.opt_start_seq == 100
+        
+        # 副本重复启动不重建
+        await _start(js, deliver_policy='by_start_sequence', start_sequence=100)
+        assert js.deleted == 0
+        
+        updated = await _start(js, deliver_policy='all', max_ack_pending=50)
+        assert js.deleted == 0, "改回 all 不应删除 consumer 从头重放"
+        assert updated.deliver_policy == DeliverPolicy.BY_START_SEQUENCE and updated.opt_start_seq == 100
+        assert updated.max_ack_pending == 50
+        
+        # 起始时间只是时区写法不同时不重建，改变时刻时重建
+        await _start(js, deliver_policy='by_start_time', start_time='2024-05-01T08:00:00+08:00')
+        assert js.deleted == 1
+        await _start(js, deliver_policy='by_start_time', start_time='2024-05-01T00:00:00Z')
+        assert js.deleted == 1
+        await _start(js, deliver_policy='by_start_time', start_time='2024-05-02T00:00:00Z')
+        assert js.deleted == 2
+    
+    asyncio.run(run())
+    print("✅ 投递策略切换")
+
+def test_replay_skips_dedup():
+    """重建 consumer 重放时，旧 consumer 已投递过的消息按重新投递处理，重启后从 metadata 读回边界"""
+    async def run():
+        js = FakeJetStream()
+        first = await _start(js, deliver_policy='all')
+        assert first.metadata is None
+        
+        js.delivered = 500
+        replay = await _start(js, deliver_policy='by_start_sequence', start_sequence=100)
+        assert js.deleted == 1 and replay.metadata == {'replay_until_seq': '500'}, replay.metadata
+        
+        # 副本重启时 consumer 不重建，边界从服务端的 metadata 读回；改回 all 更新配置时保留
+        js.delivered = 300
+        handled = []
+        
+        async def handler(msg, redelivered):
+            handled.append((msg.metadata.sequence.stream, redelivered))
+        
+        consumer = JetStreamConsumer(FakeJetStreamNats(js), ['telegram.messages'],
+                                     {'deliver_policy': 'by_start_sequence', 'start_sequence': 100}, handler)
+        await consumer.start()
+        await consumer.stop()
+        assert js.deleted == 1 and consumer.replay_until == 500
+        for msg in (FakeMsg(300), FakeMsg(500), FakeMsg(501), FakeMsg(502, deliveries=2)):
+            await consumer.process(msg)
+        assert handled == [(300, True), (500, True), (501, False), (502, True)], handled
+        assert consumer.get_stats()['replayed'] == 2
+        
+        updated = await _start(js, deliver_policy='all')
+        assert updated.metadata == {'replay_until_seq': '500'}
+    
+    asyncio.run(run())
+    print("✅ 重放的消息跳过去重")
+
+if __name__ == '__main__':
+    try:
+        test_ack_nak_dead_letter()
+        test_flow_control()
+        test_start_position()
+        test_start_policy_switch()
+        test_replay_skips_dedup()
+        print("\n🎉 所有 JetStream 消费者测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -5,12 +5,17 @@ NATS 消息测试脚本
 """
 
 import asyncio
-import json
+import sys
 import time
 from datetime import datetime
+from pathlib import Path
 
 import nats
 
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec
+
 async def test_nats_publisher():
     """测试发送消息到NATS"""
     print("=== NATS 发送测试 ===")
@@ -42,8 +47,7 @@ async def test_nats_publisher():
     subjects = ["messages.stream", "telegram.messages"]
     
     for subject in subjects:
-        message_json = json.dumps(test_message, ensure_ascii=False)
-        await nc.publish(subject, message_json.encode())
+        await nc.publish(subject, codec.dumps(test_message))
         print(f"📤 已发送测试消息到: {subject}")
     
     await nc.close()
@@ -61,7 +65,7 @@ async def test_nats_subscriber():
     
     async def message_handler(msg):
         try:
-            data = json.loads(msg.data.decode())
+            data = codec.decode(msg.data, msg.headers)
             received_messages.append({
                 'subject': msg.subject,
                 'data': data,
@@ -5,12 +5,17 @@
 """
 
 import asyncio
-import json
 import logging
+import sys
 from datetime import datetime
+from pathlib import Path
 
 import nats
 
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -63,7 +68,7 @@ class NotificationListener:
     async def _stream_handler(self, msg):
         """处理原始流消息"""
         try:
-            message_data = json.loads(msg.data.decode())
+            message_data = codec.decode(msg.data, msg.headers)
             logger.info(f"📨 收到原始消息: type={message_data.get('type')}, "
                        f"chat={message_data.get('data', {}).get('chat_title', 'Unknown')}")
         except Exception as e:
@@ -73,7 +78,7 @@ class NotificationListener:
         """处理通知消息"""
         try:
             self.message_count += 1
-            notification_data = json.loads(msg.data.decode())
+            notification_data = codec.decode(msg.data, msg.headers)
             
             logger.info(f"🔔 收到通知消息 #{self.message_count}")
             
@@ -125,7 +130,7 @@ class NotificationListener:
             
         except Exception as e:
             logger.error(f"处理通知消息失败: {e}")
-            logger.error(f"原始消息: {msg.data.decode()[:500]}...")
+            logger.error(f"原始消息: {msg.data[:500]!r}...")
     
     def _validate_notification_structure(self, notification_data: dict):
         """验证通知消息结构"""
@@ -162,7 +167,6 @@ async def main():
     return 0
 
 if __name__ == '__main__':
-    import sys
     try:
         exit_code = asyncio.run(main())
         sys.exit(exit_code)
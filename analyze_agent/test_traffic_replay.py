@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试流量录制与回放
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from main import AnalyzeAgent, Config
+from traffic_replay import (TrafficRecord, TrafficWriter, _dispatch, paced, prepare_replay_dedup_config,
+                            read_traffic, select_window, traffic_summary)
+
+def _message(message_id: int, source: str = 'telegram') -> bytes:
+    return json.dumps({'source': source, 'data': {'message_id': message_id, 'text': f'BTC 消息 {message_id}'}},
+                      ensure_ascii=False).encode()
+
+def test_round_trip():
+    """录制文件保留时间戳、subject、消息头，非 UTF-8 消息体也能还原"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'traffic.jsonl.gz')
+        writer = TrafficWriter(path, ['telegram.messages', 'twitter.messages'])
+        writer.write('telegram.messages', _message(1), offset=0.0)
+        writer.write('twitter.messages', _message(2, 'twitter'), {'X-Source': 'twitter'}, offset=0.25)
+        writer.write('telegram.messages', b'\xff\xfe', offset=1.5)
+        writer.close()
+        
+        header, records = read_traffic(path)
+        records = list(records)
+    
+    assert header['subjects'] == ['telegram.messages', 'twitter.messages'], header
+    assert [r.offset for r in records] == [0.0, 0.25, 1.5]
+    assert records[1] == TrafficRecord(0.25, 'twitter.messages', _message(2, 'twitter'), {'X-Source': 'twitter'})
+    assert records[2].payload == b'\xff\xfe' and records[2].headers is None
+    print("✅ 录制文件读写")
+
+def test_window_and_summary():
+    """按时间段截取后偏移量从 0 开始，统计能找到峰值秒和峰值分钟"""
+    # 前 100 秒每 10 秒一条，第 100 秒突发 30 条
+    records = [TrafficRecord(float(i * 10), 'telegram.messages', b'x') for i in range(10)]
+    records += [TrafficRecord(100 + i * 0.01, 'telegram.messages', b'x') for i in range(30)]
+    records += [TrafficRecord(200.0, 'twitter.messages', b'x')]
+    
+    summary = traffic_summary(records)
+    assert summary['messages'] == 41 and summary['subjects']['twitter.messages'] == 1
+    assert summary['peak_second'] == {'offset_s': 100, 'messages': 30}, summary['peak_second']
+    assert summary['peak_minute'] == {'offset_s': 50, 'messages': 35}, summary['peak_minute']
+    
+    window = list(select_window(records, start=95, end=150))
+    assert len(window) == 30 and window[0].offset == 5.0, window[:1]
+    print("✅ 时间段截取和峰值统计")
+
+async def _sent_times(records, speed):
+    times = []
+    async for record, scheduled in paced(records, speed):
+        times.append(time.monotonic())
+    return times
+
+def test_paced_preserves_burstiness():
+    """10× 回放时间隔缩小 10 倍，突发内的消息仍然连续发送；max 不等待"""
+    records = [TrafficRecord(offset, 'telegram.messages', b'x') for offset in (0.0, 0.01, 0.02, 2.0, 2.01)]
+    
+    times = asyncio.run(_sent_times(records, 10.0))
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert gaps[0] < 0.02 and gaps[1] < 0.02 and gaps[3] < 0.02, gaps
+    assert 0.15 < gaps[2] < 0.3, gaps
+    
+    times = asyncio.run(_sent_times(records, None))
+    assert times[-1] - times[0] < 0.05, times
+    print("✅ 按倍速回放保留突发特征")
+
+def test_dispatch_queues_per_subject():
+    """同一 subject 顺序处理，不同 subject 并发；突发时延迟包含排队时间"""
+    handled = []
+    
+    async def handler(record):
+        await asyncio.sleep(0.05)
+        handled.append((record.subject, record.payload))
+    
+    records = [TrafficRecord(0.0, 'telegram.messages', str(i).encode()) for i in range(4)]
+    records.append(TrafficRecord(0.0, 'twitter.messages', b't'))
+    stats = asyncio.run(_dispatch(records, None, handler))
+    
+    assert [p for s, p in handled if s == 'telegram.messages'] == [b'0', b'1', b'2', b'3'], handled
+    assert handled.index(('twitter.messages', b't')) < 2, handled
+    report = stats.report()
+    assert report['messages'] == 5 and report['max_backlog'] >= 4, report
+    assert report['latency_ms']['max'] >= 190, report['latency_ms']
+    print("✅ 按 subject 顺序处理并统计排队延迟")
+
+def test_replay_forces_local_dedup():
+    """离线回放不连接 NATS，remote 去重后端改为进程内去重器，缓存文件使用临时文件"""
+    config = Config.__new__(Config)
+    config.config = {'deduplication': {'enabled': True, 'backend': 'remote', 'cache_file': 'data/message_cache.pkl',
+                                       'remote': {'subject': 'dedup.check'}}}
+    agent = AnalyzeAgent.__new__(AnalyzeAgent)
+    agent.config = config
+    
+    prepare_replay_dedup_config(config.get_deduplication_config(), argparse.Namespace(dedup_cache=None))
+    dedup_config = config.get_deduplication_config()
+    assert agent._dedup_backend() == 'local', dedup_config
+    assert dedup_config['cache_file'] != 'data/message_cache.pkl', dedup_config
+    
+    prepare_replay_dedup_config(dedup_config, argparse.Namespace(dedup_cache='replay.pkl'))
+    assert dedup_config['cache_file'] == 'replay.pkl'
+    assert prepare_replay_dedup_config({}, argparse.Namespace(dedup_cache=None)) == {}
+    print("✅ 回放使用进程内去重器")
+
+if __name__ == '__main__':
+    try:
+        test_round_trip()
+        test_window_and_summary()
+        test_paced_preserves_burstiness()
+        test_dispatch_queues_per_subject()
+        test_replay_forces_local_dedup()
+        print("\n🎉 所有流量回放测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+NATS 流量录制与回放
+把生产环境的 telegram.messages / twitter.messages 录制为带时间戳的 gzip JSONL 文件，
+再按 1×、10× 或最大速度回放，用于离线复现真实的突发流量（例如 FOMC 公布时的一分钟）
+
+用法:
+    python traffic_replay.py record -o traffic.jsonl.gz --duration 3600
+    python traffic_replay.py info traffic.jsonl.gz
+    python traffic_replay.py replay traffic.jsonl.gz --speed 10 --target nats
+    python traffic_replay.py replay traffic.jsonl.gz --speed max --target dedup --start 120 --end 180
+
+回放按录制时的到达间隔 / speed 调度（相对开始时间的绝对时刻，不累积误差），保留原始流量的突发特征
+
+文件格式（每行一个 JSON 对象）:
+    第一行: {"version": 1, "recorded_at": "...", "subjects": [...]}
+    之后:   {"t": 相对录制开始的秒数, "s": subject, "p": 消息体, "h": NATS 头（可选）}
+    消息体不是 UTF-8 时使用 "b": base64 代替 "p"
+"""
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import yaml
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DEFAULT_SUBJECTS = ['telegram.messages', 'twitter.messages']
+
+@dataclass
+class TrafficRecord:
+    """一条录制的消息"""
+    offset: float
+    subject: str
+    payload: bytes
+    headers: Optional[Dict[str, str]] = None
+
+class TrafficWriter:
+    """录制文件写入器"""
+    
+    def __init__(self, path: str, subjects: List[str]):
+        self.path = path
+        self.file = gzip.open(path, 'wb')
+        self.start_time = time.monotonic()
+        self.count = 0
+        self._write_line({
+            'version': FORMAT_VERSION,
+            'recorded_at': datetime.now().isoformat(),
+            'subjects': subjects
+        })
+    
+    def write(self, subject: str, payload: bytes, headers: Optional[Dict[str, str]] = None,
+              offset: Optional[float] = None):
+        """写入一条消息，offset 默认取当前时间相对录制开始的秒数"""
+        if offset is None:
+            offset = time.monotonic() - self.start_time
+        line = {'t': round(offset, 6), 's': subject}
+        try:
+            line['p'] = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            line['b'] = base64.b64encode(payload).decode('ascii')
+        if headers:
+            line['h'] = dict(headers)
+        self._write_line(line)
+        self.count += 1
+    
+    def _write_line(self, data: Dict[str, Any]):
+        self.file.write(codec.dumps(data) + b'\n')
+    
+    def close(self):
+        self.file.close()
+
+def read_traffic(path: str) -> Tuple[Dict[str, Any], Iterator[TrafficRecord]]:
+    """
+    读取录制文件
+    
+    Returns:
+        (文件头, 按时间顺序的消息迭代器)
+    """
+    file = gzip.open(path, 'rb')
+    header = codec.loads(file.readline())
+    if header.get('version') != FORMAT_VERSION:
+        file.close()
+        raise ValueError(f"不支持的录制文件版本: {header.get('version')}")
+    
+    def records() -> Iterator[TrafficRecord]:
+        with file:
+            for line in file:
+                if not line.strip():
+                    continue
+                data = codec.loads(line)
+                payload = data['p'].encode('utf-8') if 'p' in data else base64.b64decode(data['b'])
+                yield TrafficRecord(data['t'], data['s'], payload, data.get('h'))
+    
+    return header, records()
+
+def select_window(records: Iterable[TrafficRecord], start: float = 0.0,
+                  end: Optional[float] = None) -> Iterator[TrafficRecord]:
+    """只保留 [start, end) 时间段内的消息，偏移量改为相对 start"""
+    for record in records:
+        if record.offset < start:
+            continue
+        if end is not None and record.offset >= end:
+            break
+        yield TrafficRecord(record.offset - start, record.subject, record.payload, record.headers)
+
+async def paced(records: Iterable[TrafficRecord], speed: Optional[float]) -> AsyncIterator[Tuple[TrafficRecord, float]]:
+    """
+    按录制时间间隔回放
+    
+    Args:
+        records: 录制的消息
+        speed: 回放倍速，None 表示不等待（最大速度）
+    
+    Yields:
+        (消息, 计划发送时刻 time.monotonic)
+    """
+    start_time = time.monotonic()
+    for record in records:
+        if speed is None:
+            yield record, time.monotonic()
+            continue
+        scheduled = start_time + record.offset / speed
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield record, scheduled
+
+def traffic_summary(records: Iterable[TrafficRecord]) -> Dict[str, Any]:
+    """统计消息数、时长、各 subject 数量和峰值速率"""
+    count = 0
+    total_bytes = 0
+    duration = 0.0
+    subjects = Counter()
+    per_second = Counter()
+    for record in records:
+        count += 1
+        total_bytes += len(record.payload)
+        duration = record.offset
+        subjects[record.subject] += 1
+        per_second[int(record.offset)] += 1
+    
+    peak_second, peak_count = max(per_second.items(), key=lambda item: item[1]) if per_second else (0, 0)
+    # 连续 60 秒窗口内的最大消息数，用于定位突发分钟
+    peak_minute_start, peak_minute_count = 0, 0
+    seconds = sorted(per_second)
+    window_count = 0
+    left = 0
+    for second in seconds:
+        window_count += per_second[second]
+        while seconds[left] <= second - 60:
+            window_count -= per_second[seconds[left]]
+            left += 1
+        if window_count > peak_minute_count:
+            peak_minute_start, peak_minute_count = seconds[left], window_count
+    
+    return {
+        'messages': count,
+        'bytes': total_bytes,
+        'duration_s': duration,
+        'avg_rate': count / duration if duration > 0 else float(count),
+        'subjects': dict(subjects),
+        'peak_second': {'offset_s': peak_second, 'messages': peak_count},
+        'peak_minute': {'offset_s': peak_minute_start, 'messages': peak_minute_count}
+    }
+
+def percentile(ordered: List[float], q: float) -> float:
+    """已排序列表的分位数（最近秩）"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class ReplayMessage:
+    """回放消息，提供 AnalyzeAgent 消息回调使用的 nats Msg 属性"""
+    
+    __slots__ = ('subject', 'data', 'headers')
+    
+    def __init__(self, subject: str, data: bytes, headers: Optional[Dict[str, str]] = None):
+        self.subject = subject
+        self.data = data
+        self.headers = headers
+
+class NotificationSink:
+    """
+    离线回放时替代 AnalyzeAgent 的 NATS 连接
+    统计发出的通知，可选把它们录制为同格式文件（之后可以回放给 notification）
+    """
+    
+    def __init__(self, writer: Optional[TrafficWriter] = None):
+        self.writer = writer
+        self.count = 0
+        self.bytes = 0
+    
+    async def publish(self, subject: str, payload: bytes = b'', reply: str = '', headers: Optional[Dict[str, str]] = None):
+        self.count += 1
+        self.bytes += len(payload)
+        if self.writer:
+            self.writer.write(subject, payload, headers)
+    
+    async def flush(self, timeout: int = 10):
+        pass
+    
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+
+def load_config(config_file: str) -> Dict[str, Any]:
+    with open(config_file, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+async def record(args: argparse.Namespace):
+    """订阅 NATS 并录制消息，到达 --duration / --max-messages 或收到 Ctrl+C 时结束"""
+    # 只有录制和回放到 NATS 需要 nats-py，离线回放不需要
+    import nats
+    
+    nats_config = load_config(args.config).get('nats', {}) if Path(args.config).exists() else {}
+    servers = args.servers or nats_config.get('servers', ['nats://localhost:4222'])
+    subjects = args.subjects or DEFAULT_SUBJECTS
+    
+    nats_client = await nats.connect(servers=servers)
+    writer = TrafficWriter(args.output, subjects)
+    done = asyncio.Event()
+    
+    async def on_message(msg):
+        writer.write(msg.subject, msg.data, msg.headers)
+        if args.max_messages and writer.count >= args.max_messages:
+            done.set()
+    
+    for subject in subjects:
+        await nats_client.subscribe(subject, cb=on_message)
+    
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGINT, done.set)
+    loop.add_signal_handler(signal.SIGTERM, done.set)
+    logger.info(f"开始录制 {subjects} → {args.output}，按 Ctrl+C 停止")
+    
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.duration)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await nats_client.drain()
+        writer.close()
+    logger.info(f"录制完成: {writer.count} 条消息，{time.monotonic() - writer.start_time:.1f}s")
+
+class _ReplayStats:
+    """回放统计: 从计划发送时刻到处理完成的延迟"""
+    
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.start_time = time.monotonic()
+        self.max_backlog = 0
+    
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.start_time
+        ordered = sorted(self.latencies)
+        return {
+            'messages': len(ordered),
+            'elapsed_s': elapsed,
+            'throughput_per_sec': len(ordered) / elapsed if elapsed > 0 else 0.0,
+            'latency_ms': {
+                'p50': percentile(ordered, 0.50) * 1000,
+                'p95': percentile(ordered, 0.95) * 1000,
+                'p99': percentile(ordered, 0.99) * 1000,
+                'max': (ordered[-1] if ordered else 0.0) * 1000
+            },
+            'max_backlog': self.max_backlog
+        }
+
+async def replay_to_nats(records: Iterable[TrafficRecord], args: argparse.Namespace) -> Dict[str, Any]:
+    """按录制节奏发布到 NATS（可以用 --subject-map 改写 subject，避免打到生产订阅者）"""
+    import nats
+    
+    nats_config = load_config(args.config).get('nats', {}) if Path(args.config).exists() else {}
+    servers = args.servers or nats_config.get('servers', ['nats://localhost:4222'])
+    subject_map = dict(item.split('=', 1) for item in args.subject_map)
+    
+    nats_client = await nats.connect(servers=servers)
+    stats = _ReplayStats()
+    try:
+        async for record, scheduled in paced(records, args.speed):
+            subject = subject_map.get(record.subject, record.subject)
+            await nats_client.publish(subject, record.payload, headers=record.headers)
+            stats.latencies.append(time.monotonic() - scheduled)
+        await nats_client.flush()
+    finally:
+        await nats_client.close()
+    return stats.report()
+
+async def _dispatch(records: Iterable[TrafficRecord], speed: Optional[float], handler) -> _ReplayStats:
+    """
+    按 subject 分队列顺序处理（与 nats-py 每个订阅顺序执行回调一致），
+    延迟包含排队时间，能反映突发时的积压
+    """
+    stats = _ReplayStats()
+    queues: Dict[str, asyncio.Queue] = {}
+    workers: List[asyncio.Task] = []
+    
+    async def worker(queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record, scheduled = item
+            await handler(record)
+            stats.latencies.append(time.monotonic() - scheduled)
+    
+    async for record, scheduled in paced(records, speed):
+        queue = queues.get(record.subject)
+        if queue is None:
+            queue = queues[record.subject] = asyncio.Queue()
+            workers.append(asyncio.create_task(worker(queue)))
+        queue.put_nowait((record, scheduled))
+        stats.max_backlog = max(stats.max_backlog, sum(q.qsize() for q in queues.values()))
+        if speed is None:
+            # 最大速度下让出事件循环，避免先把整个文件读入队列
+            await asyncio.sleep(0)
+    
+    for queue in queues.values():
+        queue.put_nowait(None)
+    await asyncio.gather(*workers)
+    return stats
+
+async def replay_to_agent(records: Iterable[TrafficRecord], args: argparse.Namespace) -> Dict[str, Any]:
+    """离线回放给进程内的 AnalyzeAgent（LLM 和去重按 config.yml 配置），通知不发到 NATS"""
+    from main import AnalyzeAgent
+    
+    agent = AnalyzeAgent(args.config)
+    prepare_replay_dedup_config(agent.config.get_deduplication_config(), args)
+    await agent.initialize_deduplicator()
+    sink = NotificationSink(TrafficWriter(args.notifications, [agent.config.get_nats_config().get(
+        'notification_subject', 'messages.notification')]) if args.notifications else None)
+    agent.nats_client = sink
+    
+    try:
+        stats = await _dispatch(records, args.speed,
+                                lambda record: agent._message_handler(ReplayMessage(record.subject, record.payload, record.headers)))
+    finally:
+        await sink.close()
+    
+    report = stats.report()
+    report['notifications'] = {'count': sink.count, 'bytes': sink.bytes}
+    if agent.deduplicator:
+        report['deduplication'] = agent.deduplicator.get_stats()
+    return report
+
+async def replay_to_dedup(records: Iterable[TrafficRecord], args: argparse.Namespace) -> Dict[str, Any]:
+    """只回放给去重器（不调用 LLM），测试突发流量下的去重延迟和命中率"""
+    from deduplication import MessageDeduplicator
+    
+    dedup_config = load_config(args.config).get('deduplication', {})
+    deduplicator = MessageDeduplicator(
+        model_name=dedup_config.get('model_name', 'BAAI/bge-m3'),
+        similarity_threshold=dedup_config.get('similarity_threshold', 0.85),
+        time_window_hours=dedup_config.get('time_window_hours', 2),
+        max_cache_size=dedup_config.get('max_cache_size', 10000),
+        # 不读写生产缓存文件
+        cache_file=replay_cache_file(args)
+    )
+    await deduplicator.initialize()
+    
+    async def handle(record: TrafficRecord):
+        await deduplicator.check_and_add(codec.decode(record.payload, record.headers))
+    
+    stats = await _dispatch(records, args.speed, handle)
+    report = stats.report()
+    report['deduplication'] = {k: v for k, v in deduplicator.get_stats().items()
+                               if isinstance(v, (int, float, str, bool))}
+    return report
+
+def prepare_replay_dedup_config(dedup_config: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """离线回放的去重配置: 使用临时缓存文件，远程去重改为进程内去重器
+    
+    回放不连接 NATS，RemoteDeduplicator 的请求全部失败并按"不重复"放行，
+    去重实际被关闭而报告仍显示去重统计，所以强制使用 local 后端
+    """
+    if not dedup_config:
+        return dedup_config
+    # 不读写生产缓存文件
+    dedup_config['cache_file'] = replay_cache_file(args)
+    if dedup_config.get('backend', 'local') == 'remote':
+        logger.warning("离线回放不连接 NATS，远程去重改用进程内去重器")
+        dedup_config['backend'] = 'local'
+    return dedup_config
+
+def replay_cache_file(args: argparse.Namespace) -> str:
+    """回放使用的去重缓存文件，默认每次回放使用新的临时文件"""
+    return args.dedup_cache or str(Path(tempfile.mkdtemp(prefix='replay-dedup-')) / 'message_cache.pkl')
+
+REPLAY_TARGETS = {
+    'nats': replay_to_nats,
+    'agent': replay_to_agent,
+    'dedup': replay_to_dedup
+}
+
+async def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    header, records = read_traffic(args.file)
+    records = select_window(records, args.start, args.end)
+    if args.subjects:
+        records = (r for r in records if r.subject in args.subjects)
+    
+    speed_label = '最大速度' if args.speed is None else f'{args.speed:g}×'
+    logger.info(f"回放 {args.file}（录制于 {header.get('recorded_at')}）→ {args.target}，{speed_label}")
+    return await REPLAY_TARGETS[args.target](records, args)
+
+def parse_speed(value: str) -> Optional[float]:
+    """'max' 表示不等待，否则为倍速"""
+    if value.lower() == 'max':
+        return None
+    speed = float(value.rstrip('xX×'))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("倍速必须大于 0")
+    return speed
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='NATS 流量录制与回放')
+    parser.add_argument('--config', default='config.yml', help='analyze_agent 配置文件（NATS 地址、LLM 和去重配置）')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    record_parser = commands.add_parser('record', help='录制 NATS 消息')
+    record_parser.add_argument('-o', '--output', required=True, help='输出文件（.jsonl.gz）')
+    record_parser.add_argument('--subjects', nargs='+', help=f'录制的 subject，默认 {DEFAULT_SUBJECTS}')
+    record_parser.add_argument('--servers', nargs='+', help='NATS 服务器，默认使用配置文件')
+    record_parser.add_argument('--duration', type=float, help='录制时长（秒）')
+    record_parser.add_argument('--max-messages', type=int, help='录制消息数上限')
+    
+    info_parser = commands.add_parser('info', help='查看录制文件的统计和峰值')
+    info_parser.add_argument('file')
+    
+    replay_parser = commands.add_parser('replay', help='回放录制文件')
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--speed', type=parse_speed, default=1.0, help='回放倍速，例如 1、10 或 max')
+    replay_parser.add_argument('--target', choices=sorted(REPLAY_TARGETS), default='nats',
+                               help='nats: 发布到 NATS; agent: 进程内 AnalyzeAgent; dedup: 只测试去重器')
+    replay_parser.add_argument('--start', type=float, default=0.0, help='从录制的第几秒开始')
+    replay_parser.add_argument('--end', type=float, help='到录制的第几秒结束')
+    replay_parser.add_argument('--subjects', nargs='+', help='只回放这些 subject')
+    replay_parser.add_argument('--servers', nargs='+', help='NATS 服务器（target=nats），默认使用配置文件')
+    replay_parser.add_argument('--subject-map', nargs='*', default=[], metavar='FROM=TO',
+                               help='发布时改写 subject（target=nats），例如 telegram.messages=replay.telegram')
+    replay_parser.add_argument('--notifications', help='target=agent 时把生成的通知录制到该文件')
+    replay_parser.add_argument('--dedup-cache', help='回放使用的去重缓存文件，默认使用空的临时文件')
+    replay_parser.add_argument('--output', help='回放结果 JSON 文件')
+    
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    if args.command == 'record':
+        asyncio.run(record(args))
+        return
+    
+    if args.command == 'info':
+        header, records = read_traffic(args.file)
+        report = {'header': header, **traffic_summary(records)}
+    else:
+        report = asyncio.run(replay(args))
+    
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=codec.default))
+    if getattr(args, 'output', None):
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=codec.default)
+
+if __name__ == '__main__':
+    main()
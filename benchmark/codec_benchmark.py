@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+消息序列化性能测试
+比较标准库 json、orjson 和 msgpack（common.codec 的两种线上格式）在流水线实际消息上的
+消息体大小和编码、解码耗时:
+  telegram         telegramstream 发布的消息，extracted_data 中带两个完整的 CoinGecko 币种对象
+  notification     analyze_agent full 格式的通知（原始消息 + 分析结果 + 去重统计，统计中有 numpy 类型）
+  compact          analyze_agent compact 格式的通知
+也可以用 traffic_replay.py 录制的文件测试真实流量（--traffic）
+
+用法:
+    python benchmark/codec_benchmark.py
+    python benchmark/codec_benchmark.py --traffic traffic.jsonl.gz --limit 5000 --output codec.json
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCHMARK_DIR.parent
+sys.path.append(str(REPO_ROOT))
+sys.path.append(str(REPO_ROOT / 'analyze_agent'))
+
+from common import codec
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def coingecko_coin(coin_id: str, symbol: str, name: str, price: float, rank: int) -> Dict[str, Any]:
+    """CoinGecko /coins/markets 返回的单个币种对象（字段与 telegramstream/message.md 一致）"""
+    return {
+        'id': coin_id,
+        'symbol': symbol,
+        'name': name,
+        'image': f'https://coin-images.coingecko.com/coins/images/{rank}/large/{coin_id}.png',
+        'current_price': price,
+        'market_cap': int(price * 120442405),
+        'market_cap_rank': rank,
+        'fully_diluted_valuation': int(price * 120442405),
+        'total_volume': 15234567890,
+        'high_24h': price * 1.018,
+        'low_24h': price * 0.982,
+        'price_change_24h': price * 0.0205,
+        'price_change_percentage_24h': 2.05,
+        'market_cap_change_24h': 5432109876,
+        'market_cap_change_percentage_24h': 2.05,
+        'circulating_supply': 120442405.374,
+        'total_supply': 120442405.374,
+        'max_supply': None,
+        'ath': price * 2.17,
+        'ath_change_percentage': -53.85,
+        'ath_date': '2021-11-10T14:24:19.604Z',
+        'atl': 0.432979,
+        'atl_change_percentage': 519673.67,
+        'atl_date': '2015-10-20T00:00:00.000Z',
+        'roi': {'times': 86.8168, 'currency': 'eth', 'percentage': 8681.68},
+        'last_updated': '2024-12-23T10:30:00.000Z'
+    }
+
+def telegram_message(message_id: int = 12345) -> Dict[str, Any]:
+    text = '🚀 ETH 突破 2250 美元关键阻力位，BTC 同步走强，链上大额转账明显增加，市场情绪持续升温 #ETH #BTC'
+    return {
+        'type': 'telegram.message',
+        'timestamp': 1734567890123,
+        'source': 'telegram',
+        'sender': 'telegramstream',
+        'data': {
+            'message_id': message_id,
+            'chat_id': -1001234567890,
+            'chat_title': 'Crypto Signals 中文频道',
+            'chat_type': 'channel',
+            'user_id': 123456789,
+            'username': 'crypto_trader',
+            'first_name': 'John',
+            'is_bot': False,
+            'date': 1734567890123,
+            'text': text,
+            'raw_text': text[2:],
+            'reply_to_message_id': None,
+            'forward_from_chat_id': None,
+            'entities': [{'type': 'text_link', 'offset': 50, 'length': 10,
+                          'url': 'https://dexscreener.com/ethereum/0x1234567890abcdef'}],
+            'media': None,
+            'extracted_data': {
+                'addresses': {'ethereum': ['0x1234567890abcdef1234567890abcdef12345678'], 'solana': [], 'bitcoin': []},
+                'symbols': ['ETH', 'BTC'],
+                'crypto_currencies': [
+                    coingecko_coin('ethereum', 'eth', 'Ethereum', 2250.50, 2),
+                    coingecko_coin('bitcoin', 'btc', 'Bitcoin', 97500.25, 1)
+                ],
+                'urls': [{'url': 'https://dexscreener.com/ethereum/0x1234567890abcdef', 'domain': 'dexscreener.com',
+                          'type': 'dex_tracker'}],
+                'prices': [{'price': 2250.5, 'currency': 'USD'}],
+                'keywords': ['突破', '阻力位', '走强'],
+                'sentiment': 'positive',
+                'raw_text': text[2:]
+            }
+        }
+    }
+
+def _number(value: float, kind: str = 'float'):
+    """去重器返回的统计和相似度是 numpy 类型（没有安装 numpy 时使用 Python 类型）"""
+    if np is None:
+        return value
+    return np.float32(value) if kind == 'float' else np.int64(value)
+
+def analysis_results() -> Dict[str, Any]:
+    return {
+        'analysis_results': [{
+            'agent_name': '情绪分析Agent',
+            'agent_type': 'sentiment_analysis',
+            'result': {
+                'sentiment': '利多',
+                'reason': 'ETH 放量突破关键阻力位，BTC 同步走强，短期资金持续流入，市场情绪偏乐观',
+                'score': 0.72,
+                'analysis_time': '2024-12-23T10:30:02.512345',
+                'llm_provider': 'deepseek',
+                'processing_time': 1834
+            },
+            'processing_time_ms': 1834,
+            'llm_provider': 'deepseek',
+            'analysis_time': '2024-12-23T10:30:02.512345'
+        }],
+        'summary': {
+            'total_agents': 1,
+            'successful_analyses': 1,
+            'failed_analyses': 0,
+            'overall_sentiment': '利多',
+            'overall_score': 0.72,
+            'processing_start_time': '2024-12-23T10:30:00.678000Z',
+            'processing_end_time': '2024-12-23T10:30:02.512000Z',
+            'total_processing_time_ms': 1834
+        }
+    }
+
+def full_notification() -> Dict[str, Any]:
+    return {
+        'type': 'messages.notification',
+        'timestamp': 1734567892600,
+        'source': 'analyze_agent',
+        'sender': 'analyze_agent',
+        'data': {
+            'original_message': telegram_message(),
+            **analysis_results(),
+            'deduplication_stats': {
+                'total_messages': _number(18234, 'int'),
+                'duplicates_found': _number(2931, 'int'),
+                'cache_hits': 412,
+                'cache_misses': 15303,
+                'cache_size': 9876,
+                'active_messages_in_window': 1204,
+                'time_window_hours': 2,
+                'similarity_threshold': _number(0.85),
+                'model_name': 'BAAI/bge-m3',
+                'vector_dimension': 1024
+            }
+        }
+    }
+
+def compact_notification() -> Dict[str, Any]:
+    message = telegram_message()
+    data = message['data']
+    results = analysis_results()
+    return {
+        'type': 'messages.notification',
+        'timestamp': 1734567892600,
+        'source': 'analyze_agent',
+        'sender': 'analyze_agent',
+        'data': {
+            'ref_id': 'telegram:-1001234567890:12345',
+            'original_message': {
+                'source': 'telegram',
+                'type': message['type'],
+                'data': {
+                    'message_id': data['message_id'],
+                    'chat_id': data['chat_id'],
+                    'chat_title': data['chat_title'],
+                    'username': data['username'],
+                    'date': data['date'],
+                    'raw_text': data['raw_text'],
+                    'extracted_data': {'symbols': data['extracted_data']['symbols']}
+                }
+            },
+            'analysis_results': [{'agent_type': 'sentiment_analysis',
+                                  'result': {k: v for k, v in results['analysis_results'][0]['result'].items()
+                                             if k in ('sentiment', 'reason', 'score')}}],
+            'summary': {k: results['summary'][k] for k in ('overall_sentiment', 'overall_score')}
+        }
+    }
+
+def sample_payloads() -> Dict[str, Any]:
+    """流水线中的典型消息"""
+    return {'telegram': telegram_message(), 'notification': full_notification(), 'compact': compact_notification()}
+
+def stdlib_dumps(value: Any) -> bytes:
+    """各服务原来的写法: 标准库 json，numpy 类型需要先转换"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=codec.default).encode()
+
+def _per_op_us(function: Callable[[Any], Any], items: List[Any], min_seconds: float) -> float:
+    """重复执行直到累计 min_seconds，返回每次调用的平均微秒数"""
+    rounds, elapsed = 0, 0.0
+    while elapsed < min_seconds:
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed += time.perf_counter() - start
+        rounds += 1
+    return elapsed / (rounds * len(items)) * 1e6
+
+def _avg_bytes(encoded: List[bytes]) -> float:
+    return sum(len(data) for data in encoded) / len(encoded)
+
+def measure(name: str, objects: List[Any], min_seconds: float) -> Dict[str, Any]:
+    """同一组对象分别用标准库、orjson 和 msgpack 编码、解码"""
+    encoded = [stdlib_dumps(obj) for obj in objects]
+    result = {
+        'payload': name,
+        'messages': len(objects),
+        'avg_bytes': _avg_bytes(encoded),
+        'json': {
+            'encode_us': _per_op_us(stdlib_dumps, objects, min_seconds),
+            'decode_us': _per_op_us(json.loads, encoded, min_seconds)
+        }
+    }
+    if codec.ORJSON_AVAILABLE:
+        result['orjson'] = {
+            'encode_us': _per_op_us(codec.dumps, objects, min_seconds),
+            'decode_us': _per_op_us(codec.loads, encoded, min_seconds)
+        }
+    if codec.MSGPACK_AVAILABLE:
+        packed = [codec.encode(obj, codec.FORMAT_MSGPACK) for obj in objects]
+        headers = codec.content_headers(codec.FORMAT_MSGPACK)
+        result['msgpack'] = {
+            'avg_bytes': _avg_bytes(packed),
+            'encode_us': _per_op_us(lambda obj: codec.encode(obj, codec.FORMAT_MSGPACK), objects, min_seconds),
+            'decode_us': _per_op_us(lambda data: codec.decode(data, headers), packed, min_seconds)
+        }
+    return result
+
+def load_traffic(path: str, limit: int) -> Dict[str, List[Any]]:
+    """读取录制文件，按 subject 分组的消息对象（按录制的 Content-Type 头解码，JSON 和 msgpack 都可以）"""
+    from traffic_replay import read_traffic
+    
+    _, records = read_traffic(path)
+    grouped: Dict[str, List[Any]] = {}
+    for index, record in enumerate(records):
+        if limit and index >= limit:
+            break
+        try:
+            grouped.setdefault(record.subject, []).append(codec.decode(record.payload, record.headers))
+        except codec.DecodeError:
+            continue
+    return grouped
+
+def print_result(result: Dict[str, Any]):
+    line = (f"{result['payload']:<28} {result['messages']:>6} 条  {result['avg_bytes']:>8.0f} B  "
+            f"json 编码 {result['json']['encode_us']:>7.1f}µs 解码 {result['json']['decode_us']:>7.1f}µs")
+    if 'orjson' in result:
+        orjson_result = result['orjson']
+        line += (f"  orjson 编码 {orjson_result['encode_us']:>6.1f}µs 解码 {orjson_result['decode_us']:>6.1f}µs  "
+                 f"({result['json']['encode_us'] / orjson_result['encode_us']:.1f}x / "
+                 f"{result['json']['decode_us'] / orjson_result['decode_us']:.1f}x)")
+    if 'msgpack' in result:
+        msgpack_result = result['msgpack']
+        line += (f"  msgpack {msgpack_result['avg_bytes']:>8.0f} B ({msgpack_result['avg_bytes'] / result['avg_bytes']:.0%}) "
+                 f"编码 {msgpack_result['encode_us']:>6.1f}µs 解码 {msgpack_result['decode_us']:>6.1f}µs")
+    print(line)
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    print(f"codec 后端: {codec.BACKEND}，msgpack: {'有' if codec.MSGPACK_AVAILABLE else '无'}，"
+          f"numpy: {'有' if np is not None else '无'}")
+    if not codec.ORJSON_AVAILABLE:
+        print("⚠️  未安装 orjson，只测试标准库（pip install orjson）")
+    if not codec.MSGPACK_AVAILABLE:
+        print("⚠️  未安装 msgpack，不测试 msgpack 格式（pip install msgpack）")
+    
+    groups = {name: [payload] for name, payload in sample_payloads().items()}
+    if args.traffic:
+        groups.update({f"traffic:{subject}": objects for subject, objects in load_traffic(args.traffic, args.limit).items()})
+    
+    results = []
+    for name, objects in groups.items():
+        result = measure(name, objects, args.min_seconds)
+        results.append(result)
+        print_result(result)
+    return {'backend': codec.BACKEND, 'msgpack': codec.MSGPACK_AVAILABLE, 'results': results}
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='标准库 json、orjson 与 msgpack 的消息大小和序列化性能对比')
+    parser.add_argument('--traffic', help='traffic_replay.py 录制的文件，额外测试真实流量')
+    parser.add_argument('--limit', type=int, default=10000, help='最多读取的录制消息数，0 表示全部')
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='每项测试的最短累计时间（秒）')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 结果已写入 {args.output}")
+
+if __name__ == '__main__':
+    main()
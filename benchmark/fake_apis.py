@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+模拟外部 HTTP 接口（测试和性能测试用）
+- FakeLLM: OpenAI 兼容的 /v1/chat/completions，按配置的延迟返回固定的情绪分析结果
+- FakeBotAPI: Telegram Bot API 的 getMe / sendMessage，可选按 Telegram 的限制返回 429
+
+两者挂在同一个最小化的 asyncio HTTP/1.1 服务器上（支持 keep-alive 和 Content-Length 请求体）
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+# 处理函数: (path, headers, body) -> (status, 响应 JSON)
+Handler = Callable[[str, Dict[str, str], bytes], Awaitable[Tuple[int, Dict[str, Any]]]]
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 429: 'Too Many Requests'}
+
+class MiniHttpServer:
+    """最小化的 HTTP/1.1 服务器，按路径前缀分发到处理函数"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.routes: List[Tuple[str, Handler]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+    
+    def route(self, prefix: str, handler: Handler):
+        self.routes.append((prefix, handler))
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+    
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode().partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                
+                status, response = await self._dispatch(path, headers, body)
+                data = json.dumps(response, ensure_ascii=False).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'OK')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _dispatch(self, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        for prefix, handler in self.routes:
+            if path.startswith(prefix):
+                return await handler(path, headers, body)
+        return 404, {'error': f'no route for {path}'}
+
+def parse_body(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+    """解析 JSON 或表单请求体（python-telegram-bot 以表单发送参数）"""
+    if not body:
+        return {}
+    if 'json' in headers.get('content-type', ''):
+        return json.loads(body)
+    return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+
+class FakeLLM:
+    """
+    模拟 LLM 服务（OpenAI Chat Completions 接口）
+    
+    每个请求等待 latency ± jitter 秒后返回情绪分析 JSON，
+    concurrency 限制同时处理的请求数（模拟推理服务的容量），0 表示不限制
+    """
+    
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, concurrency: int = 0,
+                 sentiment: str = '利多', score: float = 0.8):
+        self.latency = latency
+        self.jitter = jitter
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+        self.content = json.dumps({'情绪': sentiment, '理由': '性能测试', '情绪评分': score}, ensure_ascii=False)
+        self.requests = 0
+    
+    def install(self, server: MiniHttpServer):
+        server.route('/v1/chat/completions', self.handle)
+    
+    async def handle(self, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        if self.semaphore:
+            async with self.semaphore:
+                await self._think()
+        else:
+            await self._think()
+        
+        self.requests += 1
+        request = parse_body(headers, body)
+        return 200, {
+            'id': f'chatcmpl-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        }
+    
+    async def _think(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        await asyncio.sleep(max(0.0, delay))
+
+class FakeBotAPI:
+    """
+    模拟 Telegram Bot API
+    
+    on_message(chat_id, text) 在每次 sendMessage 成功时调用。
+    enforce_limits 为 True 时按滑动窗口执行全局 30 条/秒、单群组 20 条/分钟的限制，超限返回 429
+    """
+    
+    def __init__(self, on_message: Optional[Callable[[str, str], None]] = None, enforce_limits: bool = False,
+                 global_limit: int = 30, chat_limit: int = 20):
+        self.on_message = on_message
+        self.enforce_limits = enforce_limits
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.global_window = deque()
+        self.chat_windows: Dict[str, deque] = {}
+        self.sent = 0
+        self.rejected = 0
+    
+    def install(self, server: MiniHttpServer):
+        server.route('/bot', self.handle)
+    
+    async def handle(self, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        method = path.rstrip('/').rsplit('/', 1)[-1]
+        params = parse_body(headers, body)
+        now = time.time()
+        
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}}
+        if method != 'sendMessage':
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        
+        chat_id = str(params.get('chat_id'))
+        retry_after = self._check_limits(chat_id, now) if self.enforce_limits else 0
+        if retry_after:
+            self.rejected += 1
+            return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {retry_after}',
+                         'parameters': {'retry_after': retry_after}}
+        
+        self.sent += 1
+        if self.on_message:
+            self.on_message(chat_id, params.get('text', ''))
+        return 200, {'ok': True, 'result': {
+            'message_id': self.sent,
+            'date': int(now),
+            'chat': {'id': int(chat_id) if chat_id.lstrip('-').isdigit() else 0, 'type': 'supergroup', 'title': 'bench'},
+            'text': params.get('text', '')
+        }}
+    
+    def _check_limits(self, chat_id: str, now: float) -> int:
+        chat_window = self.chat_windows.setdefault(chat_id, deque())
+        for window, period in ((self.global_window, 1.0), (chat_window, 60.0)):
+            while window and window[0] <= now - period:
+                window.popleft()
+        if len(self.global_window) >= self.global_limit:
+            return 1
+        if len(chat_window) >= self.chat_limit:
+            return max(1, int(chat_window[0] + 60.0 - now) + 1)
+        self.global_window.append(now)
+        chat_window.append(now)
+        return 0
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+进程内 NATS 服务器（测试和性能测试用）
+实现 NATS 客户端协议的核心子集: INFO/CONNECT/PING/PONG/SUB/UNSUB/PUB/HPUB/MSG/HMSG，
+支持 * 和 > 通配符、队列组和请求/响应（reply subject），可以直接用 nats-py 连接。
+不支持 JetStream、集群和鉴权
+
+可以注册 tap 回调观察经过服务器的消息，性能测试用它记录每个阶段的到达时间
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_PAYLOAD = 8 * 1024 * 1024
+
+def subject_matches(pattern: str, subject: str) -> bool:
+    """判断 subject 是否匹配订阅模式（支持 * 和 > 通配符）"""
+    pattern_tokens = pattern.split('.')
+    subject_tokens = subject.split('.')
+    for i, token in enumerate(pattern_tokens):
+        if token == '>':
+            return len(subject_tokens) > i
+        if i >= len(subject_tokens):
+            return False
+        if token != '*' and token != subject_tokens[i]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+class _Subscription:
+    __slots__ = ('client', 'sid', 'subject', 'queue', 'max_msgs', 'delivered')
+    
+    def __init__(self, client: '_Client', sid: str, subject: str, queue: Optional[str]):
+        self.client = client
+        self.sid = sid
+        self.subject = subject
+        self.queue = queue
+        self.max_msgs = 0
+        self.delivered = 0
+
+class _Client:
+    """一个客户端连接"""
+    
+    def __init__(self, server: 'MiniNatsServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cid: int):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.cid = cid
+        self.subs: Dict[str, _Subscription] = {}
+        self.headers = False
+        self.verbose = False
+        self.name = ''
+        self.closed = False
+    
+    def send(self, data: bytes):
+        if self.closed:
+            return
+        transport = self.writer.transport
+        if transport.get_write_buffer_size() > self.server.max_pending_bytes:
+            # 与 nats-server 一样断开慢消费者
+            logger.warning(f"客户端 {self.cid} ({self.name}) 缓冲超过上限，按慢消费者断开")
+            self.server.stats['slow_consumers'] += 1
+            self.writer.write(b"-ERR 'Slow Consumer'\r\n")
+            self.close()
+            return
+        self.writer.write(data)
+    
+    def deliver(self, sub: _Subscription, subject: str, reply: Optional[str], header: bytes, payload: bytes):
+        reply_part = f" {reply}" if reply else ''
+        if header and self.headers:
+            line = f"HMSG {subject} {sub.sid}{reply_part} {len(header)} {len(header) + len(payload)}\r\n"
+            self.send(line.encode() + header + payload + b"\r\n")
+        else:
+            line = f"MSG {subject} {sub.sid}{reply_part} {len(payload)}\r\n"
+            self.send(line.encode() + payload + b"\r\n")
+        self.server.stats['msgs_out'] += 1
+        
+        sub.delivered += 1
+        if sub.max_msgs and sub.delivered >= sub.max_msgs:
+            self.server._remove_sub(sub)
+    
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for sub in list(self.subs.values()):
+            self.server._remove_sub(sub)
+        self.writer.close()
+    
+    async def run(self):
+        info = {
+            'server_id': 'MINI_NATS', 'server_name': 'mini-nats', 'version': '2.10.0', 'proto': 1,
+            'go': 'python', 'host': self.server.host, 'port': self.server.port,
+            'headers': True, 'max_payload': MAX_PAYLOAD, 'client_id': self.cid
+        }
+        self.writer.write(f"INFO {json.dumps(info)}\r\n".encode())
+        try:
+            while not self.closed:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                await self._handle_line(line.rstrip(b'\r\n'))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.close()
+    
+    async def _handle_line(self, line: bytes):
+        if not line:
+            return
+        op, _, rest = line.partition(b' ')
+        op = op.upper()
+        args = rest.decode().split()
+        
+        if op == b'PUB':
+            size = int(args[-1])
+            data = await self.reader.readexactly(size + 2)
+            reply = args[1] if len(args) == 3 else None
+            self.server.route(args[0], reply, b'', data[:size])
+        elif op == b'HPUB':
+            header_size, total_size = int(args[-2]), int(args[-1])
+            data = await self.reader.readexactly(total_size + 2)
+            reply = args[1] if len(args) == 4 else None
+            self.server.route(args[0], reply, data[:header_size], data[header_size:total_size])
+        elif op == b'PING':
+            self.writer.write(b"PONG\r\n")
+            return
+        elif op == b'PONG':
+            return
+        elif op == b'SUB':
+            subject, sid = args[0], args[-1]
+            queue = args[1] if len(args) == 3 else None
+            sub = _Subscription(self, sid, subject, queue)
+            self.subs[sid] = sub
+            self.server._add_sub(sub)
+        elif op == b'UNSUB':
+            sub = self.subs.get(args[0])
+            if sub:
+                if len(args) > 1 and int(args[1]) > sub.delivered:
+                    sub.max_msgs = int(args[1])
+                else:
+                    self.server._remove_sub(sub)
+        elif op == b'CONNECT':
+            options = json.loads(rest or b'{}')
+            self.headers = bool(options.get('headers'))
+            self.verbose = bool(options.get('verbose'))
+            self.name = options.get('name', '')
+        else:
+            self.writer.write(b"-ERR 'Unknown Protocol Operation'\r\n")
+            return
+        
+        if self.verbose:
+            self.writer.write(b"+OK\r\n")
+
+class MiniNatsServer:
+    """
+    进程内 NATS 服务器
+    
+    用法:
+        server = MiniNatsServer(port=0)
+        await server.start()
+        ... nats.connect(server.url) ...
+        await server.stop()
+    """
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, max_pending_bytes: int = 64 * 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.max_pending_bytes = max_pending_bytes
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Dict[int, _Client] = {}
+        self._tasks = set()
+        self._subs: List[_Subscription] = []
+        self._next_cid = 0
+        self._taps: List[Tuple[str, Callable[[str, bytes, bytes], Any]]] = []
+        self.stats = {'msgs_in': 0, 'msgs_out': 0, 'bytes_in': 0, 'slow_consumers': 0}
+    
+    @property
+    def url(self) -> str:
+        return f"nats://{self.host}:{self.port}"
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"mini NATS 服务器已启动: {self.url}")
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        for client in list(self._clients.values()):
+            client.close()
+        # 等待连接处理协程读到 EOF 后退出
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+    
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._next_cid += 1
+        client = _Client(self, reader, writer, self._next_cid)
+        self._clients[client.cid] = client
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await client.run()
+        finally:
+            self._clients.pop(client.cid, None)
+            self._tasks.discard(task)
+    
+    def _add_sub(self, sub: _Subscription):
+        self._subs.append(sub)
+    
+    def _remove_sub(self, sub: _Subscription):
+        sub.client.subs.pop(sub.sid, None)
+        if sub in self._subs:
+            self._subs.remove(sub)
+    
+    def add_tap(self, pattern: str, callback: Callable[[str, bytes, bytes], Any]):
+        """注册观察回调 callback(subject, header, payload)，在消息路由前同步调用"""
+        self._taps.append((pattern, callback))
+    
+    def has_subscriber(self, subject: str) -> bool:
+        """是否有客户端订阅了 subject（用于等待服务启动完成）"""
+        return any(subject_matches(sub.subject, subject) for sub in self._subs)
+    
+    def subscriber_count(self, subject: str) -> int:
+        """订阅了 subject 的订阅数（队列组成员分别计数）"""
+        return sum(1 for sub in self._subs if subject_matches(sub.subject, subject))
+    
+    def route(self, subject: str, reply: Optional[str], header: bytes, payload: bytes):
+        """把一条消息投递给所有匹配的订阅，队列组中随机选择一个成员"""
+        self.stats['msgs_in'] += 1
+        self.stats['bytes_in'] += len(payload)
+        for pattern, callback in self._taps:
+            if subject_matches(pattern, subject):
+                callback(subject, header, payload)
+        
+        groups: Dict[str, List[_Subscription]] = {}
+        for sub in list(self._subs):
+            if not subject_matches(sub.subject, subject):
+                continue
+            if sub.queue:
+                groups.setdefault(sub.queue, []).append(sub)
+            else:
+                sub.client.deliver(sub, subject, reply, header, payload)
+        for members in groups.values():
+            sub = random.choice(members)
+            sub.client.deliver(sub, subject, reply, header, payload)
+
+def parse_headers(header: bytes) -> Dict[str, str]:
+    """解析 NATS/1.0 消息头"""
+    headers = {}
+    for line in header.decode(errors='ignore').split('\r\n')[1:]:
+        key, sep, value = line.partition(':')
+        if sep:
+            headers[key.strip()] = value.strip()
+    return headers
+
+async def _serve(host: str, port: int):
+    server = MiniNatsServer(host, port)
+    await server.start()
+    print(f"mini NATS 服务器运行中: {server.url}，按 Ctrl+C 停止")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logger.info(f"统计: {server.stats}, 客户端 {len(server._clients)}, 订阅 {len(server._subs)}")
+    finally:
+        await server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='进程内 NATS 服务器（测试用）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4222)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
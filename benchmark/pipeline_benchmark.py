@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+端到端流水线性能测试
+启动进程内 NATS 服务器、模拟 LLM 和模拟 Telegram Bot API，以子进程运行 analyze_agent 和 notification，
+按配置的速率发布 telegramstream 格式的消息，输出各阶段延迟 (p50/p95/p99) 和最大可持续吞吐量
+
+阶段:
+  publish    驱动器发布 → 消息到达 NATS（telegramstream 的 NatsPublisher 批量 flush）
+  analyze    messages.stream 到达 → messages.notification 到达（analyze_agent，含 LLM 延迟）
+  notify     messages.notification 到达 → Bot API 收到所有群组的 sendMessage（notification）
+  end_to_end 驱动器发布 → Bot API 收到所有群组的消息
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import signal
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCHMARK_DIR.parent
+sys.path.insert(0, str(BENCHMARK_DIR))
+sys.path.append(str(REPO_ROOT / 'telegramstream'))
+sys.path.append(str(REPO_ROOT))
+
+import nats
+import yaml
+
+from fake_apis import FakeBotAPI, FakeLLM, MiniHttpServer
+from mini_nats import MiniNatsServer, parse_headers
+from publisher import NatsPublisher
+from common import codec
+
+STREAM_SUBJECT = 'messages.stream'
+NOTIFICATION_SUBJECT = 'messages.notification'
+BENCH_CHAT_ID = -1009000000000
+BOT_TOKEN = '123456:benchmark'
+
+# 消息文本中的追踪标记，Bot API 收到的消息通过它关联到原始消息
+TOKEN_PATTERN = re.compile(r'bench-(\d+)')
+STAGES = ('publish', 'analyze', 'notify', 'end_to_end')
+
+def percentile(ordered: List[float], q: float) -> float:
+    """已排序列表的分位数（最近秩）"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def deep_update(base: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """递归合并配置"""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            deep_update(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+class StageTracker:
+    """按消息 ID 记录每个阶段的到达时间（time.monotonic）"""
+    
+    def __init__(self, groups: int):
+        self.groups = groups
+        self.sent: Dict[int, float] = {}
+        self.streamed: Dict[int, float] = {}
+        self.notified: Dict[int, float] = {}
+        self.delivered: Dict[int, float] = {}
+        self._deliveries: Dict[int, int] = defaultdict(int)
+    
+    def on_stream(self, subject: str, header: bytes, payload: bytes):
+        now = time.monotonic()
+        message_id = codec.decode(payload, parse_headers(header)).get('data', {}).get('message_id')
+        if message_id in self.sent:
+            self.streamed.setdefault(message_id, now)
+    
+    def on_notification(self, subject: str, header: bytes, payload: bytes):
+        now = time.monotonic()
+        data = codec.decode(payload, parse_headers(header)).get('data', {})
+        message_id = data.get('original_message', {}).get('data', {}).get('message_id')
+        if message_id in self.sent:
+            self.notified.setdefault(message_id, now)
+    
+    def on_bot_message(self, chat_id: str, text: str):
+        now = time.monotonic()
+        match = TOKEN_PATTERN.search(text)
+        if not match:
+            return
+        message_id = int(match.group(1))
+        self._deliveries[message_id] += 1
+        if self._deliveries[message_id] == self.groups:
+            self.delivered[message_id] = now
+    
+    def summarize(self, ids: range) -> Dict[str, Any]:
+        """统计一组消息的阶段延迟（毫秒）"""
+        latencies = {stage: [] for stage in STAGES}
+        for message_id in ids:
+            sent = self.sent.get(message_id)
+            streamed = self.streamed.get(message_id)
+            notified = self.notified.get(message_id)
+            delivered = self.delivered.get(message_id)
+            if sent is not None and streamed is not None:
+                latencies['publish'].append((streamed - sent) * 1000)
+            if streamed is not None and notified is not None:
+                latencies['analyze'].append((notified - streamed) * 1000)
+            if notified is not None and delivered is not None:
+                latencies['notify'].append((delivered - notified) * 1000)
+            if sent is not None and delivered is not None:
+                latencies['end_to_end'].append((delivered - sent) * 1000)
+        
+        summary = {}
+        for stage, values in latencies.items():
+            values.sort()
+            summary[stage] = {
+                'count': len(values),
+                'p50_ms': percentile(values, 0.50),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'max_ms': values[-1] if values else 0.0
+            }
+        return summary
+
+class PipelineBenchmark:
+    """性能测试运行器"""
+    
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = Path(args.workdir or tempfile.mkdtemp(prefix='pipeline-bench-'))
+        self.tracker = StageTracker(args.groups)
+        self.nats_server = MiniNatsServer()
+        self.http_server = MiniHttpServer()
+        self.fake_llm = FakeLLM(latency=args.llm_latency_ms / 1000, jitter=args.llm_jitter_ms / 1000,
+                                concurrency=args.llm_concurrency)
+        self.fake_bot = FakeBotAPI(on_message=self.tracker.on_bot_message, enforce_limits=args.telegram_limits)
+        self.processes: Dict[str, asyncio.subprocess.Process] = {}
+        self.nats_client = None
+        self.publisher: Optional[NatsPublisher] = None
+        # 按启动时间选择起始 ID，重复使用 --workdir 时不会被 outbox 当作已发送的通知
+        self.next_id = int(time.time()) * 1000
+    
+    async def setup(self):
+        """启动模拟服务、写入配置并启动 analyze_agent / notification"""
+        await self.nats_server.start()
+        self.nats_server.add_tap(STREAM_SUBJECT, self.tracker.on_stream)
+        self.nats_server.add_tap(NOTIFICATION_SUBJECT, self.tracker.on_notification)
+        
+        self.fake_llm.install(self.http_server)
+        self.fake_bot.install(self.http_server)
+        await self.http_server.start()
+        
+        print(f"📁 工作目录: {self.workdir}")
+        print(f"🛰️  NATS: {self.nats_server.url}  HTTP: {self.http_server.url}")
+        
+        for replica in range(self.args.analyze_replicas):
+            name = 'analyze_agent' if replica == 0 else f'analyze_agent-{replica + 1}'
+            await self._spawn(name, self._analyze_agent_config(), self.args.analyze_python, service='analyze_agent')
+        await self._spawn('notification', self._notification_config(), self.args.notification_python)
+        await self._wait_ready()
+        
+        # 驱动器扮演 telegramstream，使用它的发布器和配置
+        publisher_config = self._load_example('telegramstream').get('nats', {}).get('publisher', {})
+        self.nats_client = await nats.connect(servers=[self.nats_server.url], name='pipeline-benchmark')
+        self.publisher = NatsPublisher(
+            self.nats_client,
+            STREAM_SUBJECT,
+            flush_interval=publisher_config.get('flush_interval', 0.05),
+            flush_threshold=publisher_config.get('flush_threshold', 100),
+            wire_format=self.args.wire_format
+        )
+        self.publisher.start()
+    
+    def _load_example(self, service: str) -> Dict[str, Any]:
+        with open(REPO_ROOT / service / 'config.yml.example', 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    
+    def _analyze_agent_config(self) -> Dict[str, Any]:
+        return deep_update(self._load_example('analyze_agent'), {
+            'nats': {
+                'servers': [self.nats_server.url],
+                'subject': [STREAM_SUBJECT],
+                'notification_subject': NOTIFICATION_SUBJECT,
+                'notification_format': self.args.notification_format,
+                'notification_wire_format': self.args.wire_format,
+                # 多副本时使用队列组分担消息
+                'queue_group': 'analyze_agent' if self.args.analyze_replicas > 1 else ''
+            },
+            'llm': {
+                'provider': 'openai',
+                'openai': {'api_key': 'benchmark', 'base_url': f"{self.http_server.url}/v1", 'model': 'fake-llm'}
+            },
+            'deduplication': {'enabled': False},
+            'metrics': {'port': 0},  # 系统分配端口，不与本机运行的服务冲突
+            'logging': {'level': self.args.log_level}
+        })
+    
+    def _notification_config(self) -> Dict[str, Any]:
+        groups = [
+            {'chat_id': BENCH_CHAT_ID - i, 'name': f'benchmark-{i}', 'enabled': True}
+            for i in range(self.args.groups)
+        ]
+        return deep_update(self._load_example('notification'), {
+            'nats': {'servers': [self.nats_server.url], 'subject': NOTIFICATION_SUBJECT},
+            'telegram': {'bot_token': BOT_TOKEN, 'base_url': f"{self.http_server.url}/bot", 'target_groups': groups},
+            'rate_limit': {'enabled': self.args.telegram_limits},
+            'coalesce': {'enabled': False},
+            'queue': {'ttl_seconds': 0, 'stats_interval': 0},
+            'outbox': {'path': str(self.workdir / 'notification' / 'outbox.db')},
+            'metrics': {'port': 0},
+            'logging': {'level': self.args.log_level, 'file': ''}
+        })
+    
+    async def _spawn(self, name: str, config: Dict[str, Any], python: str, service: Optional[str] = None):
+        """以子进程运行 service 的 main.py，name 为进程名和工作目录名（同一服务的多个副本各用一个目录）"""
+        service = service or name
+        service_dir = self.workdir / name
+        service_dir.mkdir(parents=True, exist_ok=True)
+        with open(service_dir / 'config.yml', 'w', encoding='utf-8') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+        
+        log_file = open(service_dir / 'service.log', 'wb')
+        self.processes[name] = await asyncio.create_subprocess_exec(
+            python, str(REPO_ROOT / service / 'main.py'),
+            cwd=str(service_dir), stdout=log_file, stderr=asyncio.subprocess.STDOUT
+        )
+        log_file.close()
+    
+    async def _wait_ready(self):
+        """等待所有 analyze_agent 副本和 notification 完成订阅"""
+        deadline = time.monotonic() + self.args.startup_timeout
+        start_time = time.monotonic()
+        while not (self.nats_server.subscriber_count(STREAM_SUBJECT) >= self.args.analyze_replicas
+                   and self.nats_server.has_subscriber(NOTIFICATION_SUBJECT)):
+            for service, process in self.processes.items():
+                if process.returncode is not None:
+                    raise RuntimeError(f"{service} 启动失败，日志: {self.workdir / service / 'service.log'}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"服务启动超时 ({self.args.startup_timeout}s)，日志目录: {self.workdir}")
+            await asyncio.sleep(0.2)
+        print(f"✅ analyze_agent 和 notification 已就绪 ({time.monotonic() - start_time:.1f}s)")
+    
+    def _make_message(self, message_id: int) -> Dict[str, Any]:
+        """构造 telegramstream 格式的消息"""
+        text = f"BTC 突破关键阻力位，成交量明显放大 bench-{message_id} "
+        text += '市场情绪持续升温 ' * max(0, (self.args.text_length - len(text)) // 9)
+        now_ms = int(time.time() * 1000)
+        return {
+            'type': 'telegram.message',
+            'timestamp': now_ms,
+            'source': 'telegram',
+            'sender': 'telegramstream',
+            'data': {
+                'message_id': message_id,
+                'chat_id': BENCH_CHAT_ID,
+                'chat_title': 'Benchmark Source',
+                'chat_type': 'group',
+                'user_id': 1,
+                'username': 'bench_user',
+                'first_name': 'Bench',
+                'is_bot': False,
+                'date': now_ms,
+                'text': text,
+                'raw_text': text,
+                'reply_to_message_id': None,
+                'forward_from_chat_id': None,
+                'entities': [],
+                'media': None,
+                'extracted_data': {'symbols': ['BTC'], 'urls': [], 'raw_text': text}
+            }
+        }
+    
+    async def run_step(self, rate: float, count: int) -> Dict[str, Any]:
+        """按固定速率发送 count 条消息并等待处理完成"""
+        ids = range(self.next_id, self.next_id + count)
+        self.next_id += count
+        
+        start_time = time.monotonic()
+        for i, message_id in enumerate(ids):
+            delay = start_time + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            payload = self.publisher.encode(self._make_message(message_id))
+            self.tracker.sent[message_id] = time.monotonic()
+            await self.publisher.publish(payload)
+        await self.publisher.flush()
+        send_duration = time.monotonic() - start_time
+        
+        # 等待所有消息送达或超时
+        deadline = time.monotonic() + self.args.drain_timeout
+        while time.monotonic() < deadline:
+            if all(message_id in self.tracker.delivered for message_id in ids):
+                break
+            await asyncio.sleep(0.1)
+        
+        delivered_times = [self.tracker.delivered[i] for i in ids if i in self.tracker.delivered]
+        elapsed = (max(delivered_times) - start_time) if delivered_times else 0.0
+        stages = self.tracker.summarize(ids)
+        delivery_ratio = len(delivered_times) / count
+        sustainable = (
+            delivery_ratio >= self.args.min_delivery
+            and stages['end_to_end']['p99_ms'] <= self.args.slo_ms
+        )
+        return {
+            'rate': rate,
+            'sent': count,
+            'send_duration_s': send_duration,
+            'delivered': len(delivered_times),
+            'delivery_ratio': delivery_ratio,
+            'throughput_per_sec': len(delivered_times) / elapsed if elapsed > 0 else 0.0,
+            'stages': stages,
+            'sustainable': sustainable
+        }
+    
+    async def teardown(self):
+        """停止服务进程和模拟服务"""
+        if self.publisher:
+            await self.publisher.close()
+        if self.nats_client:
+            await self.nats_client.close()
+        
+        for service, process in self.processes.items():
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+        for service, process in self.processes.items():
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        
+        await self.http_server.stop()
+        await self.nats_server.stop()
+
+def print_step(result: Dict[str, Any]):
+    stages = result['stages']
+    latency = '  '.join(
+        f"{stage} {stages[stage]['p50_ms']:.0f}/{stages[stage]['p95_ms']:.0f}/{stages[stage]['p99_ms']:.0f}"
+        for stage in STAGES
+    )
+    mark = '✅' if result['sustainable'] else '❌'
+    print(f"{mark} 输入 {result['rate']:>7.1f} 条/秒  送达 {result['delivered']}/{result['sent']}  "
+          f"吞吐 {result['throughput_per_sec']:>7.1f} 条/秒  延迟 p50/p95/p99 (ms): {latency}")
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = PipelineBenchmark(args)
+    results = []
+    try:
+        await benchmark.setup()
+        
+        # 预热: 建立 HTTP 连接、加载代码路径
+        if args.warmup > 0:
+            await benchmark.run_step(rate=min(5.0, args.rates[0]), count=args.warmup)
+        
+        print(f"\n📊 每档 {args.duration}s，SLO: 端到端 p99 ≤ {args.slo_ms}ms 且送达率 ≥ {args.min_delivery:.0%}")
+        for rate in args.rates:
+            result = await benchmark.run_step(rate, max(1, int(rate * args.duration)))
+            results.append(result)
+            print_step(result)
+            if not result['sustainable'] and not args.keep_going:
+                break
+            await asyncio.sleep(args.cooldown)
+    finally:
+        await benchmark.teardown()
+    
+    sustainable = [r for r in results if r['sustainable']]
+    best = max(sustainable, key=lambda r: r['throughput_per_sec']) if sustainable else None
+    if best:
+        print(f"\n🏁 最大可持续吞吐量: {best['throughput_per_sec']:.1f} 条/秒（输入速率 {best['rate']} 条/秒）")
+    else:
+        print("\n🏁 没有满足 SLO 的速率档位")
+    
+    return {
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'steps': results,
+        'max_sustainable_throughput': best['throughput_per_sec'] if best else 0.0,
+        'nats': benchmark.nats_server.stats,
+        'llm_requests': benchmark.fake_llm.requests,
+        'bot': {'sent': benchmark.fake_bot.sent, 'rejected': benchmark.fake_bot.rejected},
+        'workdir': str(benchmark.workdir)
+    }
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='telegramstream → analyze_agent → notification 端到端性能测试')
+    parser.add_argument('--rates', type=lambda s: [float(x) for x in s.split(',')], default=[1, 2, 5, 10, 20, 50],
+                        help='逐档提高的输入速率（条/秒），逗号分隔')
+    parser.add_argument('--duration', type=float, default=20, help='每档持续发送秒数')
+    parser.add_argument('--cooldown', type=float, default=2, help='档位之间的间隔秒数')
+    parser.add_argument('--drain-timeout', type=float, default=30, help='发送结束后等待送达的最长秒数')
+    parser.add_argument('--warmup', type=int, default=5, help='预热消息数')
+    parser.add_argument('--slo-ms', type=float, default=5000, help='端到端 p99 延迟上限（毫秒）')
+    parser.add_argument('--min-delivery', type=float, default=0.99, help='最低送达率')
+    parser.add_argument('--keep-going', action='store_true', help='不满足 SLO 后继续测试更高的速率')
+    parser.add_argument('--llm-latency-ms', type=float, default=300, help='模拟 LLM 平均延迟')
+    parser.add_argument('--llm-jitter-ms', type=float, default=100, help='模拟 LLM 延迟抖动（均匀分布 ±）')
+    parser.add_argument('--llm-concurrency', type=int, default=0, help='模拟 LLM 最大并发请求数，0 表示不限制')
+    parser.add_argument('--analyze-replicas', type=int, default=1,
+                        help='analyze_agent 副本数，大于 1 时使用队列组分担消息')
+    parser.add_argument('--groups', type=int, default=1, help='notification 目标群组数')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='启用 notification 限流，并让模拟 Bot API 按 Telegram 限制返回 429')
+    parser.add_argument('--notification-format', choices=['full', 'compact'], default='compact')
+    parser.add_argument('--wire-format', choices=[codec.FORMAT_JSON, codec.FORMAT_MSGPACK], default=codec.FORMAT_JSON,
+                        help='telegramstream 消息和 analyze_agent 通知的消息体格式')
+    parser.add_argument('--text-length', type=int, default=200, help='消息原文长度（字符）')
+    parser.add_argument('--log-level', default='WARNING', help='服务日志级别')
+    parser.add_argument('--startup-timeout', type=float, default=180, help='等待服务启动的最长秒数')
+    parser.add_argument('--analyze-python', default=sys.executable, help='运行 analyze_agent 的 Python 解释器')
+    parser.add_argument('--notification-python', default=sys.executable, help='运行 notification 的 Python 解释器')
+    parser.add_argument('--workdir', help='配置和日志目录，默认创建临时目录')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📄 结果已写入 {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+性能测试组件测试: 进程内 NATS 服务器和模拟 HTTP 接口
+使用原始 socket 协议交互，不依赖 nats-py
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_apis import FakeBotAPI, FakeLLM, MiniHttpServer
+from mini_nats import MiniNatsServer, parse_headers, subject_matches
+
+class _RawClient:
+    """按 NATS 文本协议收发的最小客户端"""
+    
+    async def connect(self, server: MiniNatsServer, headers: bool = True):
+        self.reader, self.writer = await asyncio.open_connection(server.host, server.port)
+        await self.reader.readline()  # INFO
+        self.writer.write(f"CONNECT {json.dumps({'headers': headers})}\r\n".encode())
+        return self
+    
+    async def ping(self):
+        """PING/PONG 往返，保证之前的命令都已被服务器处理"""
+        self.writer.write(b"PING\r\n")
+        await self.writer.drain()
+        assert await self.reader.readline() == b"PONG\r\n"
+    
+    def send(self, line: str, payload: bytes = None):
+        self.writer.write(line.encode() + b"\r\n" + (payload + b"\r\n" if payload is not None else b''))
+    
+    async def next_msg(self, timeout: float = 1.0):
+        """读取一条 MSG/HMSG，返回 (subject, sid, header, payload)"""
+        line = (await asyncio.wait_for(self.reader.readline(), timeout)).decode().split()
+        if line[0] == 'HMSG':
+            header_size, total_size = int(line[-2]), int(line[-1])
+            data = await self.reader.readexactly(total_size + 2)
+            return line[1], line[2], data[:header_size], data[header_size:total_size]
+        size = int(line[-1])
+        data = await self.reader.readexactly(size + 2)
+        return line[1], line[2], b'', data[:size]
+    
+    async def close(self):
+        self.writer.close()
+
+def test_subject_matching():
+    """* 匹配一个 token，> 匹配剩余的一个或多个 token"""
+    assert subject_matches('messages.stream', 'messages.stream')
+    assert subject_matches('messages.*', 'messages.stream')
+    assert not subject_matches('messages.*', 'messages.stream.x')
+    assert subject_matches('messages.>', 'messages.stream.x')
+    assert not subject_matches('messages.>', 'messages')
+    assert not subject_matches('messages.stream', 'messages.notification')
+    print("✅ subject 通配符匹配")
+
+async def _test_pub_sub_headers():
+    server = MiniNatsServer()
+    await server.start()
+    try:
+        observed = []
+        server.add_tap('messages.>', lambda subject, header, payload: observed.append((subject, payload)))
+        
+        sub = await _RawClient().connect(server)
+        sub.send("SUB messages.* 1")
+        await sub.ping()
+        assert server.has_subscriber('messages.notification')
+        
+        pub = await _RawClient().connect(server)
+        header = b"NATS/1.0\r\nX-Type: telegram\r\nX-Score: 0.8\r\n\r\n"
+        pub.send(f"HPUB messages.notification {len(header)} {len(header) + 5}", header + b"hello")
+        pub.send("PUB messages.stream 3", b"abc")
+        await pub.ping()
+        
+        subject, sid, received_header, payload = await sub.next_msg()
+        assert (subject, sid, payload) == ('messages.notification', '1', b'hello')
+        assert parse_headers(received_header) == {'X-Type': 'telegram', 'X-Score': '0.8'}
+        assert (await sub.next_msg())[3] == b'abc'
+        assert observed == [('messages.notification', b'hello'), ('messages.stream', b'abc')], observed
+        
+        # UNSUB 之后不再投递
+        sub.send("UNSUB 1")
+        await sub.ping()
+        assert not server.has_subscriber('messages.stream')
+        await pub.close()
+        await sub.close()
+    finally:
+        await server.stop()
+
+def test_pub_sub_headers():
+    """PUB/HPUB 投递给匹配的订阅，消息头原样转发，tap 观察到所有消息"""
+    asyncio.run(_test_pub_sub_headers())
+    print("✅ 发布订阅和消息头")
+
+async def _test_queue_group():
+    server = MiniNatsServer()
+    await server.start()
+    try:
+        members = [await _RawClient().connect(server) for _ in range(2)]
+        for member in members:
+            member.send("SUB dedup.check workers 1")
+            await member.ping()
+        assert server.subscriber_count('dedup.check') == 2
+        
+        pub = await _RawClient().connect(server)
+        for i in range(20):
+            pub.send("PUB dedup.check 1", str(i % 10).encode())
+        await pub.ping()
+        
+        assert server.stats['msgs_out'] == 20, server.stats
+        await pub.close()
+        for member in members:
+            await member.close()
+    finally:
+        await server.stop()
+
+def test_queue_group():
+    """队列组中每条消息只投递给一个成员"""
+    asyncio.run(_test_queue_group())
+    print("✅ 队列组")
+
+async def _test_fake_apis():
+    received = []
+    server = MiniHttpServer()
+    FakeLLM(latency=0.01, jitter=0.0).install(server)
+    bot = FakeBotAPI(on_message=lambda chat_id, text: received.append((chat_id, text)),
+                     enforce_limits=True, chat_limit=2)
+    bot.install(server)
+    await server.start()
+    
+    async def post(path: str, body: bytes, content_type: str):
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        writer.write(f"POST {path} HTTP/1.1\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        status = int((await reader.readline()).split()[1])
+        response = (await reader.read()).split(b"\r\n\r\n", 1)[1]
+        writer.close()
+        return status, json.loads(response)
+    
+    try:
+        status, response = await post('/v1/chat/completions', b'{"model": "fake"}', 'application/json')
+        assert status == 200
+        assert json.loads(response['choices'][0]['message']['content'])['情绪'] == '利多'
+        
+        statuses = []
+        for i in range(3):
+            status, response = await post('/bot123:abc/sendMessage', f'chat_id=-100&text=bench-{i}'.encode(),
+                                          'application/x-www-form-urlencoded')
+            statuses.append(status)
+        assert statuses == [200, 200, 429], statuses
+        assert response['parameters']['retry_after'] > 0
+        assert received == [('-100', 'bench-0'), ('-100', 'bench-1')], received
+    finally:
+        await server.stop()
+
+def test_fake_apis():
+    """模拟 LLM 返回情绪 JSON，模拟 Bot API 超过单群组限制后返回 429"""
+    asyncio.run(_test_fake_apis())
+    print("✅ 模拟 LLM 和 Bot API")
+
+if __name__ == '__main__':
+    try:
+        test_subject_matching()
+        test_pub_sub_headers()
+        test_queue_group()
+        test_fake_apis()
+        print("\n🎉 所有性能测试组件测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,4 @@
+"""
+公共模块
+telegramstream、analyze_agent、notification 共用的工具，各服务的 main.py 把仓库根目录加入 sys.path 后导入
+"""
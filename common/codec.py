@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+公共消息编解码
+telegramstream、analyze_agent、notification 在 NATS 上收发的 JSON 消息统一经过这里:
+- 安装了 orjson 时使用 orjson（编码和解码都比标准库快数倍），numpy 数组和标量直接序列化
+- 没有安装时回退到标准库 json，输出格式相同（UTF-8、不转义非 ASCII、无多余空白），numpy 类型转换为 Python 原生类型
+- 解码错误统一抛出 DecodeError（ValueError 的子类）
+
+可选的 msgpack 线上格式: 发布端配置为 msgpack 时消息体用 msgpack 编码，并带 Content-Type: application/msgpack 头；
+没有该头的消息（包括 Chrome 扩展通过 WebSocket 发布的消息和旧版本服务）按 JSON 解析。
+订阅端统一用 decode(data, headers) 解码，两种格式都能接收
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Mapping, Optional, Union
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+DecodeError = json.JSONDecodeError
+
+BACKEND = 'orjson' if ORJSON_AVAILABLE else 'json'
+
+# 线上格式
+FORMAT_JSON = 'json'
+FORMAT_MSGPACK = 'msgpack'
+HEADER_CONTENT_TYPE = 'Content-Type'
+CONTENT_TYPES = {FORMAT_JSON: 'application/json', FORMAT_MSGPACK: 'application/msgpack'}
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+def default(value: Any) -> Any:
+    """两种实现都不能直接序列化的类型: numpy（标准库）、datetime（标准库）、set 等，也可以作为 json.dumps 的 default 参数"""
+    if hasattr(value, 'tolist'):
+        # numpy 数组和标量（np.float32、np.int64 等）
+        return value.tolist()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"无法序列化类型 {type(value).__name__}")
+
+if ORJSON_AVAILABLE:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 JSON 字节，sort_keys 为 True 时按键排序（计算内容哈希等需要稳定输出的场合）"""
+        return orjson.dumps(value, default=default, option=_OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _OPTIONS)
+    
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """解析 JSON（bytes 或 str）"""
+        return orjson.loads(data)
+else:
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """序列化为 UTF-8 JSON 字节，sort_keys 为 True 时按键排序（计算内容哈希等需要稳定输出的场合）"""
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys,
+                          default=default).encode()
+    
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """解析 JSON（bytes 或 str）"""
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        try:
+            return json.loads(data)
+        except UnicodeDecodeError as e:
+            raise DecodeError(f"消息不是有效的 UTF-8: {e}", '', 0) from None
+
+def dumps_str(value: Any) -> str:
+    """序列化为 JSON 字符串（输出到控制台、写入文本文件）"""
+    return dumps(value).decode()
+
+def check_format(wire_format: str) -> str:
+    """校验配置的线上格式"""
+    if wire_format not in CONTENT_TYPES:
+        raise ValueError(f"不支持的消息格式: {wire_format}（可选 {', '.join(CONTENT_TYPES)}）")
+    if wire_format == FORMAT_MSGPACK and not MSGPACK_AVAILABLE:
+        raise ValueError("消息格式 msgpack 需要安装 msgpack（pip install msgpack）")
+    return wire_format
+
+def content_headers(wire_format: str) -> Dict[str, str]:
+    """发布时附加的消息头，JSON 不带头（与旧版本和 Chrome 扩展发布的消息相同）"""
+    if wire_format == FORMAT_JSON:
+        return {}
+    return {HEADER_CONTENT_TYPE: CONTENT_TYPES[wire_format]}
+
+def message_format(headers: Optional[Mapping[str, str]]) -> str:
+    """根据 Content-Type 头判断消息格式，没有头时为 JSON"""
+    if not headers:
+        return FORMAT_JSON
+    content_type = headers.get(HEADER_CONTENT_TYPE) or headers.get(HEADER_CONTENT_TYPE.lower()) or ''
+    if content_type.split(';', 1)[0].strip().lower() in MSGPACK_CONTENT_TYPES:
+        return FORMAT_MSGPACK
+    return FORMAT_JSON
+
+def encode(value: Any, wire_format: str = FORMAT_JSON) -> bytes:
+    """按线上格式序列化，msgpack 支持的类型与 JSON 相同（numpy、datetime、set 经 default 转换）"""
+    if wire_format == FORMAT_JSON:
+        return dumps(value)
+    return msgpack.packb(value, default=default, use_bin_type=True)
+
+def decode(data: Union[bytes, bytearray, memoryview], headers: Optional[Mapping[str, str]] = None) -> Any:
+    """按 Content-Type 头解码消息"""
+    if message_format(headers) == FORMAT_JSON:
+        return loads(data)
+    if not MSGPACK_AVAILABLE:
+        raise DecodeError("收到 msgpack 消息，但没有安装 msgpack（pip install msgpack）", '', 0)
+    try:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except (ValueError, msgpack.UnpackException) as e:
+        raise DecodeError(f"msgpack 解析失败: {e or type(e).__name__}", '', 0) from None
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+公共日志工具
+telegramstream、analyze_agent、notification 共用:
+- 日志由后台线程格式化并写入控制台和文件（QueueHandler/QueueListener），
+  事件循环中只拼接消息文本（getMessage）并把日志记录放入队列，时间戳、格式串和异常堆栈在后台线程处理
+- EventLogger 输出 "消息 key=value" 格式的结构化日志，级别未启用时不格式化任何字段
+- lazy() 包装的字段只在日志真正输出时才求值，字段可以按配置比例采样输出
+"""
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 包含空白、引号或等号的字符串值用 JSON 字符串表示，保证一条日志只占一行
+_NEEDS_QUOTE = re.compile(r'[\s"=]')
+
+_listener: Optional[QueueListener] = None
+_field_sampling: Dict[str, float] = {}
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    只在调用线程中拼接消息文本的 QueueHandler
+    
+    标准库的 prepare() 会在调用线程中执行 self.format(record)（时间戳、格式串、异常堆栈）。
+    这里只调用 getMessage() 固定参数的取值，格式化交给 QueueListener 中各处理器自己的 Formatter。
+    队列在进程内传递对象，exc_info 保留给后台线程格式化
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        return record
+
+def setup_logging(log_config: Dict[str, Any]) -> QueueListener:
+    """
+    配置根日志记录器
+    
+    Args:
+        log_config: logging 配置
+            level: 日志级别
+            format: 日志格式
+            file: 日志文件路径，留空则只输出到控制台
+            sampling: 字段采样比例，例如 {'text': 0.1} 表示 10% 的日志输出 text 字段
+    
+    Returns:
+        后台写日志的 QueueListener
+    """
+    global _listener
+    
+    level = getattr(logging, str(log_config.get('level', 'INFO')).upper(), logging.INFO)
+    formatter = logging.Formatter(log_config.get('format', DEFAULT_FORMAT))
+    
+    # 控制台和文件处理器（包括格式化）只在后台线程中执行
+    handlers = [logging.StreamHandler()]
+    if log_config.get('file'):
+        handlers.append(logging.FileHandler(log_config['file'], encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    stop_logging()
+    
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(_DeferredQueueHandler(log_queue))
+    root_logger.setLevel(level)
+    
+    _listener = QueueListener(log_queue, *handlers)
+    _listener.start()
+    set_field_sampling(log_config.get('sampling') or {})
+    return _listener
+
+def stop_logging():
+    """停止后台日志线程，写出队列中剩余的日志并关闭处理器"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+atexit.register(stop_logging)
+
+def set_field_sampling(sampling: Dict[str, float]):
+    """设置字段采样比例（0 到 1），未配置的字段总是输出"""
+    _field_sampling.clear()
+    for field, rate in sampling.items():
+        _field_sampling[field] = min(1.0, max(0.0, float(rate)))
+
+class _Lazy:
+    """延迟求值的日志参数"""
+    
+    __slots__ = ('func', 'args', 'kwargs')
+    
+    def __init__(self, func: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+    
+    def __call__(self) -> Any:
+        return self.func(*self.args, **self.kwargs)
+    
+    def __str__(self) -> str:
+        return str(self())
+
+def lazy(func: Callable[..., Any], *args, **kwargs) -> _Lazy:
+    """
+    包装一个日志参数，只有日志真正输出时才调用 func(*args, **kwargs)
+    
+    可以作为 EventLogger 的字段值，也可以作为 logger.debug("%s", ...) 的参数
+    """
+    return _Lazy(func, args, kwargs)
+
+def truncate(text: str, max_length: int) -> str:
+    """截断长文本，附带原始长度"""
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}...({len(text)} 字符)"
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, _Lazy):
+        value = value()
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    value = str(value)
+    if not value or _NEEDS_QUOTE.search(value):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+class _Fields:
+    """结构化字段，在日志输出时才格式化"""
+    
+    __slots__ = ('fields',)
+    
+    def __init__(self, fields: Dict[str, Any]):
+        self.fields = fields
+    
+    def __str__(self) -> str:
+        parts = []
+        for key, value in self.fields.items():
+            if value is None:
+                continue
+            rate = _field_sampling.get(key)
+            if rate is not None and (rate <= 0.0 or random.random() >= rate):
+                continue
+            parts.append(f" {key}={_format_value(value)}")
+        return ''.join(parts)
+
+class EventLogger:
+    """
+    结构化事件日志
+    
+    events.info("📨 收到消息", source='telegram', text=lazy(truncate, text, 500))
+    输出 "📨 收到消息 source=telegram text=..."，值为 None 的字段不输出
+    """
+    
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+    
+    def isEnabledFor(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+    
+    def debug(self, message: str, **fields):
+        self._log(logging.DEBUG, message, fields)
+    
+    def info(self, message: str, **fields):
+        self._log(logging.INFO, message, fields)
+    
+    def warning(self, message: str, **fields):
+        self._log(logging.WARNING, message, fields)
+    
+    def error(self, message: str, **fields):
+        self._log(logging.ERROR, message, fields)
+    
+    def _log(self, level: int, message: str, fields: Dict[str, Any]):
+        if self.logger.isEnabledFor(level):
+            # stacklevel=3: 日志中的文件名和行号指向调用 info()/debug() 的位置
+            self.logger.log(level, '%s%s', message, _Fields(fields), stacklevel=3)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+公共指标工具
+telegramstream、analyze_agent、notification 共用的内嵌指标注册表和 /metrics HTTP 接口（Prometheus 文本格式）:
+- Counter / Gauge / Histogram，更新时只做加法和一次二分查找，不加锁、不分配对象
+- 已经在 stats 字典里维护的计数和队列深度用 set_function 注册，抓取时才读取，热路径没有额外开销
+- MetricsServer 基于 asyncio.start_server，只响应 GET /metrics，与服务共用事件循环
+"""
+
+import asyncio
+import logging
+import math
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 延迟类直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _CounterValue:
+    __slots__ = ('value', 'function')
+    
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+    
+    def set_function(self, function: Callable[[], float]):
+        """抓取时调用 function 取值（读取已有的累计计数）"""
+        self.function = function
+    
+    def get(self) -> float:
+        return float(self.function()) if self.function else self.value
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+    
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+    
+    def set(self, value: float):
+        self.value = float(value)
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric:
+    """指标基类，按标签值保存子指标"""
+    
+    kind = ''
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, *values: Any, **kwargs: Any):
+        """按标签值获取子指标，不存在时创建"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {key}")
+            child = self._children[key] = self._new_child()
+        return child
+    
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(指标名, 标签, 值)"""
+        for key, child in list(self._children.items()):
+            yield self.name, _format_labels(self.labelnames, key), child.get()
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    """只增不减的计数"""
+    
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _CounterValue()
+    
+    def inc(self, amount: float = 1.0):
+        self._default.value += amount
+    
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+class Gauge(Metric):
+    """可增可减的当前值（队列深度、缓存大小等）"""
+    
+    kind = 'gauge'
+    
+    def _new_child(self):
+        return _GaugeValue()
+    
+    def inc(self, amount: float = 1.0):
+        self._default.value += amount
+    
+    def dec(self, amount: float = 1.0):
+        self._default.value -= amount
+    
+    def set(self, value: float):
+        self._default.set(value)
+    
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+class Histogram(Metric):
+    """分桶计数的分布（延迟、批大小等），分位数由 Prometheus 端计算"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets if not math.isinf(b)))
+        super().__init__(name, documentation, labelnames)
+    
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+    
+    def observe(self, value: float):
+        self._default.observe(value)
+    
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, child.count
+
+class MetricsRegistry:
+    """指标注册表，同名指标重复注册时返回已有的实例"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+    
+    def _register(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs) -> Any:
+        metric = self._metrics.get(name)
+        if metric is not None:
+            if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"指标 {name} 已注册为不同的类型或标签")
+            return metric
+        metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+    
+    def render(self) -> str:
+        """Prometheus 文本格式，读取失败的回调指标跳过"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.debug(f"读取指标 {metric.name} 失败: {e}")
+        return '\n'.join(lines) + '\n'
+
+# 进程内默认注册表，各模块在导入时定义自己的指标
+REGISTRY = MetricsRegistry()
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+class MetricsServer:
+    """只响应 GET /metrics 的 HTTP 服务"""
+    
+    def __init__(self, registry: Optional[MetricsRegistry] = None, host: str = '127.0.0.1', port: int = 9100):
+        self.registry = registry or REGISTRY
+        self.host = host
+        self.port = port
+        self._server = None
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # port 为 0 时使用系统分配的端口
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"指标接口已启动: http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) >= 2 else ''
+            if parts and parts[0] == 'GET' and path == '/metrics':
+                status, content_type, body = '200 OK', CONTENT_TYPE, self.registry.render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', b'not found\n'
+            
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def start_metrics_server(metrics_config: Dict[str, Any], default_port: int,
+                               registry: Optional[MetricsRegistry] = None) -> Optional[MetricsServer]:
+    """
+    按 metrics 配置启动指标接口
+    
+    端口被占用等错误只输出警告，不影响服务本身运行
+    """
+    if not metrics_config.get('enabled', True):
+        return None
+    
+    server = MetricsServer(
+        registry=registry,
+        host=metrics_config.get('host', '127.0.0.1'),
+        port=metrics_config.get('port', default_port)
+    )
+    try:
+        await server.start()
+    except OSError as e:
+        logger.warning(f"指标接口启动失败 ({server.host}:{server.port}): {e}")
+        return None
+    return server
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+消息编解码测试
+"""
+
+import importlib.util
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common import codec
+
+MESSAGE = {
+    'type': 'telegram.message',
+    'source': 'telegram',
+    'data': {'message_id': 1, 'text': 'BTC 突破 🚀', 'score': 0.72, 'media': None, 'symbols': ['BTC']}
+}
+
+def _load_stdlib_codec():
+    """屏蔽 orjson 后重新加载，得到标准库实现"""
+    saved = sys.modules.get('orjson')
+    sys.modules['orjson'] = None
+    try:
+        spec = importlib.util.spec_from_file_location('codec_stdlib', Path(codec.__file__))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            sys.modules.pop('orjson', None)
+        else:
+            sys.modules['orjson'] = saved
+    return module
+
+def test_round_trip_and_format():
+    """两种实现输出相同的紧凑 UTF-8 JSON，可以互相解码"""
+    stdlib = _load_stdlib_codec()
+    assert not stdlib.ORJSON_AVAILABLE and stdlib.BACKEND == 'json'
+    
+    encoded = codec.dumps(MESSAGE)
+    assert encoded == stdlib.dumps(MESSAGE), (encoded, stdlib.dumps(MESSAGE))
+    assert 'BTC 突破 🚀'.encode() in encoded and b', ' not in encoded
+    assert codec.loads(encoded) == stdlib.loads(encoded) == MESSAGE
+    assert codec.loads(encoded.decode()) == stdlib.loads(memoryview(encoded)) == MESSAGE
+    assert codec.dumps_str({'a': 1}) == '{"a":1}'
+    print(f"✅ 编解码一致（当前后端: {codec.BACKEND}）")
+
+def test_extra_types():
+    """datetime、set、非字符串键和 numpy 类型"""
+    stdlib = _load_stdlib_codec()
+    value = {'at': datetime(2024, 5, 1, 8, 0, 0), 'tags': {'btc'}, 1: 'one'}
+    for module in (codec, stdlib):
+        assert module.loads(module.dumps(value)) == {'at': '2024-05-01T08:00:00', 'tags': ['btc'], '1': 'one'}
+    
+    try:
+        import numpy as np
+    except ImportError:
+        print("✅ datetime / set / 非字符串键（未安装 numpy，跳过 numpy 类型）")
+        return
+    stats = {'similarity': np.float32(0.5), 'count': np.int64(3), 'vector': np.array([1.0, 2.0])}
+    for module in (codec, stdlib):
+        assert module.loads(module.dumps(stats)) == {'similarity': 0.5, 'count': 3, 'vector': [1.0, 2.0]}
+    print("✅ datetime / set / 非字符串键 / numpy 类型")
+
+def test_decode_errors():
+    """无效 JSON 和无效 UTF-8 都抛出 DecodeError（ValueError 的子类）"""
+    stdlib = _load_stdlib_codec()
+    for module in (codec, stdlib):
+        for data in (b'not json', b'{"a":', b'"\xff"'):
+            try:
+                module.loads(data)
+                assert False, f"{module.BACKEND} 应该拒绝 {data!r}"
+            except codec.DecodeError:
+                pass
+        try:
+            module.dumps({'x': object()})
+            assert False, "不支持的类型应该报错"
+        except TypeError:
+            pass
+    assert issubclass(codec.DecodeError, ValueError)
+    print("✅ 解码错误")
+
+def test_wire_format():
+    """按 Content-Type 头识别格式，没有头时为 JSON；msgpack 与 JSON 解码结果相同"""
+    assert codec.content_headers(codec.FORMAT_JSON) == {}
+    assert codec.message_format(None) == codec.message_format({'X-Type': 'telegram'}) == codec.FORMAT_JSON
+    assert codec.message_format({'Content-Type': 'application/msgpack'}) == codec.FORMAT_MSGPACK
+    assert codec.message_format({'content-type': 'application/x-msgpack; v=1'}) == codec.FORMAT_MSGPACK
+    assert codec.decode(codec.dumps(MESSAGE), {'Content-Type': 'application/json'}) == MESSAGE
+    try:
+        codec.check_format('xml')
+        assert False, "不支持的格式应该报错"
+    except ValueError:
+        pass
+    
+    headers = {'X-Type': 'telegram', **codec.content_headers(codec.FORMAT_MSGPACK)}
+    if not codec.MSGPACK_AVAILABLE:
+        for call in (lambda: codec.check_format(codec.FORMAT_MSGPACK), lambda: codec.decode(b'\x80', headers)):
+            try:
+                call()
+                assert False, "未安装 msgpack 时应该报错"
+            except ValueError:
+                pass
+        print("✅ 线上格式（未安装 msgpack，跳过 msgpack 编解码）")
+        return
+    
+    packed = codec.encode(MESSAGE, codec.check_format(codec.FORMAT_MSGPACK))
+    assert codec.decode(packed, headers) == MESSAGE and len(packed) < len(codec.dumps(MESSAGE))
+    value = {'at': datetime(2024, 5, 1, 8, 0, 0), 'tags': {'btc'}}
+    assert codec.decode(codec.encode(value, codec.FORMAT_MSGPACK), headers) == {'at': '2024-05-01T08:00:00', 'tags': ['btc']}
+    for data in (codec.dumps(MESSAGE), b'\xc1', packed[:-3]):
+        try:
+            codec.decode(data, headers)
+            assert False, f"应该拒绝 {data[:20]!r}"
+        except codec.DecodeError:
+            pass
+    print("✅ 线上格式（JSON / msgpack）")
+
+def test_sort_keys():
+    """sort_keys 输出与键的插入顺序无关，两种实现相同（用于计算内容哈希）"""
+    stdlib = _load_stdlib_codec()
+    reordered = {'data': dict(reversed(list(MESSAGE['data'].items()))), 'source': 'telegram', 'type': 'telegram.message'}
+    
+    encoded = codec.dumps(MESSAGE, sort_keys=True)
+    assert encoded == codec.dumps(reordered, sort_keys=True) == stdlib.dumps(reordered, sort_keys=True), encoded
+    assert encoded.startswith(b'{"data":{"media":null,"message_id":1,'), encoded
+    assert codec.dumps(MESSAGE) != codec.dumps(reordered), "默认保持插入顺序"
+    print("✅ 按键排序输出")
+
+if __name__ == '__main__':
+    try:
+        test_round_trip_and_format()
+        test_extra_types()
+        test_decode_errors()
+        test_wire_format()
+        test_sort_keys()
+        print("\n🎉 所有编解码测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+公共日志工具测试
+"""
+
+import logging
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.logging_util import EventLogger, lazy, set_field_sampling, setup_logging, stop_logging, truncate
+
+class _CaptureHandler(logging.Handler):
+    """记录格式化后的消息和写入线程"""
+    
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = set()
+    
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        self.threads.add(threading.current_thread().name)
+
+def _make_logger(name: str, level: int):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [_CaptureHandler()]
+    logger.setLevel(level)
+    return logger, logger.handlers[0]
+
+def test_lazy_not_evaluated_when_disabled():
+    """级别未启用时不调用 lazy 包装的函数，也不格式化字段"""
+    calls = []
+    
+    def expensive(value):
+        calls.append(value)
+        return value
+    
+    logger, handler = _make_logger('test.lazy', logging.INFO)
+    events = EventLogger(logger)
+    events.debug("调试", text=lazy(expensive, 'debug'))
+    logger.debug("调试 %s", lazy(expensive, 'plain'))
+    assert calls == [], calls
+    
+    events.info("信息", text=lazy(expensive, 'info'))
+    assert calls == ['info'], calls
+    assert handler.messages == ['信息 text=info'], handler.messages
+    print("✅ 未启用的日志级别不求值")
+
+def test_structured_fields():
+    """字段格式: 浮点数保留 3 位，包含空白的字符串加引号，None 不输出"""
+    logger, handler = _make_logger('test.fields', logging.DEBUG)
+    EventLogger(logger).info("📨 收到消息", source='telegram', score=0.5, chat=None,
+                             text='BTC 突破\n10万', empty='')
+    
+    assert handler.messages == ['📨 收到消息 source=telegram score=0.500 text="BTC 突破\\n10万" empty=""'], handler.messages
+    assert truncate('abcdef', 3) == 'abc...(6 字符)'
+    assert truncate('abc', 3) == 'abc'
+    print("✅ 结构化字段格式正确")
+
+def test_field_sampling():
+    """采样比例为 0 的字段不输出，其他字段不受影响"""
+    logger, handler = _make_logger('test.sampling', logging.DEBUG)
+    events = EventLogger(logger)
+    try:
+        set_field_sampling({'text': 0.0, 'reason': 1.0})
+        for _ in range(10):
+            events.info("分析完成", sentiment='利多', reason='突破', text='原文')
+    finally:
+        set_field_sampling({})
+    
+    assert handler.messages == ['分析完成 sentiment=利多 reason=突破'] * 10, handler.messages[:2]
+    print("✅ 按字段采样")
+
+def test_setup_logging_writes_in_background_thread():
+    """日志文件由后台线程写入，停止后队列中的日志全部写出"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = Path(tmp) / 'service.log'
+        listener = setup_logging({'level': 'DEBUG', 'format': '%(levelname)s %(message)s', 'file': str(log_file)})
+        capture = _CaptureHandler()
+        listener.handlers = listener.handlers + (capture,)
+        try:
+            logger = logging.getLogger('test.background')
+            for i in range(20):
+                logger.info("消息 %d", i)
+        finally:
+            stop_logging()
+        
+        lines = log_file.read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 20 and lines[-1] == 'INFO 消息 19', lines[-3:]
+        assert threading.current_thread().name not in capture.threads, capture.threads
+    print("✅ 日志在后台线程写入")
+
+class _ThreadRecordingFormatter(logging.Formatter):
+    """记录 format() 所在的线程"""
+    
+    def __init__(self, fmt: str):
+        super().__init__(fmt)
+        self.threads = set()
+    
+    def format(self, record):
+        self.threads.add(threading.current_thread().name)
+        return super().format(record)
+
+def test_formatting_in_background_thread():
+    """格式化（包括异常堆栈）在后台线程执行，调用线程只拼接消息文本"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = Path(tmp) / 'service.log'
+        listener = setup_logging({'level': 'INFO', 'format': '%(levelname)s %(message)s', 'file': str(log_file)})
+        formatter = _ThreadRecordingFormatter('%(levelname)s %(message)s')
+        for handler in listener.handlers:
+            handler.setFormatter(formatter)
+        try:
+            logger = logging.getLogger('test.formatting')
+            values = ['原值']
+            logger.info("参数 %s", values)
+            values[0] = '已修改'  # 入队时已经固定消息文本
+            try:
+                raise ValueError('出错')
+            except ValueError:
+                logger.exception("处理失败")
+        finally:
+            stop_logging()
+        
+        text = log_file.read_text(encoding='utf-8')
+        assert "INFO 参数 ['原值']" in text, text
+        assert 'ERROR 处理失败' in text and 'ValueError: 出错' in text, text
+        assert formatter.threads and threading.current_thread().name not in formatter.threads, formatter.threads
+    print("✅ 日志在后台线程格式化")
+
+if __name__ == '__main__':
+    try:
+        test_lazy_not_evaluated_when_disabled()
+        test_structured_fields()
+        test_field_sampling()
+        test_setup_logging_writes_in_background_thread()
+        test_formatting_in_background_thread()
+        print("\n🎉 所有日志工具测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
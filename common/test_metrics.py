@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+指标注册表和 /metrics 接口测试
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.metrics import MetricsRegistry, MetricsServer, start_metrics_server
+
+def test_counter_and_gauge():
+    """计数、标签和抓取时回调"""
+    registry = MetricsRegistry()
+    received = registry.counter('demo_received_total', '收到的消息数', ['source'])
+    received.labels('telegram').inc()
+    received.labels(source='telegram').inc(2)
+    received.labels('twitter').inc()
+    
+    queue = []
+    depth = registry.gauge('demo_queue_depth', '队列深度')
+    depth.set_function(lambda: len(queue))
+    queue.extend([1, 2, 3])
+    
+    assert registry.counter('demo_received_total', '重复注册', ['source']) is received
+    try:
+        registry.gauge('demo_received_total', '类型不同')
+        assert False, "不同类型的同名指标应该报错"
+    except ValueError:
+        pass
+    
+    text = registry.render()
+    assert '# TYPE demo_received_total counter' in text, text
+    assert 'demo_received_total{source="telegram"} 3' in text, text
+    assert 'demo_received_total{source="twitter"} 1' in text, text
+    assert 'demo_queue_depth 3' in text, text
+    print("✅ 计数和回调指标")
+
+def test_histogram_buckets():
+    """直方图输出累计分桶、总和与数量"""
+    registry = MetricsRegistry()
+    latency = registry.histogram('demo_seconds', '耗时', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.labels('llm').observe(value)
+    
+    text = registry.render()
+    assert 'demo_seconds_bucket{stage="llm",le="0.1"} 2' in text, text
+    assert 'demo_seconds_bucket{stage="llm",le="1"} 3' in text, text
+    assert 'demo_seconds_bucket{stage="llm",le="+Inf"} 4' in text, text
+    assert 'demo_seconds_sum{stage="llm"} 3.65' in text, text
+    assert 'demo_seconds_count{stage="llm"} 4' in text, text
+    print("✅ 直方图分桶")
+
+def test_label_escaping_and_broken_callback():
+    """标签值转义，回调出错的指标跳过而不影响其他指标"""
+    registry = MetricsRegistry()
+    registry.counter('demo_total', '计数', ['chat']).labels('a "b"\n').inc()
+    registry.gauge('demo_broken', '回调出错').set_function(lambda: 1 / 0)
+    registry.gauge('demo_ok', '正常').set(2)
+    
+    text = registry.render()
+    assert 'demo_total{chat="a \\"b\\"\\n"} 1' in text, text
+    assert 'demo_broken' not in text and 'demo_ok 2' in text, text
+    print("✅ 标签转义和回调错误")
+
+async def _http_get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+async def _run_server():
+    registry = MetricsRegistry()
+    registry.counter('demo_requests_total', '请求数').inc(5)
+    server = MetricsServer(registry, port=0)
+    await server.start()
+    try:
+        metrics_response = await _http_get(server.port, '/metrics')
+        missing_response = await _http_get(server.port, '/other')
+        
+        # 端口被占用时只返回 None，不抛出异常
+        conflict = await start_metrics_server({'port': server.port}, default_port=0, registry=registry)
+        disabled = await start_metrics_server({'enabled': False}, default_port=0, registry=registry)
+    finally:
+        await server.stop()
+    return metrics_response, missing_response, conflict, disabled
+
+def test_metrics_server():
+    """GET /metrics 返回文本格式，其他路径 404"""
+    metrics_response, missing_response, conflict, disabled = asyncio.run(_run_server())
+    assert metrics_response.startswith(b'HTTP/1.1 200 OK'), metrics_response
+    assert b'text/plain; version=0.0.4' in metrics_response
+    assert metrics_response.endswith(b'demo_requests_total 5\n'), metrics_response
+    assert missing_response.startswith(b'HTTP/1.1 404'), missing_response
+    assert conflict is None and disabled is None
+    print("✅ /metrics 接口")
+
+if __name__ == '__main__':
+    try:
+        test_counter_and_gauge()
+        test_histogram_buckets()
+        test_label_escaping_and_broken_callback()
+        test_metrics_server()
+        print("\n🎉 所有指标测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+链路追踪测试
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.tracing import MAX_SPANS, TRACE_HEADER, TraceAggregator, TraceContext
+
+def _full_trace(offset: int = 0) -> TraceContext:
+    trace = TraceContext()
+    for stage, timestamp in (('telegram.date', 0), ('stream.received', 800), ('stream.extracted', 810),
+                             ('stream.published', 860), ('analyze.received', 870), ('analyze.llm', 2870),
+                             ('analyze.published', 2875), ('notify.received', 2880), ('notify.dequeued', 2900),
+                             ('notify.sent', 3100 + offset)):
+        trace.mark(stage, 1_700_000_000_000 + timestamp)
+    return trace
+
+def test_header_round_trip():
+    """每个环节解析上游的头后追加，格式错误的条目被忽略"""
+    headers = TraceContext().mark('stream.received', 1000).mark('stream.published', 1050).inject({'X-Type': 'x'})
+    assert headers[TRACE_HEADER] == 'stream.received=1000,stream.published=1050', headers
+    
+    trace = TraceContext.from_headers(headers).mark('analyze.received', 1100)
+    assert trace.spans == [('stream.received', 1000), ('stream.published', 1050), ('analyze.received', 1100)]
+    
+    assert TraceContext.from_header('a=1,broken,b=x,c=3').spans == [('a', 1), ('c', 3)]
+    assert len(TraceContext.from_headers(None)) == 0
+    assert TraceContext().inject({}) == {}
+    
+    long_trace = TraceContext.from_header(','.join(f's{i}={i}' for i in range(100)))
+    assert len(long_trace.mark('extra')) == MAX_SPANS
+    print("✅ 追踪头读写")
+
+def test_segments_follow_stage_order():
+    """相邻阶段按固定顺序计算（与追加顺序无关），缺失的阶段跳过"""
+    trace = TraceContext().mark('stream.received', 1800).mark('telegram.date', 1000).mark('stream.published', 1900)
+    trace.mark('analyze.received', 1950).mark('analyze.llm', 3950).mark('custom.stage', 9999)
+    
+    assert trace.segments() == [
+        ('telegram.date → stream.received', 800.0),
+        ('stream.received → stream.published', 100.0),
+        ('stream.published → analyze.received', 50.0),
+        ('analyze.received → analyze.llm', 2000.0)
+    ], trace.segments()
+    print("✅ 阶段耗时按顺序计算")
+
+def test_aggregator_report():
+    """汇总各区间分位数和总耗时"""
+    aggregator = TraceAggregator(window=10)
+    for i in range(20):
+        aggregator.record(_full_trace(offset=i))
+    aggregator.record(TraceContext())
+    
+    report = aggregator.report()
+    assert report['recorded'] == 20, report['recorded']
+    segments = list(report['segments'])
+    assert segments[0] == 'telegram.date → stream.received' and segments[-1] == 'notify.dequeued → notify.sent', segments
+    
+    llm = report['segments']['analyze.received → analyze.llm']
+    assert llm['count'] == 10 and llm['p99_ms'] == 2000.0, llm
+    sent = report['segments']['notify.dequeued → notify.sent']
+    assert sent['p50_ms'] in (214.0, 215.0) and sent['p99_ms'] == 219.0, sent
+    assert report['total']['p99_ms'] == 3119.0, report['total']
+    
+    lines = aggregator.format_lines()
+    assert len(lines) == len(segments) + 1 and lines[-1].startswith('总计'), lines
+    assert TraceAggregator().format_lines() == []
+    print("✅ 阶段耗时汇总")
+
+if __name__ == '__main__':
+    try:
+        test_header_round_trip()
+        test_segments_follow_stage_order()
+        test_aggregator_report()
+        print("\n🎉 所有链路追踪测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+链路追踪
+消息经过的每个环节在 NATS 头 X-Trace 中追加 "阶段=毫秒时间戳"，最后一个环节（notification）
+用 TraceAggregator 汇总相邻阶段之间的耗时分布，定位延迟花在哪里
+
+X-Trace: telegram.date=1718000000000,stream.received=1718000000840,stream.extracted=1718000000843,...
+
+时间戳为各进程的墙上时钟（毫秒），跨机器部署时阶段耗时包含时钟偏差；
+telegram.date 来自 Telegram 消息时间，只有秒级精度
+"""
+
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+TRACE_HEADER = 'X-Trace'
+
+# 阶段按消息流经的顺序排列，汇总时按这个顺序计算相邻阶段的耗时
+STAGES = (
+    'telegram.date',       # Telegram 消息时间
+    'stream.received',     # telegramstream 收到事件
+    'stream.extracted',    # telegramstream 完成发送者查询和数据提取
+    'stream.published',    # telegramstream 发布到 NATS
+    'analyze.received',    # analyze_agent 收到消息
+    'analyze.dedup',       # analyze_agent 完成去重检查
+    'analyze.llm',         # analyze_agent 完成 LLM 分析
+    'analyze.published',   # analyze_agent 发布通知
+    'notify.received',     # notification 收到通知
+    'notify.dequeued',     # notification 从发送队列取出
+    'notify.sent'          # notification 发送到所有目标群组
+)
+_STAGE_ORDER = {stage: i for i, stage in enumerate(STAGES)}
+
+# 防止异常消息携带过长的追踪头
+MAX_SPANS = 32
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+class TraceContext:
+    """一条消息的追踪记录: [(阶段, 毫秒时间戳)]"""
+    
+    __slots__ = ('spans',)
+    
+    def __init__(self, spans: Optional[List[Tuple[str, int]]] = None):
+        self.spans: List[Tuple[str, int]] = spans or []
+    
+    def mark(self, stage: str, timestamp_ms: Optional[int] = None) -> 'TraceContext':
+        """记录到达某个阶段的时间，默认当前时间"""
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((stage, now_ms() if timestamp_ms is None else int(timestamp_ms)))
+        return self
+    
+    def get(self, stage: str) -> Optional[int]:
+        for name, timestamp in self.spans:
+            if name == stage:
+                return timestamp
+        return None
+    
+    def __len__(self) -> int:
+        return len(self.spans)
+    
+    def to_header(self) -> str:
+        return ','.join(f"{stage}={timestamp}" for stage, timestamp in self.spans)
+    
+    def inject(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """把追踪记录写入 NATS 头"""
+        if self.spans:
+            headers[TRACE_HEADER] = self.to_header()
+        return headers
+    
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> 'TraceContext':
+        """解析 X-Trace 头，忽略格式错误的条目"""
+        spans = []
+        for item in (value or '').split(',')[:MAX_SPANS]:
+            stage, sep, timestamp = item.partition('=')
+            if not sep:
+                continue
+            try:
+                spans.append((stage.strip(), int(timestamp)))
+            except ValueError:
+                continue
+        return cls(spans)
+    
+    @classmethod
+    def from_headers(cls, headers: Optional[Dict[str, str]]) -> 'TraceContext':
+        """从 NATS 消息头读取追踪记录，没有时返回空记录（由当前环节开始追踪）"""
+        return cls.from_header((headers or {}).get(TRACE_HEADER))
+    
+    def segments(self) -> List[Tuple[str, float]]:
+        """
+        按阶段顺序计算相邻阶段的耗时（毫秒），缺失的阶段跳过，
+        例如没有去重时 analyze.received → analyze.llm 作为一段
+        """
+        known = sorted(
+            ((_STAGE_ORDER[stage], stage, timestamp) for stage, timestamp in self.spans if stage in _STAGE_ORDER)
+        )
+        result = []
+        for (_, previous, start), (_, stage, end) in zip(known, known[1:]):
+            if stage != previous:
+                result.append((f"{previous} → {stage}", float(end - start)))
+        return result
+
+def _percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class TraceAggregator:
+    """
+    汇总已完成消息的阶段耗时
+    
+    每个阶段区间保留最近 window 个样本，报告 p50/p95/p99 和平均值，
+    另外统计第一个阶段到最后一个阶段的总耗时
+    """
+    
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+        self.total: Deque[float] = deque(maxlen=window)
+        self.recorded = 0
+    
+    def record(self, trace: TraceContext):
+        segments = trace.segments()
+        if not segments:
+            return
+        self.recorded += 1
+        total = 0.0
+        for name, duration in segments:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(duration)
+            total += duration
+        self.total.append(total)
+    
+    def report(self) -> Dict[str, Any]:
+        """按阶段顺序输出各区间的耗时分布（毫秒）"""
+        def summarize(values) -> Dict[str, float]:
+            ordered = sorted(values)
+            return {
+                'count': len(ordered),
+                'avg_ms': sum(ordered) / len(ordered) if ordered else 0.0,
+                'p50_ms': _percentile(ordered, 0.50),
+                'p95_ms': _percentile(ordered, 0.95),
+                'p99_ms': _percentile(ordered, 0.99)
+            }
+        
+        def order(name: str) -> Tuple[int, int]:
+            start, _, end = name.partition(' → ')
+            return _STAGE_ORDER.get(start, len(STAGES)), _STAGE_ORDER.get(end, len(STAGES))
+        
+        return {
+            'recorded': self.recorded,
+            'segments': {name: summarize(self.samples[name]) for name in sorted(self.samples, key=order)},
+            'total': summarize(self.total)
+        }
+    
+    def format_lines(self) -> List[str]:
+        """报告的文本形式，每个区间一行"""
+        report = self.report()
+        if not report['recorded']:
+            return []
+        
+        lines = []
+        for name, stats in list(report['segments'].items()) + [('总计', report['total'])]:
+            lines.append(
+                f"{name}: avg {stats['avg_ms']:.0f}ms, p50 {stats['p50_ms']:.0f}ms, "
+                f"p95 {stats['p95_ms']:.0f}ms, p99 {stats['p99_ms']:.0f}ms ({stats['count']} 条)"
+            )
+        return lines
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+消息格式化性能测试
+测量 MessageFormatter.format_notification 和预编译模板的渲染吞吐量，
+并按原文长度分组，检查渲染耗时是否随输出长度线性增长
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# 添加当前目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from main import MessageFormatter
+
+TEXT_LENGTHS = [100, 500, 2000, 4000]
+
+def make_notification(source: str, text_length: int) -> dict:
+    """构造测试通知，原文包含需要转义的 HTML 字符"""
+    text = ('BTC <突破> 10万美元 & ETH 跟涨 🚀 ' * (text_length // 20 + 1))[:text_length]
+    if source == 'twitter':
+        original_data = {
+            'username': 'crypto_trader',
+            'list_url': 'https://x.com/i/lists/123456789',
+            'tweet_url': 'https://x.com/crypto_trader/status/1234567890',
+            'raw_text': text
+        }
+    else:
+        original_data = {
+            'chat_title': 'Crypto Signals',
+            'username': 'crypto_trader',
+            'raw_text': text
+        }
+    
+    return {
+        'data': {
+            'original_message': {'source': source, 'data': original_data},
+            'analysis_results': [{
+                'agent_type': 'sentiment_analysis',
+                'result': {'sentiment': '利多', 'score': 0.85, 'reason': '突破关键价位，市场情绪积极'}
+            }],
+            'summary': {'overall_sentiment': '利多', 'overall_score': 0.85}
+        }
+    }
+
+def measure(func, arg, min_time: float) -> tuple:
+    """重复调用直到超过 min_time 秒，返回 (每秒次数, 单次微秒数)"""
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for _ in range(100):
+            func(arg)
+        count += 100
+        elapsed = time.perf_counter() - start
+    return count / elapsed, elapsed / count * 1e6
+
+def run_benchmark(min_time: float):
+    print("📊 消息格式化性能测试")
+    print(f"{'来源':<10}{'原文长度':>8}{'输出字节':>10}{'渲染/秒':>12}{'微秒/条':>10}{'微秒/KB':>10}{'模板微秒/条':>14}")
+    
+    for source in ('twitter', 'telegram'):
+        for text_length in TEXT_LENGTHS:
+            formatter = MessageFormatter({'max_text_length': text_length})
+            notification = make_notification(source, text_length)
+            output_bytes = len(formatter.format_notification(notification).encode('utf-8'))
+            rate, micros = measure(formatter.format_notification, notification, min_time)
+            
+            # 只测模板渲染（不含字段提取和 HTML 转义）
+            original_data = notification['data']['original_message']['data']
+            sentiment_result = notification['data']['analysis_results'][0]['result']
+            context = formatter._build_context(source, original_data, sentiment_result)
+            _, template_micros = measure(formatter.templates[source].render, context, min_time)
+            
+            print(f"{source:<10}{text_length:>8}{output_bytes:>10}{rate:>12.0f}{micros:>10.2f}"
+                  f"{micros / (output_bytes / 1024):>10.2f}{template_micros:>14.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='消息格式化性能测试')
+    parser.add_argument('--min-time', type=float, default=0.5, help='每组测试的最短运行时间（秒）')
+    args = parser.parse_args()
+    run_benchmark(args.min_time)
+
+if __name__ == '__main__':
+    main()
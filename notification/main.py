@@ -5,26 +5,63 @@ Notification Bot - 通知消息处理器
 """
 
 import asyncio
-import json
+import hashlib
+import heapq
+import itertools
 import logging
+import sys
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from collections import deque
 
 import yaml
 import nats
+from nats.errors import SlowConsumerError
 from telegram import Bot
 from telegram.constants import ParseMode
 from telegram.error import TelegramError, RetryAfter, TimedOut
 
+from rate_limiter import HierarchicalRateLimiter
+from outbox import Outbox, backoff_delay
+from templates import compile_templates
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec, metrics
+from common.logging_util import EventLogger, setup_logging
+from common.tracing import TraceAggregator, TraceContext
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+events = EventLogger(logger)
+
+# 指标（/metrics 接口）
+DELIVERIES = metrics.counter('notification_deliveries_total', '发送到目标群组的尝试次数', ['status'])
+SEND_SECONDS = metrics.histogram('notification_send_seconds', '调用 Telegram Bot API 发送消息的耗时（秒）')
+RATE_LIMIT_WAIT_SECONDS = metrics.histogram(
+    'notification_rate_limit_wait_seconds', '发送前等待限流令牌的时间（秒）',
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+)
+PIPELINE_STAGE_SECONDS = metrics.histogram(
+    'pipeline_stage_seconds', '整条链路相邻阶段之间的耗时（秒），来自 X-Trace 头', ['from', 'to']
+)
+
+# analyze_agent 发布通知时附带的 NATS 头，用于在解析消息体之前过滤
+HEADER_TYPE = 'X-Type'
+HEADER_SOURCE = 'X-Source'
+HEADER_SENTIMENT = 'X-Sentiment'
+HEADER_SCORE = 'X-Score'
+
+SENTIMENT_NAMES = {'bullish': '利多', 'bearish': '利空', 'neutral': '中性'}
+
+# 收到通知时把链路追踪记录附加到通知数据上（只在进程内使用，不参与幂等键和格式化）
+TRACE_KEY = '_trace'
 
 class Config:
     """配置管理器"""
@@ -44,34 +81,8 @@ class Config:
             return yaml.safe_load(f)
     
     def _setup_logging(self):
-        """设置日志配置"""
-        log_config = self.config.get('logging', {})
-        level = getattr(logging, log_config.get('level', 'INFO'))
-        format_str = log_config.get('format', '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        
-        # 配置根日志记录器
-        root_logger = logging.getLogger()
-        root_logger.setLevel(level)
-        
-        # 清除现有处理器
-        for handler in root_logger.handlers[:]:
-            root_logger.removeHandler(handler)
-        
-        # 控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(level)
-        console_formatter = logging.Formatter(format_str)
-        console_handler.setFormatter(console_formatter)
-        root_logger.addHandler(console_handler)
-        
-        # 文件处理器（如果配置了）
-        log_file = log_config.get('file')
-        if log_file:
-            file_handler = logging.FileHandler(log_file, encoding='utf-8')
-            file_handler.setLevel(level)
-            file_formatter = logging.Formatter(format_str)
-            file_handler.setFormatter(file_formatter)
-            root_logger.addHandler(file_handler)
+        """设置日志配置（控制台和文件处理器在后台线程中写入，不阻塞事件循环）"""
+        setup_logging(self.config.get('logging', {}))
     
     def get_nats_config(self) -> Dict[str, Any]:
         """获取NATS配置"""
@@ -92,162 +103,330 @@ class Config:
     def get_error_handling_config(self) -> Dict[str, Any]:
         """获取错误处理配置"""
         return self.config.get('error_handling', {})
+    
+    def get_queue_config(self) -> Dict[str, Any]:
+        """获取发送队列配置"""
+        return self.config.get('queue', {})
+    
+    def get_coalesce_config(self) -> Dict[str, Any]:
+        """获取突发合并配置"""
+        return self.config.get('coalesce', {})
+    
+    def get_outbox_config(self) -> Dict[str, Any]:
+        """获取持久化发送队列配置"""
+        return self.config.get('outbox', {})
+    
+    def get_metrics_config(self) -> Dict[str, Any]:
+        """获取指标接口配置"""
+        return self.config.get('metrics', {})
+    
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """获取链路追踪配置"""
+        return self.config.get('tracing', {})
+
+def get_sentiment_result(notification_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """从通知消息中获取情绪分析结果"""
+    analysis_results = notification_data.get('data', {}).get('analysis_results', [])
+    for result in analysis_results:
+        if result.get('agent_type') == 'sentiment_analysis':
+            return result.get('result', {})
+    return None
 
-class RateLimiter:
-    """限流器"""
-    
-    def __init__(self, max_messages_per_minute: int = 10, cooldown_seconds: int = 3):
-        self.max_messages_per_minute = max_messages_per_minute
-        self.cooldown_seconds = cooldown_seconds
-        self.message_times = deque()
-        self.last_message_time = 0
-    
-    async def wait_if_needed(self):
-        """如果需要，等待以遵守限流规则"""
-        current_time = time.time()
-        
-        # 检查冷却时间
-        time_since_last = current_time - self.last_message_time
-        if time_since_last < self.cooldown_seconds:
-            wait_time = self.cooldown_seconds - time_since_last
-            logger.debug(f"冷却等待 {wait_time:.1f} 秒")
-            await asyncio.sleep(wait_time)
-            current_time = time.time()
-        
-        # 检查每分钟限制
-        one_minute_ago = current_time - 60
-        
-        # 移除一分钟前的记录
-        while self.message_times and self.message_times[0] < one_minute_ago:
-            self.message_times.popleft()
-        
-        # 如果达到限制，等待
-        if len(self.message_times) >= self.max_messages_per_minute:
-            wait_time = self.message_times[0] + 60 - current_time
-            if wait_time > 0:
-                logger.warning(f"达到限流限制，等待 {wait_time:.1f} 秒")
-                await asyncio.sleep(wait_time)
-                current_time = time.time()
-        
-        # 记录当前消息时间
-        self.message_times.append(current_time)
-        self.last_message_time = current_time
+def notification_key(notification_data: Dict[str, Any]) -> str:
+    """通知的幂等键：同一条原始消息的通知（包括 NATS 重复投递）得到相同的键"""
+    ref_id = notification_data.get('data', {}).get('ref_id')
+    if ref_id:
+        return ref_id
+    
+    original_msg = notification_data.get('data', {}).get('original_message', {})
+    original_data = original_msg.get('data', {})
+    source = original_msg.get('source', 'unknown')
+    
+    if source == 'twitter':
+        ident = original_data.get('tweet_url') or original_data.get('tweet_id')
+    elif original_data.get('message_id') is not None:
+        ident = f"{original_data.get('chat_id')}:{original_data.get('message_id')}"
+    else:
+        ident = None
+    
+    if not ident:
+        content = codec.dumps({k: v for k, v in notification_data.items() if k != TRACE_KEY}, sort_keys=True)
+        ident = hashlib.sha1(content).hexdigest()
+    return f"{source}:{ident}"
+
+def combined_key(prefix: str, keys: List[str]) -> str:
+    """多条通知合并后的幂等键"""
+    return f"{prefix}:{hashlib.sha1('|'.join(sorted(keys)).encode()).hexdigest()}"
+
+class PrioritySendQueue:
+    """
+    优先级发送队列
+    
+    优先级 = |score| + age_weight × 等待秒数，强信号优先发送，弱信号随等待时间逐渐提升，
+    不会一直被饿死。由于所有消息的等待时间以相同速度增长，
+    堆中只需保存静态的排序键 -(|score| - age_weight × 入队时间)
+    """
+    
+    def __init__(self, max_size: int = 1000, age_weight: float = 0.01, ttl_seconds: float = 300, clock=time.monotonic):
+        self.max_size = max_size
+        self.age_weight = age_weight
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        
+        # [排序键, 序号, 入队时间, 消息]
+        self._heap: List[list] = []
+        self._counter = itertools.count()
+        self._not_empty = asyncio.Event()
+        
+        # 统计信息
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'dropped_overflow': 0,
+            'expired': 0,
+            'max_depth': 0,
+            'wait_last_ms': 0.0,
+            'wait_max_ms': 0.0,
+            'wait_avg_ms': 0.0
+        }
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def put(self, item: Any, score: float) -> bool:
+        """
+        放入消息
+        
+        Returns:
+            是否入队（队列已满且新消息优先级最低时丢弃新消息）
+        """
+        now = self.clock()
+        entry = [-(abs(score) - self.age_weight * now), next(self._counter), now, item]
+        
+        if len(self._heap) >= self.max_size:
+            # 队列已满，丢弃优先级最低的消息
+            lowest = max(self._heap)
+            if entry >= lowest:
+                self.stats['dropped_overflow'] += 1
+                return False
+            self._heap.remove(lowest)
+            heapq.heapify(self._heap)
+            self.stats['dropped_overflow'] += 1
+        
+        heapq.heappush(self._heap, entry)
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self._heap))
+        self._not_empty.set()
+        return True
+    
+    async def get(self) -> Tuple[Any, float]:
+        """
+        取出优先级最高的消息，队列为空时等待
+        
+        Returns:
+            (消息, 等待秒数)，等待时间超过 ttl_seconds 的消息由调用方按过期处理
+        """
+        while not self._heap:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        
+        _, _, enqueue_time, item = heapq.heappop(self._heap)
+        waited = self.clock() - enqueue_time
+        self._record_wait(waited * 1000)
+        self.stats['dequeued'] += 1
+        return item, waited
+    
+    def is_expired(self, waited: float) -> bool:
+        """等待时间是否超过 TTL"""
+        return self.ttl_seconds > 0 and waited > self.ttl_seconds
+    
+    def drain_expired(self) -> List[Any]:
+        """取出所有等待超过 TTL 的消息（按入队顺序）"""
+        if not self._heap or self.ttl_seconds <= 0:
+            return []
+        
+        deadline = self.clock() - self.ttl_seconds
+        expired = [entry for entry in self._heap if entry[2] < deadline]
+        if not expired:
+            return []
+        
+        self._heap = [entry for entry in self._heap if entry[2] >= deadline]
+        heapq.heapify(self._heap)
+        self.stats['expired'] += len(expired)
+        expired.sort(key=lambda entry: entry[2])
+        return [entry[3] for entry in expired]
+    
+    def drain_all(self) -> List[Any]:
+        """按优先级取出所有消息（停止时持久化用）"""
+        entries = sorted(self._heap)
+        self._heap = []
+        return [entry[3] for entry in entries]
+    
+    def _record_wait(self, wait_ms: float):
+        """记录排队等待时间（指数移动平均）"""
+        self.stats['wait_last_ms'] = wait_ms
+        self.stats['wait_max_ms'] = max(self.stats['wait_max_ms'], wait_ms)
+        if self.stats['dequeued'] == 0:
+            self.stats['wait_avg_ms'] = wait_ms
+        else:
+            self.stats['wait_avg_ms'] = self.stats['wait_avg_ms'] * 0.9 + wait_ms * 0.1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        return {
+            **self.stats,
+            'depth': len(self._heap),
+            'max_size': self.max_size
+        }
 
 class MessageFormatter:
     """消息格式化器"""
     
     def __init__(self, format_config: Dict[str, Any]):
         self.config = format_config
+        self.max_text_length = format_config.get('max_text_length', 500)
+        # 模板只在启动时编译一次，配置错误在启动时暴露
+        self.templates = compile_templates(format_config)
     
     def format_notification(self, notification_data: Dict[str, Any]) -> str:
         """格式化通知消息"""
         try:
-            # 添加调试信息
-            logger.debug(f"开始格式化通知消息，数据结构: {json.dumps(notification_data, ensure_ascii=False, indent=2)[:500]}...")
-            
-            # 提取数据
-            original_msg = notification_data.get('data', {}).get('original_message', {})
-            analysis_results = notification_data.get('data', {}).get('analysis_results', [])
-            summary = notification_data.get('data', {}).get('summary', {})
-            
-            logger.debug(f"提取到的数据 - original_msg: {bool(original_msg)}, analysis_results: {len(analysis_results)}, summary: {bool(summary)}")
-            
-            # 获取原始消息数据
-            original_data = original_msg.get('data', {})
-            logger.debug(f"原始消息数据: {bool(original_data)}, keys: {list(original_data.keys()) if original_data else []}")
-            
-            # 获取消息来源
+            data = notification_data.get('data', {})
+            original_msg = data.get('original_message', {})
             source = original_msg.get('source', 'unknown')
             
             # 获取情绪分析结果
-            sentiment_result = self._get_sentiment_result(analysis_results)
+            sentiment_result = self._get_sentiment_result(data.get('analysis_results', []))
             if not sentiment_result:
                 logger.debug("未找到情绪分析结果")
                 return None
             
-            logger.debug(f"情绪分析结果: {sentiment_result}")
-            
-            # 构建消息
-            message_parts = []
-            
-            # 分析结果和评分
-            sentiment = sentiment_result.get('sentiment', '未知')
-            score = sentiment_result.get('score', 0.0)
-            reason = sentiment_result.get('reason', '无')
-            
-            # 情绪图标
-            emoji = self._get_sentiment_emoji(sentiment, score)
-            
-            # 主要分析结果
-            message_parts.append(f"{emoji} <b>分析结果:</b> {sentiment}")
-            
-            if self.config.get('include_score', True):
-                message_parts.append(f"📊 <b>评分:</b> {score:.2f}")
-            
-            if self.config.get('include_reason', True) and reason != '无':
-                message_parts.append(f"💡 <b>理由:</b> {reason}")
-            
-            # 来源信息 - 根据不同来源显示不同信息
-            if self.config.get('include_source', True):
-                if source == 'twitter':
-                    # Twitter消息
-                    list_url = original_data.get('list_url', '')
-                    username = original_data.get('username', '未知用户')
-                    
-                    # 从列表URL中提取列表名称，如果没有则显示"未知列表"
-                    list_name = '未知列表'
-                    if list_url:
-                        # 尝试从URL中提取列表ID或名称
-                        if '/lists/' in list_url:
-                            list_id = list_url.split('/lists/')[-1].split('?')[0]
-                            list_name = f"列表 {list_id}"
-                        else:
-                            list_name = '未知列表'
-                    
-                    message_parts.append(f"🐦 <b>来源:</b> Twitter - {list_name}")
-                    message_parts.append(f"👤 <b>用户:</b> {username} (@{username})")
-                    
-                    # 添加Twitter链接（如果有）
-                    tweet_url = original_data.get('tweet_url')
-                    if tweet_url:
-                        message_parts.append(f"🔗 <a href=\"{tweet_url}\">查看推文</a>")
-                else:
-                    # Telegram消息
-                    chat_title = original_data.get('chat_title', '未知群组')
-                    message_parts.append(f"📱 <b>来源:</b> Telegram - {chat_title}")
-            
-            # 原文引用
-            raw_text = original_data.get('raw_text') or original_data.get('text', '')
-            if raw_text:
-                # 限制文本长度
-                max_length = self.config.get('max_text_length', 500)
-                if len(raw_text) > max_length:
-                    raw_text = raw_text[:max_length] + '...'
-                
-                message_parts.append(f"\n<pre>{self._escape_html(raw_text)}</pre>")
-            
-            # @原作者 - 仅对Telegram消息显示
-            if source == 'telegram' and self.config.get('include_author', True):
-                username_tg = original_data.get('username')
-                first_name = original_data.get('first_name')
-                
-                if username_tg:
-                    message_parts.append(f"\n👤 @{username_tg}")
-                elif first_name:
-                    message_parts.append(f"\n👤 {first_name}")
-            
-            # 时间戳
-            timestamp = datetime.now().strftime('%H:%M:%S')
-            message_parts.append(f"\n⏰ {timestamp}")
-            
-            result = '\n'.join(message_parts)
-            logger.debug(f"格式化完成，消息长度: {len(result)}")
-            return result
+            # 非 Twitter 来源都使用 Telegram 模板
+            template = self.templates['twitter' if source == 'twitter' else 'telegram']
+            return template.render(self._build_context(source, original_msg.get('data', {}), sentiment_result))
             
         except Exception as e:
             logger.error(f"格式化消息失败: {e}", exc_info=True)
             return None
     
+    def _build_context(self, source: str, original_data: Dict[str, Any], sentiment_result: Dict[str, Any]) -> Dict[str, Any]:
+        """提取模板字段，值为空的字段所在的行不会输出"""
+        sentiment = sentiment_result.get('sentiment', '未知')
+        score = sentiment_result.get('score', 0.0)
+        reason = sentiment_result.get('reason', '无')
+        
+        # 原文引用，限制文本长度
+        raw_text = original_data.get('raw_text') or original_data.get('text', '')
+        if len(raw_text) > self.max_text_length:
+            raw_text = raw_text[:self.max_text_length] + '...'
+        
+        context = {
+            'emoji': self._get_sentiment_emoji(sentiment, score),
+            'sentiment': sentiment,
+            'score': score,
+            'reason': '' if reason == '无' else reason,
+            'text': self._escape_html(raw_text),
+            'time': datetime.now().strftime('%H:%M:%S')
+        }
+        
+        if source == 'twitter':
+            # 从列表URL中提取列表ID
+            list_url = original_data.get('list_url', '')
+            list_name = '未知列表'
+            if '/lists/' in list_url:
+                list_name = f"列表 {list_url.split('/lists/')[-1].split('?')[0]}"
+            
+            context['list_name'] = list_name
+            context['username'] = original_data.get('username', '未知用户')
+            context['tweet_url'] = original_data.get('tweet_url')
+        else:
+            context['chat_title'] = original_data.get('chat_title', '未知群组')
+            # @原作者 - 仅对Telegram消息显示
+            if source == 'telegram':
+                username = original_data.get('username')
+                context['author'] = f"@{username}" if username else original_data.get('first_name')
+        
+        return context
+    
+    def format_brief(self, notification_data: Dict[str, Any], snippet_length: int = 60) -> Optional[str]:
+        """格式化为单行摘要（用于合并消息）"""
+        sentiment_result = get_sentiment_result(notification_data)
+        if not sentiment_result:
+            return None
+        
+        sentiment = sentiment_result.get('sentiment', '未知')
+        score = sentiment_result.get('score', 0.0)
+        original_msg = notification_data.get('data', {}).get('original_message', {})
+        original_data = original_msg.get('data', {})
+        
+        if original_msg.get('source') == 'twitter':
+            origin = f"@{original_data.get('username', '未知用户')}"
+        else:
+            origin = original_data.get('chat_title', '未知群组')
+        
+        raw_text = (original_data.get('raw_text') or original_data.get('text', '')).replace('\n', ' ')
+        if len(raw_text) > snippet_length:
+            raw_text = raw_text[:snippet_length] + '...'
+        
+        emoji = self._get_sentiment_emoji(sentiment, score)
+        return f"{emoji} {sentiment} {score:+.2f} | {self._escape_html(origin)} | {self._escape_html(raw_text)}"
+    
+    def get_symbols(self, notification_data: Dict[str, Any]) -> List[str]:
+        """获取通知对应原始消息中的数字货币符号"""
+        original_msg = notification_data.get('data', {}).get('original_message', {})
+        return self._extract_symbols(original_msg.get('data', {}), original_msg.get('source', 'unknown'))
+    
+    def format_digest(self, notifications: List[Dict[str, Any]]) -> Optional[str]:
+        """把短时间内相关的多条通知合并为一条摘要消息"""
+        results = [(n, get_sentiment_result(n) or {}) for n in notifications]
+        results.sort(key=lambda pair: abs(pair[1].get('score', 0.0)), reverse=True)
+        lines = [line for line in (self.format_brief(n) for n, _ in results) if line]
+        if not lines:
+            return None
+        
+        # 情绪分布和平均评分
+        sentiment_counts: Dict[str, int] = {}
+        for _, result in results:
+            sentiment = result.get('sentiment', '未知')
+            sentiment_counts[sentiment] = sentiment_counts.get(sentiment, 0) + 1
+        dominant = max(sentiment_counts, key=sentiment_counts.get)
+        avg_score = sum(result.get('score', 0.0) for _, result in results) / len(results)
+        
+        symbols: List[str] = []
+        for notification in notifications:
+            for symbol in self.get_symbols(notification):
+                if symbol not in symbols:
+                    symbols.append(symbol)
+        
+        emoji = self._get_sentiment_emoji(dominant, avg_score)
+        message_parts = [f"{emoji} <b>{len(lines)} 条相关信号</b>"]
+        if symbols:
+            message_parts.append(f"💰 <b>币种:</b> {', '.join(symbols[:10])}")
+        distribution = ', '.join(f"{sentiment} {count}" for sentiment, count in sentiment_counts.items())
+        message_parts.append(f"📊 <b>情绪:</b> {distribution}，平均评分 {avg_score:+.2f}")
+        message_parts.append('')
+        
+        max_lines = self.config.get('max_summary_lines', 20)
+        message_parts.extend(lines[:max_lines])
+        if len(lines) > max_lines:
+            message_parts.append(f"... 另有 {len(lines) - max_lines} 条")
+        message_parts.append(f"\n⏰ {datetime.now().strftime('%H:%M:%S')}")
+        return '\n'.join(message_parts)
+    
+    def format_expired_summary(self, notifications: List[Dict[str, Any]]) -> Optional[str]:
+        """把等待超时的多条通知合并为一条消息"""
+        lines = [line for line in (self.format_brief(n) for n in notifications) if line]
+        if not lines:
+            return None
+        
+        max_lines = self.config.get('max_summary_lines', 20)
+        message_parts = [f"⏳ <b>{len(lines)} 条延迟信号合并发送</b>"]
+        message_parts.extend(lines[:max_lines])
+        if len(lines) > max_lines:
+            message_parts.append(f"... 另有 {len(lines) - max_lines} 条")
+        message_parts.append(f"\n⏰ {datetime.now().strftime('%H:%M:%S')}")
+        return '\n'.join(message_parts)
+    
     def _get_sentiment_result(self, analysis_results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         """获取情绪分析结果"""
         for result in analysis_results:
@@ -320,11 +499,130 @@ class MessageFormatter:
             logger.debug(f"提取符号失败: {e}")
             return []
 
+class NotificationCoalescer:
+    """
+    突发合并器
+    
+    第一条通知立即发出并打开一个时间窗口，窗口内币种有重叠（或情绪相同）的后续通知
+    暂存起来，窗口结束时合并为一条摘要发出。单条信号没有额外延迟，
+    突发时每个窗口只发送一次，所有信号最多延迟 window_seconds 秒
+    """
+    
+    def __init__(self, emit: Callable[[List[Dict[str, Any]]], None],
+                 symbol_getter: Callable[[Dict[str, Any]], List[str]],
+                 window_seconds: float = 10.0,
+                 max_group_size: int = 20,
+                 group_by_sentiment: bool = True,
+                 clock=time.monotonic):
+        self.emit = emit
+        self.symbol_getter = symbol_getter
+        self.window_seconds = window_seconds
+        self.max_group_size = max_group_size
+        self.group_by_sentiment = group_by_sentiment
+        self.clock = clock
+        
+        # 按打开时间排序的窗口，截止时间单调递增
+        self._groups: deque = deque()
+        self._wakeup = asyncio.Event()
+        
+        # 统计信息
+        self.stats = {
+            'received': 0,
+            'emitted': 0,
+            'digests': 0,
+            'coalesced': 0
+        }
+    
+    def add(self, notification_data: Dict[str, Any]):
+        """提交一条通知"""
+        self.stats['received'] += 1
+        symbols = set(self.symbol_getter(notification_data))
+        sentiment = (get_sentiment_result(notification_data) or {}).get('sentiment')
+        
+        group = self._find_group(symbols, sentiment)
+        if group is None:
+            # 没有相关窗口：立即发出，并打开新窗口
+            self._groups.append({
+                'symbols': symbols,
+                'sentiment': sentiment,
+                'deadline': self.clock() + self.window_seconds,
+                'pending': []
+            })
+            self._wakeup.set()
+            self._emit([notification_data])
+            return
+        
+        group['symbols'] |= symbols
+        group['pending'].append(notification_data)
+        if len(group['pending']) >= self.max_group_size:
+            self._flush_group(group)
+    
+    def _find_group(self, symbols: set, sentiment: Optional[str]) -> Optional[Dict[str, Any]]:
+        """查找币种重叠或情绪相同的窗口"""
+        now = self.clock()
+        for group in self._groups:
+            if group['deadline'] <= now:
+                continue
+            if symbols & group['symbols']:
+                return group
+            if self.group_by_sentiment and sentiment and sentiment == group['sentiment']:
+                return group
+        return None
+    
+    def _flush_group(self, group: Dict[str, Any]):
+        """发出窗口内暂存的通知"""
+        pending = group['pending']
+        group['pending'] = []
+        if not pending:
+            return
+        if len(pending) > 1:
+            self.stats['digests'] += 1
+            self.stats['coalesced'] += len(pending)
+        self._emit(pending)
+    
+    def _emit(self, notifications: List[Dict[str, Any]]):
+        self.stats['emitted'] += 1
+        try:
+            self.emit(notifications)
+        except Exception as e:
+            logger.error(f"发出合并通知失败: {e}")
+    
+    def flush_all(self):
+        """立即发出所有暂存的通知"""
+        while self._groups:
+            self._flush_group(self._groups.popleft())
+    
+    async def run(self):
+        """按截止时间关闭窗口"""
+        while True:
+            if not self._groups:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            
+            delay = self._groups[0]['deadline'] - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            now = self.clock()
+            while self._groups and self._groups[0]['deadline'] <= now:
+                self._flush_group(self._groups.popleft())
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        return {
+            **self.stats,
+            'open_windows': len(self._groups),
+            'sends_saved': self.stats['received'] - self.stats['emitted']
+        }
+
 class MessageFilter:
     """消息过滤器"""
     
     def __init__(self, filter_config: Dict[str, Any]):
         self.config = filter_config
+        self.min_threshold = filter_config.get('min_score_threshold', 0.0)
+        self.sentiment_filter = set(filter_config.get('sentiment_filter', []))
     
     def should_send(self, notification_data: Dict[str, Any]) -> bool:
         """判断是否应该发送消息"""
@@ -337,27 +635,26 @@ class MessageFilter:
                 logger.debug("没有情绪分析结果，跳过")
                 return False
             
-            sentiment = sentiment_result.get('sentiment', '中性')
-            score = sentiment_result.get('score', 0.0)
-            
-            # 评分阈值过滤（使用绝对值）
-            min_threshold = self.config.get('min_score_threshold', 0.0)
-            if abs(score) < min_threshold:
-                logger.debug(f"评分绝对值 {abs(score):.2f} 低于阈值 {min_threshold}，跳过")
-                return False
-            
-            # 情绪过滤
-            sentiment_filter = self.config.get('sentiment_filter', [])
-            if sentiment_filter and sentiment not in sentiment_filter:
-                logger.debug(f"情绪 {sentiment} 不在过滤列表中，跳过")
-                return False
-            
-            return True
+            return self.check(sentiment_result.get('sentiment', '中性'), sentiment_result.get('score', 0.0))
             
         except Exception as e:
             logger.error(f"过滤判断失败: {e}")
             return False
     
+    def check(self, sentiment: str, score: float) -> bool:
+        """按情绪和评分判断是否应该发送（不需要完整的通知消息）"""
+        # 评分阈值过滤（使用绝对值）
+        if abs(score) < self.min_threshold:
+            events.debug("评分绝对值低于阈值，跳过", score=score, threshold=self.min_threshold)
+            return False
+        
+        # 情绪过滤
+        if self.sentiment_filter and sentiment not in self.sentiment_filter:
+            events.debug("情绪不在过滤列表中，跳过", sentiment=sentiment)
+            return False
+        
+        return True
+    
     def _get_sentiment_result(self, analysis_results: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         """获取情绪分析结果"""
         for result in analysis_results:
@@ -374,8 +671,13 @@ class TelegramNotifier:
         self.rate_limiter = None
         self.message_formatter = None
         self.message_filter = None
+        self.send_queue = None
+        self.expired_policy = 'collapse'
+        self.coalescer = None
+        self.outbox = None
         self.bot = None
         self.target_groups = []
+        self.trace_aggregator = None
         
         self._initialize_components()
     
@@ -386,7 +688,9 @@ class TelegramNotifier:
         if not bot_token or bot_token == 'YOUR_BOT_TOKEN_HERE':
             raise ValueError("请在配置文件中设置有效的 Telegram Bot Token")
         
-        self.bot = Bot(token=bot_token)
+        # base_url 可以指向本地 Bot API 服务器或性能测试的模拟接口
+        base_url = self.telegram_config.get('base_url')
+        self.bot = Bot(token=bot_token, base_url=base_url) if base_url else Bot(token=bot_token)
         
         # 初始化目标群组
         groups = self.telegram_config.get('target_groups', [])
@@ -395,12 +699,18 @@ class TelegramNotifier:
         if not self.target_groups:
             raise ValueError("没有配置启用的目标群组")
         
-        # 初始化限流器
+        # 初始化限流器：Bot 全局令牌桶 + 每个群组的令牌桶
         rate_config = self.config.get_rate_limit_config()
         if rate_config.get('enabled', True):
-            self.rate_limiter = RateLimiter(
-                max_messages_per_minute=rate_config.get('max_messages_per_minute', 10),
-                cooldown_seconds=rate_config.get('cooldown_seconds', 3)
+            global_config = rate_config.get('global', {})
+            per_chat_config = rate_config.get('per_chat', {})
+            self.rate_limiter = HierarchicalRateLimiter(
+                global_limit=global_config.get('max_messages_per_second', 30),
+                global_period=1.0,
+                global_burst=global_config.get('burst', 1),
+                chat_limit=per_chat_config.get('max_messages_per_minute', rate_config.get('max_messages_per_minute', 20)),
+                chat_period=60.0,
+                chat_burst=per_chat_config.get('burst', 3)
             )
         
         # 初始化消息格式化器
@@ -411,91 +721,305 @@ class TelegramNotifier:
         filter_config = self.config.get_filters_config()
         self.message_filter = MessageFilter(filter_config)
         
+        # 初始化优先级发送队列
+        queue_config = self.config.get_queue_config()
+        self.send_queue = PrioritySendQueue(
+            max_size=queue_config.get('max_size', 1000),
+            age_weight=queue_config.get('age_weight', 0.01),
+            ttl_seconds=queue_config.get('ttl_seconds', 300)
+        )
+        self.expired_policy = queue_config.get('expired_policy', 'collapse')
+        if self.expired_policy not in ('drop', 'collapse'):
+            raise ValueError(f"不支持的过期处理策略: {self.expired_policy}，可选: drop, collapse")
+        
+        # 初始化突发合并器
+        coalesce_config = self.config.get_coalesce_config()
+        if coalesce_config.get('enabled', True):
+            self.coalescer = NotificationCoalescer(
+                emit=self._enqueue,
+                symbol_getter=self.message_formatter.get_symbols,
+                window_seconds=coalesce_config.get('window_seconds', 10),
+                max_group_size=coalesce_config.get('max_group_size', 20),
+                group_by_sentiment=coalesce_config.get('group_by_sentiment', True)
+            )
+        
+        # 初始化持久化发送队列
+        outbox_config = self.config.get_outbox_config()
+        self.outbox = Outbox(
+            path=outbox_config.get('path', 'outbox.db'),
+            lease_seconds=outbox_config.get('lease_seconds', 60)
+        )
+        
+        # 链路追踪汇总（notification 是最后一个环节，汇总整条链路的阶段耗时）
+        tracing_config = self.config.get_tracing_config()
+        if tracing_config.get('enabled', True):
+            self.trace_aggregator = TraceAggregator(window=tracing_config.get('window', 1000))
+        
+        error_config = self.config.get_error_handling_config()
+        self.retry_attempts = error_config.get('retry_attempts', 3)
+        self.retry_delay = error_config.get('retry_delay', 5)
+        self.max_retry_delay = error_config.get('max_retry_delay', 300)
+        self.group_names = {str(g.get('chat_id')): g.get('name', str(g.get('chat_id'))) for g in self.target_groups}
+        
         logger.info(f"Telegram通知器初始化完成，目标群组: {len(self.target_groups)} 个")
     
-    async def send_notification(self, notification_data: Dict[str, Any]):
-        """发送通知消息"""
+    def submit_notification(self, notification_data: Dict[str, Any], prefiltered: bool = False) -> bool:
+        """
+        过滤通知消息，经过突发合并后放入发送队列
+        
+        Args:
+            notification_data: 通知消息
+            prefiltered: 是否已经按 NATS 头完成过滤
+        
+        Returns:
+            是否已接收
+        """
         try:
             # 过滤检查
-            if not self.message_filter.should_send(notification_data):
+            if not prefiltered and not self.message_filter.should_send(notification_data):
                 logger.debug("消息被过滤器拦截，不发送")
-                return
-            
-            # 格式化消息
-            message_text = self.message_formatter.format_notification(notification_data)
-            if not message_text:
-                logger.warning("消息格式化失败，跳过发送")
-                return
+                return False
             
-            # 发送到所有目标群组
-            for group in self.target_groups:
-                await self._send_to_group(group, message_text)
+            if self.coalescer:
+                self.coalescer.add(notification_data)
+                return True
+            return self._enqueue([notification_data])
             
         except Exception as e:
-            logger.error(f"发送通知失败: {e}")
+            logger.error(f"提交通知失败: {e}")
+            return False
     
-    async def _send_to_group(self, group: Dict[str, Any], message_text: str):
-        """发送消息到指定群组"""
-        chat_id = group.get('chat_id')
-        group_name = group.get('name', str(chat_id))
-        
-        error_config = self.config.get_error_handling_config()
-        retry_attempts = error_config.get('retry_attempts', 3)
-        retry_delay = error_config.get('retry_delay', 5)
-        
-        for attempt in range(retry_attempts + 1):
+    def _enqueue(self, notifications: List[Dict[str, Any]]) -> bool:
+        """放入发送队列（格式化由发送协程完成）"""
+        score = max(abs((get_sentiment_result(n) or {}).get('score', 0.0)) for n in notifications)
+        keys = [notification_key(n) for n in notifications]
+        job_key = keys[0] if len(keys) == 1 else combined_key('digest', keys)
+        job = {'key': job_key, 'notifications': notifications}
+        if not self.send_queue.put(job, score):
+            logger.warning(f"发送队列已满，丢弃评分 {score:.2f} 的通知")
+            return False
+        return True
+    
+    def _render(self, job: Dict[str, Any]) -> Optional[str]:
+        """格式化发送任务（单条或摘要）"""
+        notifications = job['notifications']
+        if len(notifications) == 1:
+            return self.message_formatter.format_notification(notifications[0])
+        return self.message_formatter.format_digest(notifications)
+    
+    async def run_sender(self):
+        """按优先级从发送队列取出消息并发送（可以同时运行多个）"""
+        while True:
             try:
-                # 限流等待
-                if self.rate_limiter:
-                    await self.rate_limiter.wait_if_needed()
+                await self._handle_expired(self.send_queue.drain_expired())
                 
-                # 发送消息
-                await self.bot.send_message(
-                    chat_id=chat_id,
-                    text=message_text,
-                    parse_mode=ParseMode.HTML,
-                    disable_web_page_preview=True
-                )
+                job, waited = await self.send_queue.get()
+                if self.send_queue.is_expired(waited):
+                    self.send_queue.stats['expired'] += 1
+                    await self._handle_expired([job] + self.send_queue.drain_expired())
+                    continue
                 
-                logger.info(f"✅ 消息已发送到 {group_name} ({chat_id})")
-                return
+                self._trace_job(job, 'notify.dequeued')
+                message_text = self._render(job)
+                if not message_text:
+                    logger.warning("消息格式化失败，跳过发送")
+                    continue
                 
-            except RetryAfter as e:
-                # Telegram限流
-                wait_time = e.retry_after
-                logger.warning(f"Telegram限流，等待 {wait_time} 秒后重试")
-                await asyncio.sleep(wait_time)
+                await self._deliver(job['key'], message_text)
+                self._trace_job(job, 'notify.sent', finished=True)
                 
-            except TimedOut:
-                # 超时错误
-                if attempt < retry_attempts:
-                    logger.warning(f"发送超时，{retry_delay} 秒后重试 ({attempt + 1}/{retry_attempts})")
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error(f"❌ 发送到 {group_name} 超时，已达最大重试次数")
-                    
-            except TelegramError as e:
-                # 其他Telegram错误
-                if "chat not found" in str(e).lower():
-                    logger.error(f"❌ 群组 {group_name} ({chat_id}) 不存在或Bot未加入")
-                    return
-                elif "not enough rights" in str(e).lower():
-                    logger.error(f"❌ Bot在群组 {group_name} 中没有发送消息权限")
-                    return
-                else:
-                    if attempt < retry_attempts:
-                        logger.warning(f"Telegram错误: {e}，{retry_delay} 秒后重试 ({attempt + 1}/{retry_attempts})")
-                        await asyncio.sleep(retry_delay)
-                    else:
-                        logger.error(f"❌ 发送到 {group_name} 失败: {e}")
-                        
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                # 其他未知错误
-                if attempt < retry_attempts:
-                    logger.warning(f"未知错误: {e}，{retry_delay} 秒后重试 ({attempt + 1}/{retry_attempts})")
-                    await asyncio.sleep(retry_delay)
-                else:
-                    logger.error(f"❌ 发送到 {group_name} 失败: {e}")
+                logger.error(f"发送通知失败: {e}")
+    
+    def _trace_job(self, job: Dict[str, Any], stage: str, finished: bool = False):
+        """记录发送任务中每条通知到达的阶段，发送完成后交给汇总器"""
+        if self.trace_aggregator is None:
+            return
+        for notification in job['notifications']:
+            trace = notification.get(TRACE_KEY)
+            if trace is None:
+                continue
+            trace.mark(stage)
+            if finished:
+                self.trace_aggregator.record(trace)
+                for segment, duration_ms in trace.segments():
+                    start, _, end = segment.partition(' → ')
+                    PIPELINE_STAGE_SECONDS.labels(start, end).observe(duration_ms / 1000)
+    
+    async def _handle_expired(self, jobs: List[Dict[str, Any]]):
+        """按配置丢弃或合并等待超时的消息"""
+        if not jobs:
+            return
+        
+        if self.expired_policy == 'drop':
+            logger.warning(f"丢弃 {len(jobs)} 条等待超时的通知")
+            return
+        
+        notifications = [n for job in jobs for n in job['notifications']]
+        summary_text = self.message_formatter.format_expired_summary(notifications)
+        if summary_text:
+            logger.info(f"合并发送 {len(notifications)} 条等待超时的通知")
+            await self._deliver(combined_key('expired', [job['key'] for job in jobs]), summary_text)
+    
+    def _delivery_entries(self, job_key: str, message_text: str) -> List[Tuple[str, Any, str]]:
+        """每个目标群组一条 outbox 记录，幂等键 = hash(通知键:chat_id)"""
+        return [
+            (hashlib.sha1(f"{job_key}:{group.get('chat_id')}".encode()).hexdigest(), group.get('chat_id'), message_text)
+            for group in self.target_groups
+        ]
+    
+    async def _deliver(self, job_key: str, message_text: str):
+        """
+        写入 outbox 后并发发送到所有目标群组
+        
+        每个群组只尝试一次，失败的消息由重试协程按退避时间重发，
+        单个群组的限流和重试不影响其他群组
+        """
+        entries = self._delivery_entries(job_key, message_text)
+        rows = await self.outbox.add_leased(entries)
+        if len(rows) < len(entries):
+            logger.info(f"通知 {job_key} 已在 outbox 中，跳过 {len(entries) - len(rows)} 个重复发送")
+        await self._attempt_many(rows)
+    
+    async def _attempt_many(self, rows: List[Dict[str, Any]]):
+        results = await asyncio.gather(*(self._attempt(row) for row in rows), return_exceptions=True)
+        for row, result in zip(rows, results):
+            if isinstance(result, Exception):
+                logger.error(f"发送到 {row['chat_id']} 异常: {result}")
+    
+    async def _attempt(self, row: Dict[str, Any]):
+        """发送一条 outbox 记录并更新状态"""
+        chat_id = row['chat_id']
+        group_name = self.group_names.get(str(chat_id), str(chat_id))
+        status, detail, retry_after = await self._send_to_group(chat_id, row['text'], row)
+        DELIVERIES.labels(status).inc()
+        
+        if status == 'superseded':
+            # 限流等待超过了租约，记录已由重试协程重新取出，由那次尝试发送
+            logger.debug(f"发送到 {group_name} 的租约已过期，交给重试协程: {row['key']}")
+            return
+        
+        if status == 'sent':
+            await self.outbox.mark_sent(row['key'])
+            events.info("✅ 消息已发送", group=group_name, chat_id=chat_id, attempts=row['attempts'])
+            return
+        
+        if status == 'failed':
+            await self.outbox.mark_failed(row['key'], detail)
+            logger.error(f"❌ 发送到 {group_name} 失败，不再重试: {detail}")
+            return
+        
+        attempts = row['attempts'] + 1
+        if attempts > self.retry_attempts:
+            await self.outbox.mark_failed(row['key'], detail)
+            logger.error(f"❌ 发送到 {group_name} 失败，已达最大重试次数: {detail}")
+            return
+        
+        delay = retry_after if retry_after is not None else backoff_delay(attempts, self.retry_delay, self.max_retry_delay)
+        await self.outbox.reschedule(row['key'], delay, detail)
+        logger.warning(f"发送到 {group_name} 失败: {detail}，{delay:.1f} 秒后重试 ({attempts}/{self.retry_attempts})")
+    
+    async def _send_to_group(self, chat_id: Any, message_text: str,
+                             row: Optional[Dict[str, Any]] = None) -> Tuple[str, str, Optional[float]]:
+        """
+        发送一次消息到指定群组
+        
+        Args:
+            row: 对应的 outbox 记录，限流等待结束后先续租，租约已被其他尝试占用时不发送
+        
+        Returns:
+            (状态, 错误信息, RetryAfter 秒数)，状态为 sent / retry / failed / superseded
+        """
+        try:
+            # 限流等待
+            if self.rate_limiter:
+                RATE_LIMIT_WAIT_SECONDS.observe(await self.rate_limiter.acquire(chat_id))
+            
+            # 等待可能超过租约时长，续租成功后才发送
+            if row is not None and not await self.outbox.renew_lease(row):
+                return 'superseded', '租约已过期', None
+            
+            # 发送消息
+            start = time.perf_counter()
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=message_text,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True
+            )
+            SEND_SECONDS.observe(time.perf_counter() - start)
+            return 'sent', '', None
+            
+        except RetryAfter as e:
+            # Telegram限流：扣除该群组的令牌，按 retry_after 重试
+            wait_time = e.retry_after
+            if isinstance(wait_time, timedelta):
+                wait_time = wait_time.total_seconds()
+            if self.rate_limiter:
+                self.rate_limiter.penalize(chat_id, wait_time)
+            return 'retry', f"Telegram限流 {wait_time} 秒", float(wait_time)
+            
+        except TimedOut:
+            # 超时错误
+            return 'retry', '发送超时', None
+            
+        except TelegramError as e:
+            # 其他Telegram错误
+            if "chat not found" in str(e).lower():
+                return 'failed', '群组不存在或Bot未加入', None
+            elif "not enough rights" in str(e).lower():
+                return 'failed', 'Bot没有发送消息权限', None
+            return 'retry', f"Telegram错误: {e}", None
+            
+        except Exception as e:
+            # 其他未知错误
+            return 'retry', f"未知错误: {e}", None
+    
+    async def run_retry_loop(self):
+        """重发 outbox 中到期的消息（包括上次运行遗留的消息）"""
+        outbox_config = self.config.get_outbox_config()
+        poll_interval = outbox_config.get('poll_interval', 1)
+        batch_size = outbox_config.get('batch_size', 20)
+        retention_seconds = outbox_config.get('retention_hours', 24) * 3600
+        last_purge = 0.0
+        
+        while True:
+            try:
+                rows = await self.outbox.lease_due(batch_size)
+                if rows:
+                    await self._attempt_many(rows)
+                    continue
+                
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    purged = await self.outbox.purge(retention_seconds)
+                    if purged:
+                        logger.info(f"outbox 清理了 {purged} 条过期记录")
+                
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"outbox 重试失败: {e}")
+            
+            await asyncio.sleep(poll_interval)
+    
+    async def persist_pending(self):
+        """停止时把内存中尚未发送的通知写入 outbox，下次启动后发送"""
+        if self.coalescer:
+            self.coalescer.flush_all()
+        
+        jobs = self.send_queue.drain_all()
+        entries = []
+        for job in jobs:
+            message_text = self._render(job)
+            if message_text:
+                entries.extend(self._delivery_entries(job['key'], message_text))
+        if entries:
+            await self.outbox.add_many(entries, leased=False)
+            logger.info(f"已将 {len(jobs)} 条未发送的通知写入 outbox")
+        await self.outbox.close()
 
 class NotificationBot:
     """通知机器人主类"""
@@ -506,6 +1030,20 @@ class NotificationBot:
         self.telegram_notifier = None
         self.running = False
         self.message_count = 0
+        self.subscription = None
+        self.metrics_server = None
+        self._tasks: List[asyncio.Task] = []
+        
+        # 接收统计
+        self.stats = {
+            'received': 0,
+            'decode_errors': 0,
+            'rejected': 0,
+            'header_filtered': 0,
+            'accepted': 0,
+            'slow_consumer': 0,
+            'nats_errors': 0
+        }
     
     async def initialize(self):
         """初始化"""
@@ -517,7 +1055,8 @@ class NotificationBot:
         
         try:
             self.nats_client = await nats.connect(
-                servers=nats_config.get('servers', ['nats://localhost:4222'])
+                servers=nats_config.get('servers', ['nats://localhost:4222']),
+                error_cb=self._nats_error_cb
             )
             logger.info("NATS连接成功")
         except Exception as e:
@@ -539,8 +1078,31 @@ class NotificationBot:
         
         logger.info(f"开始监听NATS subject: {subject}")
         
-        # 订阅通知消息
-        await self.nats_client.subscribe(subject, cb=self._message_handler)
+        # 启动发送协程池和统计日志
+        sender_workers = self.config.get_queue_config().get('sender_workers', 4)
+        for _ in range(max(1, sender_workers)):
+            self._tasks.append(asyncio.create_task(self.telegram_notifier.run_sender()))
+        self._tasks.append(asyncio.create_task(self.telegram_notifier.run_retry_loop()))
+        if self.telegram_notifier.coalescer:
+            self._tasks.append(asyncio.create_task(self.telegram_notifier.coalescer.run()))
+        stats_interval = self.config.get_queue_config().get('stats_interval', 60)
+        if stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._stats_loop(stats_interval)))
+        trace_interval = self.config.get_tracing_config().get('report_interval', 60)
+        if self.telegram_notifier.trace_aggregator and trace_interval > 0:
+            self._tasks.append(asyncio.create_task(self._trace_report_loop(trace_interval)))
+        
+        # 订阅通知消息，回调只做解码、过滤和入队，客户端缓冲上限可配置
+        self.subscription = await self.nats_client.subscribe(
+            subject,
+            cb=self._message_handler,
+            pending_msgs_limit=nats_config.get('pending_msgs_limit', 512 * 1024),
+            pending_bytes_limit=nats_config.get('pending_bytes_limit', 128 * 1024 * 1024)
+        )
+        
+        # 指标接口
+        self._register_metrics()
+        self.metrics_server = await metrics.start_metrics_server(self.config.get_metrics_config(), default_port=9103)
         
         self.running = True
         logger.info("🤖 通知机器人已启动，等待消息...")
@@ -557,31 +1119,172 @@ class NotificationBot:
             logger.info("收到停止信号")
         finally:
             self.running = False
+            if self.metrics_server:
+                await self.metrics_server.stop()
             if self.nats_client:
                 await self.nats_client.close()
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.telegram_notifier.persist_pending()
+    
+    async def _nats_error_cb(self, e):
+        """NATS 错误回调，记录慢消费者事件"""
+        if isinstance(e, SlowConsumerError):
+            self.stats['slow_consumer'] += 1
+            if self.stats['slow_consumer'] == 1 or self.stats['slow_consumer'] % 100 == 0:
+                logger.warning(f"⚠️ NATS 慢消费者: 订阅缓冲已满，累计丢弃 {self.stats['slow_consumer']} 条消息")
+            return
+        self.stats['nats_errors'] += 1
+        logger.error(f"NATS错误: {e}")
+    
+    def _register_metrics(self):
+        """注册抓取时从各组件 stats 读取的计数和队列深度（不在热路径上更新）"""
+        notifier = self.telegram_notifier
+        
+        received = metrics.counter('notification_messages_total', '收到的通知按处理结果计数', ['result'])
+        for result in ('received', 'accepted', 'rejected', 'header_filtered', 'decode_errors'):
+            received.labels(result).set_function(lambda result=result: self.stats[result])
+        
+        dropped = metrics.counter('notification_dropped_total', '丢弃的通知数', ['reason'])
+        dropped.labels('slow_consumer').set_function(lambda: self.stats['slow_consumer'])
+        dropped.labels('queue_overflow').set_function(lambda: notifier.send_queue.stats['dropped_overflow'])
+        dropped.labels('expired').set_function(lambda: notifier.send_queue.stats['expired'])
+        
+        depth = metrics.gauge('notification_queue_depth', '队列当前深度', ['queue'])
+        depth.labels('send').set_function(lambda: len(notifier.send_queue))
+        depth.labels('nats_pending').set_function(lambda: self.subscription.pending_msgs)
+        
+        if notifier.coalescer:
+            metrics.counter('notification_coalesced_total', '合并进摘要的通知数').set_function(
+                lambda: notifier.coalescer.stats['coalesced']
+            )
+        if notifier.rate_limiter:
+            metrics.counter('notification_rate_limit_penalties_total', '收到 RetryAfter 后扣除令牌的次数').set_function(
+                lambda: notifier.rate_limiter.stats['penalties']
+            )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取接收统计信息"""
+        stats = dict(self.stats)
+        if self.subscription:
+            stats['pending_msgs'] = self.subscription.pending_msgs
+            stats['pending_bytes'] = self.subscription.pending_bytes
+        return stats
+    
+    async def _stats_loop(self, interval: float):
+        """定期输出接收和发送统计"""
+        while True:
+            await asyncio.sleep(interval)
+            receive_stats = self.get_stats()
+            logger.info(
+                f"📊 接收: {receive_stats['received']} 条, 入队 {receive_stats['accepted']}, "
+                f"过滤 {receive_stats['rejected']} (按消息头 {receive_stats['header_filtered']}), 解码失败 {receive_stats['decode_errors']}, "
+                f"慢消费者 {receive_stats['slow_consumer']}, "
+                f"订阅缓冲 {receive_stats.get('pending_msgs', 0)} 条 / {receive_stats.get('pending_bytes', 0)} bytes"
+            )
+            stats = self.telegram_notifier.send_queue.get_stats()
+            logger.info(
+                f"📊 发送队列: 深度 {stats['depth']}, 已发送 {stats['dequeued']}/{stats['enqueued']}, "
+                f"过期 {stats['expired']}, 溢出丢弃 {stats['dropped_overflow']}, "
+                f"等待 avg {stats['wait_avg_ms']:.0f}ms / max {stats['wait_max_ms']:.0f}ms"
+            )
+            outbox_stats = await self.telegram_notifier.outbox.get_stats()
+            logger.info(
+                f"📊 outbox: 待发送 {outbox_stats['pending']}, 已发送 {outbox_stats['sent']}, "
+                f"失败 {outbox_stats['failed']}, 最早待发送 {outbox_stats['oldest_pending_age']:.0f} 秒前"
+            )
+            coalescer = self.telegram_notifier.coalescer
+            if coalescer:
+                coalesce_stats = coalescer.get_stats()
+                logger.info(
+                    f"📊 突发合并: 收到 {coalesce_stats['received']}, 发出 {coalesce_stats['emitted']}, "
+                    f"摘要 {coalesce_stats['digests']}, 节省发送 {coalesce_stats['sends_saved']}"
+                )
+    
+    async def _trace_report_loop(self, interval: float):
+        """定期输出链路各阶段的耗时分布"""
+        aggregator = self.telegram_notifier.trace_aggregator
+        while True:
+            await asyncio.sleep(interval)
+            lines = aggregator.format_lines()
+            if not lines:
+                continue
+            logger.info(f"⏱️ 链路延迟（最近 {len(aggregator.total)} 条，累计 {aggregator.recorded} 条）:")
+            for line in lines:
+                logger.info(f"⏱️   {line}")
+    
+    def _check_headers(self, headers: Optional[Dict[str, str]]) -> Optional[bool]:
+        """
+        根据 NATS 头过滤消息
+        
+        Returns:
+            True 通过，False 丢弃，None 表示没有足够的头信息，需要解析消息体后再过滤
+        """
+        if not headers or HEADER_TYPE not in headers:
+            return None
+        
+        if headers.get(HEADER_TYPE) != 'messages.notification':
+            events.debug("跳过非通知消息", type=headers.get(HEADER_TYPE))
+            return False
+        if headers.get(HEADER_SOURCE) != 'analyze_agent':
+            events.debug("跳过非analyze_agent消息", source=headers.get(HEADER_SOURCE))
+            return False
+        
+        sentiment = SENTIMENT_NAMES.get(headers.get(HEADER_SENTIMENT, ''))
+        try:
+            score = float(headers[HEADER_SCORE])
+        except (KeyError, ValueError):
+            return None
+        if sentiment is None:
+            return None
+        
+        return self.telegram_notifier.message_filter.check(sentiment, score)
     
     async def _message_handler(self, msg):
-        """处理接收到的通知消息"""
+        """处理接收到的通知消息：只解码、过滤并放入发送队列，不等待发送"""
+        self.message_count += 1
+        self.stats['received'] += 1
+        trace = None
+        if self.telegram_notifier.trace_aggregator is not None:
+            trace = TraceContext.from_headers(msg.headers).mark('notify.received')
+        
+        # 先按 NATS 头过滤，未通过的消息不解析消息体
+        header_result = self._check_headers(msg.headers)
+        if header_result is False:
+            self.stats['rejected'] += 1
+            self.stats['header_filtered'] += 1
+            return
+        
         try:
-            self.message_count += 1
-            logger.info(f"📨 收到通知消息 #{self.message_count} [subject: {msg.subject}], 大小: {len(msg.data)} bytes")
-            
-            # 解析消息
-            notification_data = json.loads(msg.data.decode())
-            
-            # 验证消息类型
-            if notification_data.get('type') != 'messages.notification':
-                logger.warning(f"跳过非通知消息: type={notification_data.get('type')}")
-                return
-            
-            if notification_data.get('source') != 'analyze_agent':
-                logger.warning(f"跳过非analyze_agent消息: source={notification_data.get('source')}")
-                return
+            notification_data = codec.decode(msg.data, msg.headers)
+        except codec.DecodeError as e:
+            self.stats['decode_errors'] += 1
+            logger.error(f"解析通知消息失败: {e}")
+            return
+        
+        try:
+            if header_result is None:
+                # 没有通知头（旧版本 analyze_agent），按消息体验证类型
+                if notification_data.get('type') != 'messages.notification':
+                    self.stats['rejected'] += 1
+                    events.debug("跳过非通知消息", type=notification_data.get('type'))
+                    return
+                
+                if notification_data.get('source') != 'analyze_agent':
+                    self.stats['rejected'] += 1
+                    logger.warning(f"跳过非analyze_agent消息: source={notification_data.get('source')}")
+                    return
             
-            logger.info(f"处理通知消息: 来自 {notification_data.get('sender')}")
+            events.info("📨 收到通知消息", seq=self.message_count, subject=msg.subject, bytes=len(msg.data))
+            if trace is not None:
+                notification_data[TRACE_KEY] = trace
             
-            # 发送Telegram通知
-            await self.telegram_notifier.send_notification(notification_data)
+            # 放入发送队列，由发送协程池按优先级发送
+            if self.telegram_notifier.submit_notification(notification_data, prefiltered=header_result is True):
+                self.stats['accepted'] += 1
+            else:
+                self.stats['rejected'] += 1
             
         except Exception as e:
             logger.error(f"处理通知消息失败: {e}", exc_info=True)
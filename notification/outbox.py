@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+持久化发送队列（Outbox）
+基于 SQLite 记录每条待发送的 Telegram 消息，保证进程重启后未发送的消息不会丢失
+"""
+
+import asyncio
+import random
+import sqlite3
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+def backoff_delay(attempts: int, base_delay: float, max_delay: float) -> float:
+    """
+    指数退避 + 抖动（equal jitter）
+    
+    第 n 次失败后的等待时间在 [d/2, d] 之间，d = min(max_delay, base_delay × 2^(n-1))
+    """
+    delay = min(max_delay, base_delay * (2 ** max(0, attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class Outbox:
+    """
+    SQLite 发送队列
+    
+    每条记录以幂等键为主键（通知 + 群组），重复写入会被忽略，因此同一通知不会重复发送。
+    记录通过 next_attempt_at 实现租约: 取出待发送记录时把它推迟 lease_seconds 秒，
+    发送成功后标记为 sent；进程在发送过程中退出时，租约到期后会被重新发送（至少一次）。
+    限流等待可能超过租约时长，发送前用 renew_lease() 续租: 租约已被其他尝试重新占用时续租失败，
+    本次尝试放弃发送，同一条记录不会被两个尝试同时发送。
+    所有数据库操作在单独的线程中执行，不阻塞事件循环
+    """
+    
+    def __init__(self, path: str = 'outbox.db', lease_seconds: float = 60, clock=time.time):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                key TEXT PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)')
+    
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+    
+    async def add_many(self, entries: Iterable[Tuple[str, Any, str]], leased: bool = True) -> List[str]:
+        """
+        写入待发送消息
+        
+        Args:
+            entries: (幂等键, chat_id, 消息文本) 列表
+            leased: True 表示调用方会立即发送（先占用租约），False 表示交给重试协程发送
+        
+        Returns:
+            新写入的幂等键（已存在的键被忽略）
+        """
+        return [row['key'] for row in await self._run(self._add_many, list(entries), leased)]
+    
+    async def add_leased(self, entries: Iterable[Tuple[str, Any, str]]) -> List[Dict[str, Any]]:
+        """写入待发送消息并占用租约，返回新写入的记录（格式与 lease_due 相同），调用方立即发送"""
+        return await self._run(self._add_many, list(entries), True)
+    
+    def _add_many(self, entries: List[Tuple[str, Any, str]], leased: bool) -> List[Dict[str, Any]]:
+        now = self.clock()
+        next_attempt_at = now + self.lease_seconds if leased else now
+        inserted = []
+        with self._transaction():
+            for key, chat_id, text in entries:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO outbox (key, chat_id, text, status, attempts, next_attempt_at, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, 0, ?, ?, ?)',
+                    (key, str(chat_id), text, STATUS_PENDING, next_attempt_at, now, now)
+                )
+                if cursor.rowcount:
+                    inserted.append({'key': key, 'chat_id': str(chat_id), 'text': text, 'attempts': 0,
+                                     'lease_until': next_attempt_at})
+        return inserted
+    
+    async def lease_due(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """取出到期的待发送消息，并占用租约"""
+        return await self._run(self._lease_due, limit)
+    
+    def _lease_due(self, limit: int) -> List[Dict[str, Any]]:
+        now = self.clock()
+        lease_until = now + self.lease_seconds
+        with self._transaction():
+            rows = self._conn.execute(
+                'SELECT key, chat_id, text, attempts FROM outbox '
+                'WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?',
+                (STATUS_PENDING, now, limit)
+            ).fetchall()
+            self._conn.executemany(
+                'UPDATE outbox SET next_attempt_at = ?, updated_at = ? WHERE key = ?',
+                [(lease_until, now, row[0]) for row in rows]
+            )
+        return [{'key': key, 'chat_id': chat_id, 'text': text, 'attempts': attempts, 'lease_until': lease_until}
+                for key, chat_id, text, attempts in rows]
+    
+    async def renew_lease(self, row: Dict[str, Any]) -> bool:
+        """
+        发送前续租，租约从现在起重新计算
+        
+        记录的租约仍是 row 取出时占用的那一个才续租成功（row['lease_until'] 更新为新的到期时间）；
+        租约到期后已被重新取出、或者已经发送/失败时返回 False，调用方不应再发送
+        """
+        lease_until = await self._run(self._renew_lease, row['key'], row['lease_until'])
+        if lease_until is None:
+            return False
+        row['lease_until'] = lease_until
+        return True
+    
+    def _renew_lease(self, key: str, expected: float) -> Optional[float]:
+        now = self.clock()
+        lease_until = now + self.lease_seconds
+        cursor = self._conn.execute(
+            'UPDATE outbox SET next_attempt_at = ?, updated_at = ? WHERE key = ? AND status = ? AND next_attempt_at = ?',
+            (lease_until, now, key, STATUS_PENDING, expected)
+        )
+        return lease_until if cursor.rowcount else None
+    
+    async def mark_sent(self, key: str):
+        """标记为已发送"""
+        await self._run(self._update, key, STATUS_SENT, None, None, False)
+    
+    async def mark_failed(self, key: str, error: str):
+        """标记为最终失败，不再重试"""
+        await self._run(self._update, key, STATUS_FAILED, None, error, True)
+    
+    async def reschedule(self, key: str, delay: float, error: str):
+        """记录一次失败，delay 秒后重试"""
+        await self._run(self._update, key, STATUS_PENDING, delay, error, True)
+    
+    def _update(self, key: str, status: str, delay: Optional[float], error: Optional[str], failed_attempt: bool):
+        now = self.clock()
+        next_attempt_at = now + delay if delay is not None else now
+        self._conn.execute(
+            'UPDATE outbox SET status = ?, next_attempt_at = ?, updated_at = ?, '
+            'attempts = attempts + ?, last_error = COALESCE(?, last_error) WHERE key = ?',
+            (status, next_attempt_at, now, 1 if failed_attempt else 0, error, key)
+        )
+    
+    async def purge(self, older_than_seconds: float) -> int:
+        """删除早于指定时间的已发送/已失败记录（保留期内仍可去重）"""
+        return await self._run(self._purge, older_than_seconds)
+    
+    def _purge(self, older_than_seconds: float) -> int:
+        cutoff = self.clock() - older_than_seconds
+        cursor = self._conn.execute(
+            'DELETE FROM outbox WHERE status != ? AND updated_at < ?',
+            (STATUS_PENDING, cutoff)
+        )
+        return cursor.rowcount
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """按状态统计记录数"""
+        return await self._run(self._get_stats)
+    
+    def _get_stats(self) -> Dict[str, Any]:
+        stats = {STATUS_PENDING: 0, STATUS_SENT: 0, STATUS_FAILED: 0}
+        for status, count in self._conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status'):
+            stats[status] = count
+        
+        oldest = self._conn.execute(
+            'SELECT MIN(created_at) FROM outbox WHERE status = ?', (STATUS_PENDING,)
+        ).fetchone()[0]
+        stats['oldest_pending_age'] = self.clock() - oldest if oldest else 0.0
+        return stats
+    
+    def _transaction(self):
+        return _Transaction(self._conn)
+    
+    async def close(self):
+        """关闭数据库"""
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+class _Transaction:
+    """显式事务（连接使用 autocommit 模式）"""
+    
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+    
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
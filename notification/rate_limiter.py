@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+分层令牌桶限流器
+模拟 Telegram Bot 的发送限制: Bot 全局约 30 条/秒，单个群组约 20 条/分钟
+"""
+
+import asyncio
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    令牌桶（虚拟调度实现）
+    
+    不保存令牌数，而是记录理论到达时间 (TAT)，这样可以为未来的时间点预约令牌:
+    reserve() 立即扣除一个令牌并返回可以发送的时间点，调用方只需等待到该时间点。
+    
+    为保证任意 period 长度的窗口内不超过 limit 条，持续速率取 (limit - burst + 1) / period:
+    burst 为 1 时严格按 period / limit 的间隔发送，burst 越大越能容忍突发，但持续速率相应降低
+    """
+    
+    def __init__(self, limit: int, period: float, burst: int = 1):
+        if limit <= 0 or period <= 0:
+            raise ValueError("限流上限和周期必须大于 0")
+        burst = max(1, min(burst, limit))
+        
+        self.limit = limit
+        self.period = period
+        self.burst = burst
+        self.interval = period / (limit - burst + 1)  # 每个令牌的补充间隔
+        self.tolerance = (burst - 1) * self.interval  # 允许提前发送的时间
+        self.tat = 0.0  # 理论到达时间
+        self.blocked_until = 0.0  # RetryAfter 惩罚截止时间
+    
+    def reserve(self, at: float) -> float:
+        """预约一个令牌，返回不早于 at 的可发送时间点"""
+        start = max(at, self.tat - self.tolerance, self.blocked_until)
+        self.tat = max(self.tat, start) + self.interval
+        return start
+    
+    def penalize(self, retry_after: float, now: float):
+        """收到 RetryAfter 时清空令牌并扣除 retry_after 时长的额度"""
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.tat = max(self.tat, self.blocked_until + self.tolerance)
+    
+    def available(self, now: float) -> float:
+        """当前可立即使用的令牌数"""
+        if now < self.blocked_until:
+            return 0.0
+        debt = max(0.0, self.tat - now)
+        return max(0.0, self.burst - debt / self.interval)
+
+class HierarchicalRateLimiter:
+    """
+    分层限流器: 每条消息需要同时获得群组令牌和 Bot 全局令牌
+    
+    每个群组有独立的令牌桶，不同群组之间互不阻塞，只共享全局令牌桶。
+    clock 和 sleep 可注入，便于用模拟时钟测试
+    """
+    
+    def __init__(self,
+                 global_limit: int = 30,
+                 global_period: float = 1.0,
+                 global_burst: int = 1,
+                 chat_limit: int = 20,
+                 chat_period: float = 60.0,
+                 chat_burst: int = 3,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Any] = asyncio.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.chat_limit = chat_limit
+        self.chat_period = chat_period
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_limit, global_period, global_burst)
+        self.chat_buckets: Dict[Any, TokenBucket] = {}
+        
+        # 统计信息
+        self.stats = {
+            'acquired': 0,
+            'delayed': 0,
+            'total_wait': 0.0,
+            'max_wait': 0.0,
+            'penalties': 0
+        }
+    
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_limit, self.chat_period, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+    
+    async def acquire(self, chat_id: Any) -> float:
+        """
+        等待直到可以向 chat_id 发送一条消息
+        
+        先等待群组令牌，再预约全局令牌，被群组限流的消息不会提前占用全局额度
+        
+        Returns:
+            实际等待的秒数
+        """
+        start_time = self.clock()
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            now = self.clock()
+            delay = chat_bucket.reserve(now) - now
+            if delay > 0:
+                await self.sleep(delay)
+            
+            now = self.clock()
+            delay = self.global_bucket.reserve(now) - now
+            if delay > 0:
+                await self.sleep(delay)
+            
+            # 等待期间收到 RetryAfter 时，之前的预约作废，重新预约
+            now = self.clock()
+            if now >= chat_bucket.blocked_until and now >= self.global_bucket.blocked_until:
+                break
+        
+        # 全局限流推迟了发送时间时，群组令牌也按实际发送时间计算
+        chat_bucket.tat = max(chat_bucket.tat, now + chat_bucket.interval)
+        
+        waited = now - start_time
+        self.stats['acquired'] += 1
+        if waited > 0:
+            self.stats['delayed'] += 1
+            self.stats['total_wait'] += waited
+            self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+        return waited
+    
+    def penalize(self, chat_id: Optional[Any], retry_after: float):
+        """
+        处理 Telegram RetryAfter
+        
+        Args:
+            chat_id: 触发限流的群组，None 表示 Bot 全局限流
+            retry_after: Telegram 返回的等待秒数
+        """
+        now = self.clock()
+        bucket = self.global_bucket if chat_id is None else self._chat_bucket(chat_id)
+        bucket.penalize(retry_after, now)
+        self.stats['penalties'] += 1
+        logger.warning(f"Telegram限流 (chat: {chat_id if chat_id is not None else 'global'})，{retry_after} 秒内暂停发送")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计信息"""
+        now = self.clock()
+        acquired = self.stats['acquired']
+        return {
+            **self.stats,
+            'avg_wait': self.stats['total_wait'] / acquired if acquired else 0.0,
+            'global_available': self.global_bucket.available(now),
+            'chats': len(self.chat_buckets)
+        }
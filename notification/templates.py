@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+通知消息模板
+启动时把 message_format 配置编译为按来源区分的模板，渲染时只按顺序拼接预先解析好的片段
+"""
+
+from string import Formatter
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+COMMON_FIELDS = ('emoji', 'sentiment', 'score', 'reason', 'text', 'time')
+
+# 每种来源的模板可以使用的字段
+SOURCE_FIELDS = {
+    'twitter': COMMON_FIELDS + ('list_name', 'username', 'tweet_url'),
+    'telegram': COMMON_FIELDS + ('chat_title', 'author'),
+}
+
+# 片段: (字面文本, None, None) 或 (None, 字段名, 格式说明)
+Segment = Tuple[Any, Any, Any]
+
+def default_templates(format_config: Dict[str, Any]) -> Dict[str, List[str]]:
+    """根据 include_* 开关生成默认模板（与原有消息格式一致）"""
+    header = ['{emoji} <b>分析结果:</b> {sentiment}']
+    if format_config.get('include_score', True):
+        header.append('📊 <b>评分:</b> {score:.2f}')
+    if format_config.get('include_reason', True):
+        header.append('💡 <b>理由:</b> {reason}')
+    
+    twitter = list(header)
+    telegram = list(header)
+    if format_config.get('include_source', True):
+        twitter.extend([
+            '🐦 <b>来源:</b> Twitter - {list_name}',
+            '👤 <b>用户:</b> {username} (@{username})',
+            '🔗 <a href="{tweet_url}">查看推文</a>',
+        ])
+        telegram.append('📱 <b>来源:</b> Telegram - {chat_title}')
+    
+    twitter.append('\n<pre>{text}</pre>')
+    telegram.append('\n<pre>{text}</pre>')
+    if format_config.get('include_author', True):
+        telegram.append('\n👤 {author}')
+    
+    twitter.append('\n⏰ {time}')
+    telegram.append('\n⏰ {time}')
+    return {'twitter': twitter, 'telegram': telegram}
+
+class CompiledTemplate:
+    """
+    预编译的消息模板
+    
+    模板由若干行组成，每行使用 str.format 语法引用字段，例如 "📊 <b>评分:</b> {score:.2f}"。
+    编译时解析并校验字段名，渲染时不再解析模板；某行引用的字段为空（None 或空字符串）时整行省略
+    """
+    
+    def __init__(self, lines: Union[str, Sequence[str]], fields: Sequence[str] = ()):
+        if isinstance(lines, str):
+            lines = lines.split('\n')
+        self.fields = frozenset(fields)
+        self._lines = [self._compile_line(line) for line in lines]
+    
+    def _compile_line(self, line: str) -> Tuple[Tuple[Segment, ...], Tuple[str, ...]]:
+        segments: List[Segment] = []
+        names: List[str] = []
+        for literal, name, spec, conversion in Formatter().parse(line):
+            if literal:
+                segments.append((literal, None, None))
+            if name is None:
+                continue
+            if conversion or '{' in (spec or ''):
+                raise ValueError(f"模板不支持转换或嵌套格式: {line}")
+            if self.fields and name not in self.fields:
+                raise ValueError(f"模板引用了未知字段 '{name}'，可用字段: {', '.join(sorted(self.fields))}")
+            segments.append((None, name, spec))
+            if name not in names:
+                names.append(name)
+        return tuple(segments), tuple(names)
+    
+    def render(self, context: Dict[str, Any]) -> str:
+        """按上下文渲染消息"""
+        output = []
+        for segments, names in self._lines:
+            if any(context.get(name) in (None, '') for name in names):
+                continue
+            output.append(''.join(
+                literal if name is None else format(context[name], spec)
+                for literal, name, spec in segments
+            ))
+        return '\n'.join(output)
+
+def compile_templates(format_config: Dict[str, Any]) -> Dict[str, CompiledTemplate]:
+    """编译所有来源的模板，message_format.templates 中的自定义模板覆盖默认模板"""
+    templates = default_templates(format_config)
+    for source, lines in (format_config.get('templates') or {}).items():
+        if source not in SOURCE_FIELDS:
+            raise ValueError(f"未知的模板来源 '{source}'，可用来源: {', '.join(SOURCE_FIELDS)}")
+        templates[source] = lines
+    return {source: CompiledTemplate(lines, SOURCE_FIELDS[source]) for source, lines in templates.items()}
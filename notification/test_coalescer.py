@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+突发合并器测试
+使用模拟时钟验证按币种重叠和情绪分组、窗口到期、组大小上限和摘要发送
+"""
+
+import asyncio
+import sys
+import tempfile
+
+from main import MessageFormatter, NotificationCoalescer
+from test_delivery import _make_notifier
+from test_outbox import FakeClock
+from test_rate_limiter import SimulatedClock
+
+_message_ids = iter(range(1, 10_000))
+
+def _notification(symbols, sentiment='利多', score=0.8, text='信号'):
+    return {
+        'data': {
+            'analysis_results': [{
+                'agent_type': 'sentiment_analysis',
+                'result': {'sentiment': sentiment, 'score': score, 'reason': '测试'}
+            }],
+            'original_message': {
+                'source': 'telegram',
+                'data': {
+                    'chat_id': -1, 'message_id': next(_message_ids), 'chat_title': 'Signals',
+                    'text': text, 'extracted_data': {'symbols': symbols}
+                }
+            }
+        }
+    }
+
+def _make_coalescer(clock: FakeClock, **kwargs):
+    emitted = []
+    coalescer = NotificationCoalescer(
+        emit=emitted.append,
+        symbol_getter=MessageFormatter({}).get_symbols,
+        clock=clock,
+        **{'window_seconds': 10, **kwargs}
+    )
+    return coalescer, emitted
+
+def _texts(batch):
+    return [n['data']['original_message']['data']['text'] for n in batch]
+
+def test_symbol_overlap():
+    """第一条立即发出，窗口内币种重叠的通知暂存，其他币种另开窗口"""
+    clock = FakeClock()
+    coalescer, emitted = _make_coalescer(clock, group_by_sentiment=False)
+    coalescer.add(_notification(['BTC'], text='btc-1'))
+    coalescer.add(_notification(['btc', 'ETH'], text='btc-eth'))
+    coalescer.add(_notification(['ETH'], sentiment='利空', text='eth'))  # 与窗口合并后的币种重叠
+    coalescer.add(_notification(['SOL'], text='sol'))
+    
+    assert [_texts(batch) for batch in emitted] == [['btc-1'], ['sol']], emitted
+    
+    coalescer.flush_all()
+    assert [_texts(batch) for batch in emitted[2:]] == [['btc-eth', 'eth']]
+    assert coalescer.get_stats() == {'received': 4, 'emitted': 3, 'digests': 1, 'coalesced': 2,
+                                     'open_windows': 0, 'sends_saved': 1}
+    print("✅ 币种重叠的通知合并")
+
+def test_sentiment_grouping():
+    """没有共同币种时按情绪分组，关闭 group_by_sentiment 后各自发出"""
+    for group_by_sentiment, expected in ((True, [['a'], ['b', 'c']]), (False, [['a'], ['b'], ['c']])):
+        coalescer, emitted = _make_coalescer(FakeClock(), group_by_sentiment=group_by_sentiment)
+        coalescer.add(_notification(['BTC'], sentiment='利多', text='a'))
+        coalescer.add(_notification([], sentiment='利多', text='b'))
+        coalescer.add(_notification(['DOGE'], sentiment='利多', text='c'))
+        coalescer.add(_notification([], sentiment='利空', text='d'))
+        coalescer.flush_all()
+        
+        batches = [_texts(batch) for batch in emitted if batch[0]['data']['original_message']['data']['text'] != 'd']
+        assert batches == expected, (group_by_sentiment, batches)
+    print("✅ 按情绪分组")
+
+def test_window_expiry():
+    """窗口到期后 run() 发出暂存的通知，之后的通知重新打开窗口"""
+    async def run():
+        clock = FakeClock()
+        coalescer, emitted = _make_coalescer(clock)
+        coalescer.add(_notification(['BTC'], text='first'))
+        coalescer.add(_notification(['BTC'], text='second'))
+        coalescer.add(_notification(['BTC'], text='third'))
+        
+        assert len(emitted) == 1, "窗口未到期不应发出"
+        
+        # 时钟推进到截止时间后启动 run()，不需要真实等待
+        clock.now += 10
+        runner = asyncio.create_task(coalescer.run())
+        await asyncio.sleep(0.01)
+        assert [_texts(batch) for batch in emitted] == [['first'], ['second', 'third']], emitted
+        assert coalescer.get_stats()['open_windows'] == 0
+        
+        coalescer.add(_notification(['BTC'], text='fourth'))
+        assert _texts(emitted[-1]) == ['fourth']
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+    
+    asyncio.run(run())
+    print("✅ 窗口到期发出")
+
+def test_expired_window_not_joined():
+    """已过截止时间但 run() 尚未关闭的窗口不再接收通知"""
+    clock = FakeClock()
+    coalescer, emitted = _make_coalescer(clock)
+    coalescer.add(_notification(['BTC'], text='first'))
+    clock.now += 10
+    coalescer.add(_notification(['BTC'], text='late'))
+    assert [_texts(batch) for batch in emitted] == [['first'], ['late']]
+    print("✅ 到期窗口不再合并")
+
+def test_max_group_size():
+    """暂存数量达到 max_group_size 时立即发出，窗口继续接收"""
+    coalescer, emitted = _make_coalescer(FakeClock(), max_group_size=3)
+    for i in range(8):
+        coalescer.add(_notification(['BTC'], text=f"m{i}"))
+    
+    assert [_texts(batch) for batch in emitted] == [['m0'], ['m1', 'm2', 'm3'], ['m4', 'm5', 'm6']], emitted
+    coalescer.flush_all()
+    assert _texts(emitted[-1]) == ['m7']
+    stats = coalescer.get_stats()
+    assert stats['digests'] == 2 and stats['coalesced'] == 6 and stats['sends_saved'] == 4, stats
+    print("✅ max_group_size 提前发出")
+
+def test_emit_error_isolated():
+    """emit 抛出异常时合并器继续工作"""
+    def emit(batch):
+        raise RuntimeError('队列不可用')
+    
+    coalescer = NotificationCoalescer(emit=emit, symbol_getter=MessageFormatter({}).get_symbols, clock=FakeClock())
+    coalescer.add(_notification(['BTC']))
+    coalescer.add(_notification(['BTC']))
+    coalescer.flush_all()
+    assert coalescer.get_stats()['emitted'] == 2
+    print("✅ emit 异常不影响合并器")
+
+def test_digest_emit_path():
+    """合并后的通知作为一个摘要任务进入发送队列，渲染为摘要消息"""
+    with tempfile.TemporaryDirectory() as tmp:
+        notifier = _make_notifier(tmp, SimulatedClock())
+        clock = FakeClock()
+        notifier.coalescer = NotificationCoalescer(emit=notifier._enqueue,
+                                                   symbol_getter=notifier.message_formatter.get_symbols,
+                                                   window_seconds=10, clock=clock)
+        
+        assert notifier.submit_notification(_notification(['BTC'], score=0.5, text='first'), prefiltered=True)
+        notifier.submit_notification(_notification(['BTC'], score=0.6, text='second'), prefiltered=True)
+        notifier.submit_notification(_notification(['BTC', 'ETH'], sentiment='利空', score=-0.9, text='third'),
+                                     prefiltered=True)
+        notifier.coalescer.flush_all()
+        
+        jobs = notifier.send_queue.drain_all()
+        assert [len(job['notifications']) for job in jobs] == [2, 1], jobs
+        digest, single = jobs
+        assert digest['key'].startswith('digest:') and single['key'].startswith('telegram:-1:'), jobs
+        
+        text = notifier._render(digest)
+        assert '2 条相关信号' in text and 'BTC, ETH' in text, text
+        assert text.index('third') < text.index('second'), "摘要按评分绝对值排序"
+        assert '分析结果' in notifier._render(single)
+        notifier.outbox._conn.close()
+    print("✅ 摘要进入发送队列并渲染")
+
+if __name__ == '__main__':
+    try:
+        test_symbol_overlap()
+        test_sentiment_grouping()
+        test_window_expiry()
+        test_expired_window_not_joined()
+        test_max_group_size()
+        test_emit_error_isolated()
+        test_digest_emit_path()
+        print("\n🎉 所有突发合并器测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
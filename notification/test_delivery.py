@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+发送路径测试: outbox 租约与限流等待
+突发通知在同一群组排队，限流等待超过租约时长时，重试协程会重新取出这些记录，
+每条消息仍然只发送一次
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from collections import Counter
+
+import yaml
+
+from main import Config, TelegramNotifier
+from outbox import Outbox, STATUS_PENDING
+from rate_limiter import HierarchicalRateLimiter
+from test_rate_limiter import SimulatedClock
+
+CHAT_ID = -100
+LEASE_SECONDS = 60
+
+class InlineOutbox(Outbox):
+    """在事件循环中直接执行数据库操作，模拟时钟推进时不会有未完成的线程任务"""
+    
+    async def _run(self, func, *args):
+        return func(*args)
+
+class FakeBot:
+    def __init__(self, clock: SimulatedClock):
+        self.clock = clock
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((self.clock.time(), chat_id, text))
+
+def _make_notifier(tmp: str, clock: SimulatedClock) -> TelegramNotifier:
+    config_path = os.path.join(tmp, 'config.yml')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump({
+            'telegram': {'bot_token': '123456:TEST', 'target_groups': [{'chat_id': CHAT_ID, 'name': 'test'}]},
+            'outbox': {'path': os.path.join(tmp, 'unused.db')},
+            'logging': {'level': 'WARNING'}
+        }, f)
+    
+    notifier = TelegramNotifier(Config(config_path))
+    notifier.outbox._conn.close()
+    notifier.outbox = InlineOutbox(os.path.join(tmp, 'outbox.db'), lease_seconds=LEASE_SECONDS, clock=clock.time)
+    notifier.rate_limiter = HierarchicalRateLimiter(chat_limit=20, chat_period=60.0, chat_burst=3,
+                                                    clock=clock.time, sleep=clock.sleep)
+    notifier.bot = FakeBot(clock)
+    return notifier
+
+async def _retry_loop(notifier: TelegramNotifier, clock: SimulatedClock, leased: list):
+    """与 run_retry_loop 相同，轮询间隔使用模拟时钟，全部发送后退出"""
+    while (await notifier.outbox.get_stats())[STATUS_PENDING]:
+        rows = await notifier.outbox.lease_due()
+        leased.extend(row['key'] for row in rows)
+        if rows:
+            await notifier._attempt_many(rows)
+            continue
+        await clock.sleep(1)
+
+def test_rate_limit_wait_longer_than_lease():
+    """25 条通知同时发往一个群组（约 18 条/分钟），最后几条的限流等待超过 60 秒租约"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            clock = SimulatedClock()
+            notifier = _make_notifier(tmp, clock)
+            leased = []
+            
+            deliveries = [notifier._deliver(f"job-{i}", f"通知 {i}") for i in range(25)]
+            await clock.run(*deliveries, _retry_loop(notifier, clock, leased))
+            
+            texts = Counter(text for _, _, text in notifier.bot.sent)
+            assert leased, "限流等待应超过租约，重试协程需要重新取出记录"
+            assert max(at for at, _, _ in notifier.bot.sent) > LEASE_SECONDS
+            assert len(texts) == 25 and set(texts.values()) == {1}, texts.most_common(3)
+            await notifier.outbox.close()
+            print(f"✅ 限流等待超过租约: 重试协程重新取出 {len(leased)} 条，25 条消息各发送一次")
+    
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    try:
+        test_rate_limit_wait_longer_than_lease()
+        print("\n🎉 所有发送路径测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
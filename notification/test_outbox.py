@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+持久化发送队列测试
+验证幂等写入、租约、退避重试和重启后恢复
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+from outbox import Outbox, backoff_delay, STATUS_PENDING
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+
+def test_idempotent_add():
+    """同一幂等键只写入一次"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            outbox = Outbox(os.path.join(tmp, 'outbox.db'), clock=FakeClock())
+            first = await outbox.add_many([('k1', -1, 'a'), ('k2', -2, 'b')])
+            second = await outbox.add_many([('k1', -1, 'a'), ('k3', -3, 'c')])
+            
+            assert first == ['k1', 'k2']
+            assert second == ['k3']
+            assert (await outbox.get_stats())[STATUS_PENDING] == 3
+            await outbox.close()
+            print("✅ 重复的幂等键被忽略")
+    
+    asyncio.run(run())
+
+def test_lease_and_reschedule():
+    """租约期内不会被重复取出，失败后按退避时间重试"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            clock = FakeClock()
+            outbox = Outbox(os.path.join(tmp, 'outbox.db'), lease_seconds=60, clock=clock)
+            await outbox.add_many([('k1', -1, 'a')], leased=False)
+            
+            rows = await outbox.lease_due()
+            assert [row['key'] for row in rows] == ['k1']
+            assert await outbox.lease_due() == [], "租约期内不应重复取出"
+            
+            await outbox.reschedule('k1', 10, '发送超时')
+            clock.now += 5
+            assert await outbox.lease_due() == []
+            clock.now += 5
+            rows = await outbox.lease_due()
+            assert rows[0]['attempts'] == 1
+            
+            await outbox.mark_sent('k1')
+            clock.now += 1000
+            assert await outbox.lease_due() == []
+            assert await outbox.purge(500) == 1
+            await outbox.close()
+            print("✅ 租约与退避重试正确")
+    
+    asyncio.run(run())
+
+def test_recovery_after_restart():
+    """进程在发送过程中退出，租约到期后消息会被重新发送"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'outbox.db')
+            clock = FakeClock()
+            outbox = Outbox(path, lease_seconds=60, clock=clock)
+            await outbox.add_many([('k1', -1, 'a')])  # 已占用租约，准备立即发送
+            await outbox.close()
+            
+            outbox = Outbox(path, lease_seconds=60, clock=clock)
+            assert await outbox.lease_due() == []
+            clock.now += 61
+            rows = await outbox.lease_due()
+            assert [row['text'] for row in rows] == ['a']
+            await outbox.close()
+            print("✅ 重启后未确认的消息会被重新发送")
+    
+    asyncio.run(run())
+
+def test_renew_lease():
+    """续租只对仍持有的租约生效，租约到期后被重新取出时原来的尝试续租失败"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            clock = FakeClock()
+            outbox = Outbox(os.path.join(tmp, 'outbox.db'), lease_seconds=60, clock=clock)
+            first = (await outbox.add_leased([('k1', -1, 'a')]))[0]
+            assert first['lease_until'] == 1060.0
+            
+            clock.now += 50
+            assert await outbox.renew_lease(first) and first['lease_until'] == 1110.0
+            clock.now += 30
+            assert await outbox.lease_due() == [], "续租后不应被重新取出"
+            
+            clock.now += 40
+            second = (await outbox.lease_due())[0]
+            assert not await outbox.renew_lease(first), "租约已被重新取出，原来的尝试不能续租"
+            assert await outbox.renew_lease(second)
+            await outbox.mark_sent('k1')
+            assert not await outbox.renew_lease(second), "已发送的记录不能续租"
+            await outbox.close()
+            print("✅ 续租只对当前租约生效")
+    
+    asyncio.run(run())
+
+def test_backoff_delay():
+    """指数退避带抖动且不超过上限"""
+    for attempts in range(1, 10):
+        expected = min(300, 5 * 2 ** (attempts - 1))
+        delay = backoff_delay(attempts, 5, 300)
+        assert expected / 2 <= delay <= expected
+    print("✅ 指数退避带抖动")
+
+if __name__ == '__main__':
+    try:
+        test_idempotent_add()
+        test_lease_and_reschedule()
+        test_recovery_after_restart()
+        test_renew_lease()
+        test_backoff_delay()
+        print("\n🎉 所有 outbox 测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+限流器测试
+使用模拟时钟和模拟 Telegram 服务器（按滑动窗口执行全局和群组限制），
+验证限流器在不触发 429 的前提下达到限流上限
+"""
+
+import asyncio
+import heapq
+import sys
+from collections import defaultdict, deque
+
+from rate_limiter import HierarchicalRateLimiter, TokenBucket
+
+class SimulatedClock:
+    """模拟时钟: sleep() 不真正等待，由 run() 在所有协程都在等待时推进时间"""
+    
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+        self._seq = 0
+    
+    def time(self) -> float:
+        return self.now
+    
+    async def sleep(self, delay: float):
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._sleepers, (self.now + delay, self._seq, future))
+        await future
+    
+    async def run(self, *coroutines):
+        """运行协程直到全部完成，期间按最早的唤醒时间推进时钟"""
+        tasks = [asyncio.ensure_future(c) for c in coroutines]
+        while not all(task.done() for task in tasks):
+            for _ in range(20):
+                await asyncio.sleep(0)
+            if self._sleepers:
+                deadline, _, future = heapq.heappop(self._sleepers)
+                self.now = max(self.now, deadline)
+                future.set_result(None)
+        return await asyncio.gather(*tasks)
+
+class FakeTelegramServer:
+    """模拟 Telegram Bot API 限流: 全局每秒 30 条，每个群组每分钟 20 条"""
+    
+    # 时间精度，避免浮点累加误差被判定为超限
+    RESOLUTION = 1e-6
+    
+    def __init__(self, clock: SimulatedClock, global_limit=30, global_period=1.0, chat_limit=20, chat_period=60.0):
+        self.clock = clock
+        self.global_limit = global_limit
+        self.global_period = global_period
+        self.chat_limit = chat_limit
+        self.chat_period = chat_period
+        self.global_window = deque()
+        self.chat_windows = defaultdict(deque)
+        self.sent = defaultdict(list)
+        self.rejected = 0
+    
+    def send_message(self, chat_id) -> bool:
+        """发送消息，超过限制时返回 False（相当于 429）"""
+        now = self.clock.time()
+        for window, period in ((self.global_window, self.global_period), (self.chat_windows[chat_id], self.chat_period)):
+            while window and window[0] <= now - period + self.RESOLUTION:
+                window.popleft()
+        
+        if len(self.global_window) >= self.global_limit or len(self.chat_windows[chat_id]) >= self.chat_limit:
+            self.rejected += 1
+            return False
+        
+        self.global_window.append(now)
+        self.chat_windows[chat_id].append(now)
+        self.sent[chat_id].append(now)
+        return True
+
+def _make_limiter(clock: SimulatedClock, **kwargs) -> HierarchicalRateLimiter:
+    return HierarchicalRateLimiter(clock=clock.time, sleep=clock.sleep, **kwargs)
+
+async def _sender(limiter, server, chat_id, count):
+    for _ in range(count):
+        await limiter.acquire(chat_id)
+        assert server.send_message(chat_id), f"chat {chat_id} 在 {server.clock.time():.3f}s 触发 429"
+
+def test_token_bucket_burst_then_rate():
+    """突发额度用完后按固定间隔发放令牌"""
+    bucket = TokenBucket(limit=20, period=60.0, burst=3)
+    times = [bucket.reserve(0.0) for _ in range(5)]
+    
+    assert times[:3] == [0.0, 0.0, 0.0]
+    assert abs(times[3] - 60.0 / 18) < 1e-9
+    assert abs(times[4] - 2 * 60.0 / 18) < 1e-9
+    print("✅ 令牌桶突发与补充速率正确")
+
+def test_per_chat_limit_without_429():
+    """单个群组持续发送: 不触发 429，第一分钟达到群组上限"""
+    async def run():
+        clock = SimulatedClock()
+        server = FakeTelegramServer(clock)
+        limiter = _make_limiter(clock)
+        
+        await clock.run(_sender(limiter, server, -100, 60))
+        
+        sent = server.sent[-100]
+        first_minute = [t for t in sent if t < 60.0]
+        assert server.rejected == 0
+        assert len(first_minute) == 20, f"第一分钟只发送了 {len(first_minute)} 条"
+        
+        # 持续速率 (limit - burst + 1) / period
+        steady_rate = (len(sent) - 1) / (sent[-1] - sent[0]) * 60
+        assert steady_rate >= 18 * 0.95, f"持续速率过低: {steady_rate:.1f} 条/分钟"
+        print(f"✅ 单群组: 60 条消息无 429，第一分钟 {len(first_minute)} 条，持续 {steady_rate:.1f} 条/分钟")
+    
+    asyncio.run(run())
+
+def test_global_limit_across_chats():
+    """大量群组并发发送: 不触发 429，吞吐量达到全局上限"""
+    async def run():
+        clock = SimulatedClock()
+        server = FakeTelegramServer(clock)
+        limiter = _make_limiter(clock)
+        
+        chats = list(range(-1000, -1100, -1))
+        await clock.run(*(_sender(limiter, server, chat_id, 3) for chat_id in chats))
+        
+        all_sent = sorted(t for times in server.sent.values() for t in times)
+        assert server.rejected == 0
+        assert len(all_sent) == 300
+        
+        duration = all_sent[-1] - all_sent[0]
+        throughput = (len(all_sent) - 1) / duration
+        assert throughput >= 30 * 0.95, f"全局吞吐量过低: {throughput:.1f} 条/秒"
+        print(f"✅ 100 个群组: 300 条消息无 429，全局吞吐量 {throughput:.1f} 条/秒")
+    
+    asyncio.run(run())
+
+def test_chats_do_not_block_each_other():
+    """一个群组被限流时，其他群组仍可立即发送"""
+    async def run():
+        clock = SimulatedClock()
+        server = FakeTelegramServer(clock)
+        limiter = _make_limiter(clock)
+        
+        await clock.run(_sender(limiter, server, -1, 10), _sender(limiter, server, -2, 1))
+        
+        assert server.sent[-2][0] < 1.0, "群组 -2 被群组 -1 的限流阻塞"
+        assert server.rejected == 0
+        print("✅ 群组之间互不阻塞")
+    
+    asyncio.run(run())
+
+def test_retry_after_debits_bucket():
+    """RetryAfter 扣除群组额度，已预约的消息在惩罚结束后重新预约"""
+    async def run():
+        clock = SimulatedClock()
+        limiter = _make_limiter(clock)
+        send_times = []
+        
+        async def send(chat_id, count=1):
+            for _ in range(count):
+                await limiter.acquire(chat_id)
+                send_times.append((chat_id, clock.time()))
+        
+        async def penalize_later(chat_id, delay, retry_after):
+            await clock.sleep(delay)
+            limiter.penalize(chat_id, retry_after)
+        
+        limiter.penalize(-1, 30)
+        await clock.run(send(-1), send(-2))
+        assert (-1, 30.0) in send_times, "RetryAfter 期间不应发送"
+        assert (-2, 0.0) in send_times, "其他群组不应受 RetryAfter 影响"
+        
+        # 第 4 条消息已预约在 3.33 秒，1 秒时收到 RetryAfter(10)
+        send_times.clear()
+        await clock.run(send(-3, 4), penalize_later(-3, 1.0, 10))
+        assert send_times[-1][1] >= 11.0, f"惩罚期间发送了消息: {send_times[-1][1]:.2f}s"
+        assert limiter.get_stats()['penalties'] == 2
+        print("✅ RetryAfter 扣除群组额度，其他群组不受影响")
+    
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    try:
+        test_token_bucket_burst_then_rate()
+        test_per_chat_limit_without_429()
+        test_global_limit_across_chats()
+        test_chats_do_not_block_each_other()
+        test_retry_after_debits_bucket()
+        print("\n🎉 所有限流器测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+优先级发送队列测试
+验证按信号强度和等待时间排序、同分 FIFO、队列满时的丢弃和 TTL 过期
+"""
+
+import asyncio
+import sys
+
+from main import PrioritySendQueue
+from test_outbox import FakeClock
+
+def _drain(queue: PrioritySendQueue) -> list:
+    async def run():
+        return [(await queue.get())[0] for _ in range(len(queue))]
+    return asyncio.run(run())
+
+def test_priority_order():
+    """强信号（绝对值）优先，同分按入队顺序"""
+    queue = PrioritySendQueue(clock=FakeClock())
+    for item, score in [('weak', 0.3), ('bull', 0.9), ('bear', -0.9), ('mid', 0.5), ('bull-2', 0.9)]:
+        assert queue.put(item, score)
+    
+    assert _drain(queue) == ['bull', 'bear', 'bull-2', 'mid', 'weak']
+    print("✅ 按信号强度排序，同分 FIFO")
+
+def test_aging():
+    """弱信号等待足够久后排在新到的强信号之前"""
+    clock = FakeClock()
+    queue = PrioritySendQueue(age_weight=0.01, clock=clock)
+    queue.put('old-weak', 0.2)
+    clock.now += 100  # 0.2 + 0.01 × 100 = 1.2
+    queue.put('new-strong', 0.9)
+    queue.put('new-weak', 0.2)
+    
+    assert _drain(queue) == ['old-weak', 'new-strong', 'new-weak']
+    print("✅ 等待时间提升优先级")
+
+def test_overflow():
+    """队列已满时丢弃优先级最低的消息"""
+    queue = PrioritySendQueue(max_size=2, clock=FakeClock())
+    queue.put('a', 0.5)
+    queue.put('b', 0.9)
+    
+    assert not queue.put('c', 0.1), "新消息优先级最低时应被丢弃"
+    assert queue.put('d', 0.7)
+    assert queue.get_stats()['dropped_overflow'] == 2
+    assert _drain(queue) == ['b', 'd']
+    print("✅ 队列满时丢弃最低优先级")
+
+def test_get_waits_and_reports_wait():
+    """空队列 get() 等待新消息，返回等待秒数"""
+    async def run():
+        clock = FakeClock()
+        queue = PrioritySendQueue(clock=clock)
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        assert not getter.done()
+        
+        queue.put('a', 0.5)
+        clock.now += 2.5
+        item, waited = await getter
+        assert (item, waited) == ('a', 2.5)
+        
+        stats = queue.get_stats()
+        assert stats['dequeued'] == 1 and stats['wait_last_ms'] == 2500.0 and stats['depth'] == 0
+    
+    asyncio.run(run())
+    print("✅ get() 等待并返回排队时间")
+
+def test_expiry():
+    """等待超过 TTL 的消息按入队顺序取出，TTL 为 0 时不过期"""
+    clock = FakeClock()
+    queue = PrioritySendQueue(ttl_seconds=300, clock=clock)
+    queue.put('first', 0.1)
+    clock.now += 10
+    queue.put('second', 0.9)
+    clock.now += 190
+    queue.put('fresh', 0.5)
+    
+    assert queue.drain_expired() == []
+    clock.now += 200  # first 等待 400 秒，second 等待 390 秒，fresh 等待 200 秒
+    assert queue.drain_expired() == ['first', 'second']
+    assert queue.get_stats()['expired'] == 2 and len(queue) == 1
+    
+    assert not queue.is_expired(300)
+    assert queue.is_expired(300.1)
+    assert not PrioritySendQueue(ttl_seconds=0).is_expired(10_000)
+    
+    queue = PrioritySendQueue(ttl_seconds=0, clock=clock)
+    queue.put('a', 0.5)
+    clock.now += 10_000
+    assert queue.drain_expired() == []
+    print("✅ TTL 过期")
+
+def test_drain_all():
+    """停止时按优先级取出全部消息并清空队列"""
+    queue = PrioritySendQueue(clock=FakeClock())
+    for item, score in [('low', 0.1), ('high', -0.8), ('mid', 0.4)]:
+        queue.put(item, score)
+    
+    assert queue.drain_all() == ['high', 'mid', 'low']
+    assert len(queue) == 0 and queue.drain_all() == []
+    print("✅ drain_all 按优先级取出")
+
+if __name__ == '__main__':
+    try:
+        test_priority_order()
+        test_aging()
+        test_overflow()
+        test_get_waits_and_reports_wait()
+        test_expiry()
+        test_drain_all()
+        print("\n🎉 所有优先级发送队列测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
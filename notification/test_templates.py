@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+消息模板测试
+"""
+
+import sys
+
+from templates import CompiledTemplate, SOURCE_FIELDS, compile_templates
+
+def _context(**overrides):
+    context = {
+        'emoji': '🚀', 'sentiment': '利多', 'score': 0.9, 'reason': '突破',
+        'text': 'BTC &lt;up&gt;', 'time': '12:00:00',
+        'chat_title': 'Crypto Signals', 'author': '@trader'
+    }
+    context.update(overrides)
+    return context
+
+def test_default_telegram_template():
+    """默认模板与原有消息格式一致"""
+    templates = compile_templates({})
+    message = templates['telegram'].render(_context())
+    
+    assert message == (
+        "🚀 <b>分析结果:</b> 利多\n"
+        "📊 <b>评分:</b> 0.90\n"
+        "💡 <b>理由:</b> 突破\n"
+        "📱 <b>来源:</b> Telegram - Crypto Signals\n"
+        "\n<pre>BTC &lt;up&gt;</pre>\n"
+        "\n👤 @trader\n"
+        "\n⏰ 12:00:00"
+    ), message
+    print("✅ 默认 Telegram 模板格式正确")
+
+def test_empty_fields_skip_line():
+    """字段为空时整行省略，评分为 0 时仍然输出"""
+    templates = compile_templates({'include_source': False})
+    message = templates['telegram'].render(_context(reason='', text='', author=None, score=0.0))
+    
+    assert message == "🚀 <b>分析结果:</b> 利多\n📊 <b>评分:</b> 0.00\n\n⏰ 12:00:00", message
+    print("✅ 空字段所在行被省略")
+
+def test_custom_template_override():
+    """自定义模板覆盖对应来源的默认模板"""
+    templates = compile_templates({'templates': {'twitter': "{emoji} @{username} {score:+.1f}\n{tweet_url}"}})
+    message = templates['twitter'].render(_context(username='trader', tweet_url=None))
+    
+    assert message == "🚀 @trader +0.9", message
+    assert templates['telegram'].render(_context()).startswith("🚀 <b>分析结果:</b>")
+    print("✅ 自定义模板覆盖默认模板")
+
+def test_invalid_templates_rejected():
+    """未知字段和未知来源在编译时报错"""
+    for config in ({'templates': {'twitter': ['{chat_title}']}},
+                   {'templates': {'discord': ['{emoji}']}},
+                   {'templates': {'telegram': ['{score!r}']}}):
+        try:
+            compile_templates(config)
+        except ValueError:
+            continue
+        raise AssertionError(f"未拒绝无效模板: {config}")
+    
+    assert CompiledTemplate('{anything}').render({'anything': 'ok'}) == 'ok'
+    assert 'tweet_url' in SOURCE_FIELDS['twitter']
+    print("✅ 无效模板在编译时被拒绝")
+
+if __name__ == '__main__':
+    try:
+        test_default_telegram_template()
+        test_empty_fields_skip_line()
+        test_custom_template_override()
+        test_invalid_templates_rejected()
+        print("\n🎉 所有模板测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+消息接收队列
+在 Telethon 事件处理器与消息处理/发布之间提供有界缓冲，支持多种溢出策略
+"""
+
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 优先级定义
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+
+class IngestQueue:
+    """
+    有界接收队列
+    
+    溢出策略:
+        block: 队列满时阻塞写入方（反压到 Telethon 事件处理器）
+        drop_oldest: 丢弃最早的消息，保证最新消息及时处理
+        drop_low_priority: 优先丢弃低优先级群组中最早的消息，
+            如果新消息的优先级低于队列中所有消息，则丢弃新消息
+    """
+    
+    POLICIES = ('block', 'drop_oldest', 'drop_low_priority')
+    
+    def __init__(self, max_size: int = 1000, overflow_policy: str = 'block',
+                 lag_observer: Optional[Callable[[float], None]] = None):
+        """
+        Args:
+            max_size: 队列容量
+            overflow_policy: 溢出策略
+            lag_observer: 每条消息出队时以排队时间（秒）调用，用于指标直方图
+        """
+        if overflow_policy not in self.POLICIES:
+            raise ValueError(f"不支持的溢出策略: {overflow_policy}，可选: {', '.join(self.POLICIES)}")
+        if max_size <= 0:
+            raise ValueError("队列大小必须大于 0")
+        
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.lag_observer = lag_observer
+        
+        # (item, priority, enqueue_time)
+        self._items: deque = deque()
+        self._condition = asyncio.Condition()
+        
+        # 统计信息
+        self.stats = {
+            'enqueued': 0,
+            'dequeued': 0,
+            'dropped': 0,
+            'blocked_puts': 0,
+            'max_depth': 0,
+            'lag_last_ms': 0.0,
+            'lag_max_ms': 0.0,
+            'lag_avg_ms': 0.0
+        }
+    
+    def qsize(self) -> int:
+        """当前队列深度"""
+        return len(self._items)
+    
+    def full(self) -> bool:
+        """队列是否已满"""
+        return len(self._items) >= self.max_size
+    
+    async def put(self, item: Any, priority: int = PRIORITY_NORMAL) -> bool:
+        """
+        放入消息
+        
+        Returns:
+            新消息是否被接收（drop_low_priority 策略下新消息可能被直接丢弃）
+        """
+        async with self._condition:
+            if self.full():
+                if self.overflow_policy == 'block':
+                    self.stats['blocked_puts'] += 1
+                    await self._condition.wait_for(lambda: not self.full())
+                elif self.overflow_policy == 'drop_oldest':
+                    self._items.popleft()
+                    self._record_drop()
+                else:
+                    if not self._drop_lowest_priority(priority):
+                        self._record_drop()
+                        return False
+            
+            self._items.append((item, priority, time.monotonic()))
+            self.stats['enqueued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._items))
+            self._condition.notify_all()
+            return True
+    
+    async def get(self) -> Any:
+        """取出最早的消息，队列为空时等待"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: len(self._items) > 0)
+            item, _, enqueue_time = self._items.popleft()
+            self._condition.notify_all()
+        
+        lag = time.monotonic() - enqueue_time
+        self._record_lag(lag * 1000)
+        if self.lag_observer:
+            self.lag_observer(lag)
+        self.stats['dequeued'] += 1
+        return item
+    
+    def _drop_lowest_priority(self, new_priority: int) -> bool:
+        """
+        丢弃队列中优先级最低的最早消息
+        
+        Returns:
+            是否腾出了位置（False 表示应丢弃新消息）
+        """
+        victim_index = None
+        victim_priority = None
+        for index, (_, priority, _) in enumerate(self._items):
+            if victim_priority is None or priority < victim_priority:
+                victim_index = index
+                victim_priority = priority
+        
+        if victim_index is None or new_priority < victim_priority:
+            return False
+        
+        del self._items[victim_index]
+        self._record_drop()
+        return True
+    
+    def _record_drop(self):
+        """记录丢弃"""
+        self.stats['dropped'] += 1
+        if self.stats['dropped'] == 1 or self.stats['dropped'] % 100 == 0:
+            logger.warning(f"接收队列已满 ({self.max_size})，策略 {self.overflow_policy}，累计丢弃 {self.stats['dropped']} 条消息")
+    
+    def _record_lag(self, lag_ms: float):
+        """记录排队延迟（指数移动平均）"""
+        self.stats['lag_last_ms'] = lag_ms
+        self.stats['lag_max_ms'] = max(self.stats['lag_max_ms'], lag_ms)
+        if self.stats['dequeued'] == 0:
+            self.stats['lag_avg_ms'] = lag_ms
+        else:
+            self.stats['lag_avg_ms'] = self.stats['lag_avg_ms'] * 0.9 + lag_ms * 0.1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        oldest_age_ms = 0.0
+        if self._items:
+            oldest_age_ms = (time.monotonic() - self._items[0][2]) * 1000
+        
+        return {
+            **self.stats,
+            'depth': len(self._items),
+            'max_size': self.max_size,
+            'overflow_policy': self.overflow_policy,
+            'oldest_age_ms': oldest_age_ms
+        }
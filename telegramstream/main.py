@@ -5,18 +5,18 @@ Telegram 消息监控程序
 """
 
 import asyncio
-import json
 import sys
 import time
 import re
 import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 import yaml
-from telethon import TelegramClient, events
-from telethon.tl.types import Channel, Chat
+from telethon import TelegramClient, events as telethon_events
+from telethon.tl.types import Channel, Chat, PeerChannel, PeerChat
+from telethon.utils import get_peer_id
 from prompt_toolkit.application import Application
 from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.layout import Layout
@@ -25,7 +25,18 @@ from prompt_toolkit.widgets import CheckboxList, Frame, Button
 import emoji
 
 # 导入符号匹配工具
-from symbol_util import find_crypto_symbols
+from symbol_util import get_symbols_data, match_symbols_in_text
+from ingest_queue import IngestQueue, PRIORITY_LOW, PRIORITY_NORMAL
+from sender_cache import SenderCache
+from sinks import OutputSink, create_sinks
+from publisher import LATENCY_LABELS, NatsPublisher, encode_message
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common.logging_util import EventLogger, lazy, setup_logging, truncate
+from common import metrics
+from common.codec import ORJSON_AVAILABLE
+from common.tracing import TraceContext
 
 try:
     import nats
@@ -39,11 +50,20 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+events = EventLogger(logger)
 
 # 抑制 Telethon 的调试日志
 telethon_logger = logging.getLogger('telethon')
 telethon_logger.setLevel(logging.WARNING)
 
+# 指标: 事件计数和阶段耗时在处理时更新，队列深度和累计计数在抓取时从各组件的 stats 读取
+EVENTS_RECEIVED = metrics.counter('telegramstream_events_received_total', '监控的聊天中收到的 Telegram 事件数', ['type'])
+STAGE_SECONDS = metrics.histogram(
+    'telegramstream_stage_seconds',
+    '各阶段耗时（秒）: queue=接收队列等待, extract=获取发送者和数据提取, emit=提交到输出端',
+    ['stage']
+)
+
 class TelegramConfig:
     """Telegram 配置管理"""
     
@@ -92,6 +112,34 @@ class TelegramConfig:
         """获取 NATS 配置"""
         return self.config.get('nats', {})
     
+    def get_output_config(self) -> Dict[str, Any]:
+        """获取输出端配置"""
+        return self.config.get('output', {})
+    
+    def get_extraction_config(self) -> Dict[str, Any]:
+        """获取数据提取配置"""
+        return self.config.get('advanced', {}).get('extraction', {})
+    
+    def get_ingest_config(self) -> Dict[str, Any]:
+        """获取接收队列配置"""
+        return self.config.get('advanced', {}).get('ingest', {})
+    
+    def get_sender_cache_config(self) -> Dict[str, Any]:
+        """获取发送者缓存配置"""
+        return self.config.get('advanced', {}).get('sender_cache', {})
+    
+    def get_logging_config(self) -> Dict[str, Any]:
+        """获取日志配置"""
+        return self.config.get('logging', {})
+    
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """获取链路追踪配置"""
+        return self.config.get('tracing', {})
+    
+    def get_metrics_config(self) -> Dict[str, Any]:
+        """获取指标接口配置"""
+        return self.config.get('metrics', {})
+    
     def update_monitoring_config(self, selected_chats: List[Dict[str, Any]]):
         """更新监控配置"""
         groups = []
@@ -134,6 +182,22 @@ class MessageExtractor:
         if not text:
             return {}
         
+        symbols_data = await get_symbols_data()
+        return self.extract_data_sync(text, symbols_data)
+    
+    def extract_data_sync(self, text: str, symbols_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        提取消息中的结构化数据（纯CPU计算，不访问网络）
+        
+        可以直接在事件循环中调用，也可以交给 ExtractionPool 在线程池/进程池中执行
+        
+        Args:
+            text: 消息文本
+            symbols_data: CoinGecko 数字货币数据（由 get_symbols_data 预先获取）
+        """
+        if not text:
+            return {}
+        
         # 移除表情符号获取纯文本
         raw_text = emoji.demojize(text)
         
@@ -145,9 +209,9 @@ class MessageExtractor:
             'bitcoin': list(set(self.BITCOIN_ADDRESS.findall(text)))
         }
         
-        # 使用CoinGecko API匹配数字货币符号和名称
+        # 使用CoinGecko数据匹配数字货币符号和名称
         try:
-            crypto_matches = await find_crypto_symbols(text)
+            crypto_matches = match_symbols_in_text(text, symbols_data)
             # 提取简单的符号列表（保持向后兼容）
             symbols = [match.get('symbol', '').upper() for match in crypto_matches]
             # 同时保存完整的数字货币信息
@@ -277,6 +341,90 @@ class MessageExtractor:
         
         return cleaned_text
 
+# 进程池工作进程中的提取器和 CoinGecko 数据，由 initializer 在进程启动时设置一次，
+# 每条消息只传递文本，不再序列化整份数据
+_worker_extractor: Optional[MessageExtractor] = None
+_worker_symbols_data: List[Dict[str, Any]] = []
+
+def _init_extraction_worker(symbols_data: List[Dict[str, Any]]):
+    global _worker_extractor, _worker_symbols_data
+    _worker_extractor = MessageExtractor()
+    _worker_symbols_data = symbols_data
+
+def _extract_in_worker(text: str) -> Dict[str, Any]:
+    return _worker_extractor.extract_data_sync(text, _worker_symbols_data)
+
+class ExtractionPool:
+    """
+    消息提取工作池
+    
+    Telethon 事件循环只负责 I/O，正则匹配、表情转换、符号匹配和地址扫描
+    等 CPU 密集的工作交给线程池或进程池执行。
+    
+    进程池的每个工作进程在启动时加载一份 CoinGecko 数据，之后每条消息只传递文本；
+    CoinGecko 数据刷新（返回新的列表）时版本号加一，用新数据重建进程池，旧进程池处理完已提交的消息后退出
+    """
+    
+    MODES = ('inline', 'thread', 'process')
+    
+    def __init__(self, extractor: MessageExtractor, mode: str = 'thread', max_workers: Optional[int] = None,
+                 symbols_provider: Callable[[], Awaitable[List[Dict[str, Any]]]] = get_symbols_data):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的提取模式: {mode}，可选: {', '.join(self.MODES)}")
+        
+        self.extractor = extractor
+        self.mode = mode
+        self.max_workers = max_workers
+        self.symbols_provider = symbols_provider
+        self.executor = None
+        # 进程池工作进程持有的 CoinGecko 数据及其版本
+        self.symbols_version = 0
+        self._worker_symbols_data = None
+        
+        if mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='extractor')
+        
+        logger.info(f"消息提取工作池: mode={mode}, max_workers={max_workers or 'auto'}")
+    
+    async def extract(self, text: str) -> Dict[str, Any]:
+        """提取消息数据，CoinGecko 数据刷新在事件循环中完成，匹配计算在工作池中完成"""
+        if not text:
+            return {}
+        
+        symbols_data = await self.symbols_provider()
+        
+        if self.mode == 'inline':
+            return self.extractor.extract_data_sync(text, symbols_data)
+        
+        loop = asyncio.get_running_loop()
+        if self.mode == 'process':
+            return await loop.run_in_executor(self._process_executor(symbols_data), _extract_in_worker, text)
+        return await loop.run_in_executor(self.executor, self.extractor.extract_data_sync, text, symbols_data)
+    
+    def _process_executor(self, symbols_data: List[Dict[str, Any]]) -> ProcessPoolExecutor:
+        """返回持有当前 CoinGecko 数据的进程池，数据变化时重建"""
+        if self.executor is not None and symbols_data is self._worker_symbols_data:
+            return self.executor
+        
+        if self.executor is not None:
+            # 已提交的消息继续在旧进程池中完成
+            self.executor.shutdown(wait=False)
+        self.symbols_version += 1
+        self._worker_symbols_data = symbols_data
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_extraction_worker,
+            initargs=(symbols_data,)
+        )
+        logger.info(f"提取进程池已加载 CoinGecko 数据: {len(symbols_data)} 个币种（版本 {self.symbols_version}）")
+        return self.executor
+    
+    def shutdown(self):
+        """关闭工作池"""
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
 class TelegramConfigUI:
     """Telegram 配置交互界面"""
     
@@ -466,8 +614,31 @@ class TelegramMonitor:
         self.config = config
         self.client = None
         self.extractor = MessageExtractor()
+        self.extraction_pool = None
         self.nats_client = None
+        self.publisher: Optional[NatsPublisher] = None
+        self.sinks: List[OutputSink] = []
         self.running = False
+        self.ingest_queue: Optional[IngestQueue] = None
+        self._publish_queue: Optional[asyncio.Queue] = None
+        self._publisher_task = None
+        self._dispatcher_task = None
+        self._stats_task = None
+        self.metrics_server = None
+        self._monitored_chats: Dict[int, Dict[str, Any]] = {}
+        self._low_priority_chats = set()
+        
+        # 发送者实体缓存
+        sender_cache_config = config.get_sender_cache_config()
+        self.sender_cache = SenderCache(
+            max_size=sender_cache_config.get('max_size', 10000),
+            ttl_seconds=sender_cache_config.get('ttl_seconds', 3600)
+        )
+        self._sender_refreshing = set()
+        self._background_tasks = set()
+        
+        # 链路追踪: 在 NATS 头中记录接收、提取完成和发布时间
+        self.tracing_enabled = config.get_tracing_config().get('enabled', True)
         
     async def initialize(self):
         """初始化客户端"""
@@ -492,15 +663,52 @@ class TelegramMonitor:
             # 恢复日志级别
             logging.getLogger().setLevel(old_level)
         
+        # 初始化提取工作池
+        extraction_config = self.config.get_extraction_config()
+        self.extraction_pool = ExtractionPool(
+            self.extractor,
+            mode=extraction_config.get('executor', 'thread'),
+            max_workers=extraction_config.get('max_workers')
+        )
+        
         # 初始化 NATS 连接
         nats_config = self.config.get_nats_config()
         if NATS_AVAILABLE and nats_config.get('enabled'):
             try:
-                self.nats_client = await nats.connect(servers=nats_config.get('servers', ['nats://localhost:4222']))
+                connect_options = {}
+                if nats_config.get('pending_size'):
+                    connect_options['pending_size'] = nats_config['pending_size']
+                self.nats_client = await nats.connect(
+                    servers=nats_config.get('servers', ['nats://localhost:4222']),
+                    **connect_options
+                )
                 logger.info("NATS 连接成功")
             except Exception as e:
                 logger.warning(f"NATS 连接失败: {e}")
                 self.nats_client = None
+        
+        # 初始化发布器，subject 只解析一次
+        if self.nats_client:
+            publisher_config = nats_config.get('publisher', {})
+            self.publisher = NatsPublisher(
+                self.nats_client,
+                nats_config.get('subject', 'telegram.messages'),
+                flush_interval=publisher_config.get('flush_interval', 0.05),
+                flush_threshold=publisher_config.get('flush_threshold', 100),
+                jetstream=publisher_config.get('jetstream', False),
+                ack_timeout=publisher_config.get('ack_timeout', 5.0),
+                max_pending_acks=publisher_config.get('max_pending_acks', 1000),
+                wire_format=publisher_config.get('wire_format', 'json')
+            )
+            self.publisher.start()
+            logger.info(f"NATS 发布器: subject={self.publisher.subject}, 模式={self.publisher.mode}, "
+                        f"格式={self.publisher.wire_format}, orjson={ORJSON_AVAILABLE}")
+        
+        # 初始化输出端
+        self.sinks = create_sinks(self.config.get_output_config(), nats_publisher=self.publisher)
+        for sink in self.sinks:
+            sink.start()
+        logger.info(f"输出端: {', '.join(sink.name for sink in self.sinks) or '无'}")
     
     async def start_monitoring(self):
         """启动监控"""
@@ -516,22 +724,38 @@ class TelegramMonitor:
         for chat in all_chats:
             logger.info(f"  - {chat['title']} (ID: {chat['id']}, 类型: {chat['type']})")
         
-        # 注册事件处理器
-        @self.client.on(events.NewMessage)
-        async def handle_new_message(event):
-            logger.debug(f"收到新消息事件，来自聊天 ID: {event.chat_id}")
-            await self._handle_message(event, 'telegram.message')
+        # 建立监控列表索引，事件处理器中只做一次字典查找
+        self._monitored_chats = {self._normalize_chat_id(chat['id']): chat for chat in all_chats}
         
-        @self.client.on(events.MessageEdited)
-        async def handle_edited_message(event):
-            logger.debug(f"收到编辑消息事件，来自聊天 ID: {event.chat_id}")
-            # await self._handle_message(event, 'telegram.edit')
-            # await self._handle_message(event, 'telegram.message')
+        # 初始化接收队列：事件处理器只负责入队，处理和发布由后台协程完成
+        ingest_config = self.config.get_ingest_config()
+        self.ingest_queue = IngestQueue(
+            max_size=ingest_config.get('max_size', 1000),
+            overflow_policy=ingest_config.get('overflow_policy', 'block'),
+            lag_observer=STAGE_SECONDS.labels('queue').observe
+        )
+        self._low_priority_chats = {
+            self._normalize_chat_id(chat_id) for chat_id in ingest_config.get('low_priority_chats', [])
+        }
         
-        @self.client.on(events.MessageDeleted)
-        async def handle_deleted_message(event):
-            logger.debug(f"收到删除消息事件，来自聊天 ID: {event.chat_id}")
-            await self._handle_delete(event)
+        # 发布队列限制同时处理中的消息数量，处理跟不上时反压到接收队列
+        self._publish_queue = asyncio.Queue(maxsize=ingest_config.get('max_inflight', 16))
+        self._publisher_task = asyncio.create_task(self._publish_loop())
+        self._dispatcher_task = asyncio.create_task(self._dispatch_loop())
+        self._stats_task = asyncio.create_task(self._stats_loop(ingest_config.get('stats_interval', 60)))
+        
+        logger.info(f"接收队列: 容量 {self.ingest_queue.max_size}, 溢出策略 {self.ingest_queue.overflow_policy}")
+        
+        # 指标接口
+        self._register_metrics()
+        self.metrics_server = await metrics.start_metrics_server(self.config.get_metrics_config(), default_port=9101)
+        
+        # 后台预热发送者缓存
+        sender_cache_config = self.config.get_sender_cache_config()
+        if sender_cache_config.get('prewarm', True):
+            self._spawn(self._prewarm_sender_cache(all_chats, sender_cache_config.get('prewarm_limit', 200)))
+        
+        self._register_handlers()
         
         self.running = True
         logger.info("监控已启动，按 Ctrl+C 停止")
@@ -543,55 +767,251 @@ class TelegramMonitor:
             logger.info("收到停止信号")
         finally:
             self.running = False
+            for task in (self._dispatcher_task, self._publisher_task, self._stats_task, *self._background_tasks):
+                if task:
+                    task.cancel()
+            if self.extraction_pool:
+                self.extraction_pool.shutdown()
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            for sink in self.sinks:
+                await sink.close()
+            if self.publisher:
+                await self.publisher.close()
             if self.nats_client:
                 await self.nats_client.close()
     
-    async def _handle_message(self, event, message_type: str):
-        """处理消息事件"""
-        try:
-            # 检查是否是监控的群组/频道
-            chat_id = event.chat_id
-            monitoring_config = self.config.get_monitoring_config()
-            all_chats = monitoring_config.get('groups', []) + monitoring_config.get('channels', [])
-            
-            logger.debug(f"处理消息: 聊天ID {chat_id}, 类型 {message_type}")
+    def _register_handlers(self):
+        """注册 Telethon 事件处理器（events 为结构化日志，Telethon 的事件类型使用 telethon_events）"""
+        @self.client.on(telethon_events.NewMessage)
+        async def handle_new_message(event):
+            logger.debug("收到新消息事件，来自聊天 ID: %s", event.chat_id)
+            await self._ingest(event, 'telegram.message')
+        
+        @self.client.on(telethon_events.MessageEdited)
+        async def handle_edited_message(event):
+            logger.debug("收到编辑消息事件，来自聊天 ID: %s", event.chat_id)
+            # await self._handle_message(event, 'telegram.edit')
+            # await self._handle_message(event, 'telegram.message')
+        
+        @self.client.on(telethon_events.MessageDeleted)
+        async def handle_deleted_message(event):
+            logger.debug("收到删除消息事件，来自聊天 ID: %s", event.chat_id)
+            await self._ingest(event, 'telegram.delete')
+    
+    @staticmethod
+    def _normalize_chat_id(id_value) -> int:
+        """标准化聊天 ID，处理 Telegram 的 -100 前缀格式差异"""
+        if isinstance(id_value, str):
+            id_value = int(id_value)
+        
+        # 如果是负数且以 -100 开头，提取实际 ID
+        if id_value < 0 and str(abs(id_value)).startswith('100'):
+            return abs(id_value) - 1000000000000  # 移除 -100 前缀
+        return abs(id_value)  # 统一使用正数比较
+    
+    def _find_monitored_chat(self, chat_id) -> Optional[Dict[str, Any]]:
+        """查找监控列表中的聊天"""
+        if chat_id is None:
+            return None
+        return self._monitored_chats.get(self._normalize_chat_id(chat_id))
+    
+    async def _ingest(self, event, message_type: str):
+        """事件处理器入口：过滤非监控聊天后放入接收队列"""
+        monitored_chat = self._find_monitored_chat(event.chat_id)
+        if not monitored_chat:
+            logger.debug("聊天 ID %s 不在监控列表中，跳过", event.chat_id)
+            return
+        
+        EVENTS_RECEIVED.labels(message_type).inc()
+        trace = TraceContext().mark('stream.received') if self.tracing_enabled else None
+        chat_key = self._normalize_chat_id(event.chat_id)
+        priority = PRIORITY_LOW if chat_key in self._low_priority_chats else PRIORITY_NORMAL
+        await self.ingest_queue.put((event, message_type, monitored_chat, trace), priority)
+    
+    async def _dispatch_loop(self):
+        """从接收队列取出事件，启动处理任务并按顺序登记到发布队列"""
+        while True:
+            event, message_type, monitored_chat, trace = await self.ingest_queue.get()
+            if message_type == 'telegram.delete':
+                coro = self._handle_delete(event, monitored_chat)
+            else:
+                coro = self._handle_message(event, message_type, monitored_chat, trace)
             
-            # 修复 ID 匹配问题：处理 Telegram 的 ID 格式差异
-            def normalize_chat_id(id_value):
-                """标准化聊天 ID，处理 -100 前缀"""
-                if isinstance(id_value, str):
-                    id_value = int(id_value)
+            # 任务立即开始执行（获取发送者、提取数据），但按登记顺序放入发布队列，
+            # 保证即使提取在工作池中乱序完成，消息仍按到达顺序发布
+            task = asyncio.ensure_future(coro)
+            await self._publish_queue.put((task, trace))
+    
+    async def _stats_loop(self, interval: float):
+        """定期输出接收队列统计"""
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.get_stats()
+            logger.info(
+                f"接收队列统计: 深度={stats['depth']}/{stats['max_size']}, 处理中={stats['inflight']}, "
+                f"入队={stats['enqueued']}, 丢弃={stats['dropped']}, 阻塞={stats['blocked_puts']}, "
+                f"排队延迟 avg={stats['lag_avg_ms']:.1f}ms max={stats['lag_max_ms']:.1f}ms, "
+                f"发送者缓存 {stats['sender_cache']['size']} 条 命中率={stats['sender_cache']['hit_rate']:.1%}"
+            )
+            if 'publisher' in stats:
+                publisher_stats = stats['publisher']
+                latency = publisher_stats['latency']
+                logger.info(
+                    f"NATS 发布统计: 已发布={publisher_stats['published']}, "
+                    f"吞吐={publisher_stats['throughput_per_sec']:.1f} msg/s, "
+                    f"{LATENCY_LABELS[publisher_stats['latency_kind']]} "
+                    f"p50={latency['p50_ms']:.1f}ms p95={latency['p95_ms']:.1f}ms max={latency['max_ms']:.1f}ms, "
+                    f"错误={publisher_stats['publish_errors'] + publisher_stats['ack_errors']}"
+                )
+    
+    def _register_metrics(self):
+        """注册抓取时读取的队列深度和累计计数（不在热路径上更新）"""
+        depth = metrics.gauge('telegramstream_queue_depth', '队列当前深度', ['queue'])
+        depth.labels('ingest').set_function(self.ingest_queue.qsize)
+        depth.labels('publish').set_function(self._publish_queue.qsize)
+        
+        dropped = metrics.counter('telegramstream_dropped_messages_total', '队列或输出端缓冲已满时丢弃的消息数', ['queue'])
+        dropped.labels('ingest').set_function(lambda: self.ingest_queue.stats['dropped'])
+        metrics.counter('telegramstream_ingest_blocked_total', '接收队列满时阻塞的写入次数').set_function(
+            lambda: self.ingest_queue.stats['blocked_puts']
+        )
+        
+        written = metrics.counter('telegramstream_sink_written_total', '输出端已写入的消息数', ['sink'])
+        errors = metrics.counter('telegramstream_sink_errors_total', '输出端写入失败的批次数', ['sink'])
+        for sink in self.sinks:
+            depth.labels(f'sink_{sink.name}').set_function(lambda sink=sink: sink.get_stats()['buffered'])
+            dropped.labels(f'sink_{sink.name}').set_function(lambda sink=sink: sink.stats['dropped'])
+            written.labels(sink.name).set_function(lambda sink=sink: sink.stats['written'])
+            errors.labels(sink.name).set_function(lambda sink=sink: sink.stats['errors'])
+        
+        lookups = metrics.counter('telegramstream_sender_cache_lookups_total', '发送者缓存查询次数', ['result'])
+        for result in ('hits', 'stale_hits', 'misses'):
+            lookups.labels(result).set_function(lambda result=result: self.sender_cache.stats[result])
+        metrics.gauge('telegramstream_sender_cache_size', '发送者缓存实体数').set_function(
+            lambda: self.sender_cache.get_stats()['size']
+        )
+        
+        if self.publisher:
+            metrics.counter('telegramstream_nats_published_total', '已发布到 NATS 的消息数').set_function(
+                lambda: self.publisher.stats['published']
+            )
+            publish_errors = metrics.counter('telegramstream_nats_errors_total', 'NATS 发布或确认失败次数', ['kind'])
+            for kind in ('publish_errors', 'ack_errors'):
+                publish_errors.labels(kind).set_function(lambda kind=kind: self.publisher.stats[kind])
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取监控统计信息"""
+        stats = self.ingest_queue.get_stats() if self.ingest_queue else {}
+        stats['inflight'] = self._publish_queue.qsize() if self._publish_queue else 0
+        stats['sender_cache'] = self.sender_cache.get_stats()
+        stats['sinks'] = {sink.name: sink.get_stats() for sink in self.sinks}
+        if self.publisher:
+            stats['publisher'] = self.publisher.get_stats()
+        return stats
+    
+    def _spawn(self, coro):
+        """启动后台任务并保留引用，停止监控时统一取消"""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+    
+    async def _get_sender(self, message):
+        """
+        获取消息发送者，优先使用缓存
+        
+        缓存过期时先返回旧实体，再在后台刷新，避免热路径上的 API 往返
+        """
+        sender_id = message.sender_id
+        if sender_id is None:
+            return None
+        
+        sender, is_fresh = self.sender_cache.get(sender_id)
+        if sender is not None:
+            if not is_fresh and sender_id not in self._sender_refreshing:
+                self._sender_refreshing.add(sender_id)
+                self._spawn(self._refresh_sender(sender_id))
+            return sender
+        
+        sender = await message.get_sender()
+        self.sender_cache.put(sender_id, sender)
+        return sender
+    
+    async def _refresh_sender(self, sender_id: int):
+        """后台刷新发送者实体"""
+        try:
+            entity = await self.client.get_entity(sender_id)
+            self.sender_cache.put(sender_id, entity)
+            logger.debug(f"已刷新发送者缓存: {sender_id}")
+        except Exception as e:
+            # 刷新失败时保留旧实体并重新计时，避免每条消息都触发刷新
+            sender, _ = self.sender_cache.get(sender_id)
+            self.sender_cache.put(sender_id, sender)
+            logger.debug(f"刷新发送者 {sender_id} 失败: {e}")
+        finally:
+            self._sender_refreshing.discard(sender_id)
+    
+    async def _prewarm_sender_cache(self, chats: List[Dict[str, Any]], limit: int):
+        """从监控的群组/频道预热发送者缓存"""
+        warmed = 0
+        for chat in chats:
+            raw_id = self._normalize_chat_id(chat['id'])
+            peer = PeerChat(raw_id) if chat['type'] == 'group' else PeerChannel(raw_id)
+            try:
+                # 频道消息的发送者就是频道本身
+                entity = await self.client.get_entity(peer)
+                self.sender_cache.put(get_peer_id(entity), entity)
+                warmed += 1
                 
-                # 如果是负数且以 -100 开头，提取实际 ID
-                if id_value < 0 and str(abs(id_value)).startswith('100'):
-                    return abs(id_value) - 1000000000000  # 移除 -100 前缀
-                return abs(id_value)  # 统一使用正数比较
-            
-            normalized_event_id = normalize_chat_id(chat_id)
-            
-            monitored_chat = None
-            for chat in all_chats:
-                config_id = normalize_chat_id(chat['id'])
-                if config_id == normalized_event_id:
-                    monitored_chat = chat
-                    break
-            
-            if not monitored_chat:
-                logger.debug(f"聊天 ID {chat_id} (标准化: {normalized_event_id}) 不在监控列表中，跳过")
-                logger.debug(f"监控列表 ID: {[normalize_chat_id(chat['id']) for chat in all_chats]}")
-                return
-            
-            logger.info(f"处理来自 '{monitored_chat['title']}' 的消息")
+                if chat['type'] == 'channel':
+                    continue
+                
+                async for user in self.client.iter_participants(entity, limit=limit):
+                    self.sender_cache.put(user.id, user)
+                    warmed += 1
+            except Exception as e:
+                # 没有管理员权限等情况下无法获取成员列表，跳过即可
+                logger.debug(f"预热 '{chat['title']}' 的发送者缓存失败: {e}")
+        
+        logger.info(f"发送者缓存预热完成: {warmed} 个实体")
+    
+    async def _publish_loop(self):
+        """按顺序等待处理任务完成并发布消息"""
+        while True:
+            task, trace = await self._publish_queue.get()
+            try:
+                message_data = await task
+                if message_data:
+                    start = time.perf_counter()
+                    await self._send_message(message_data, trace)
+                    STAGE_SECONDS.labels('emit').observe(time.perf_counter() - start)
+            except asyncio.CancelledError:
+                if task.cancelled():
+                    continue
+                raise
+            except Exception as e:
+                logger.error(f"发布消息时出错: {e}", exc_info=True)
+            finally:
+                self._publish_queue.task_done()
+    
+    async def _handle_message(self, event, message_type: str, monitored_chat: Dict[str, Any],
+                              trace: Optional[TraceContext] = None) -> Optional[Dict[str, Any]]:
+        """处理消息事件，返回待发布的消息数据"""
+        start = time.perf_counter()
+        try:
+            chat_id = event.chat_id
             
             # 获取消息信息
             message = event.message
-            sender = await message.get_sender()
+            events.info("📨 处理消息", chat=monitored_chat['title'], chat_id=chat_id, type=message_type, message_id=message.id)
+            sender = await self._get_sender(message)
             
             # 提取结构化数据
             text = message.message or ''
-            extracted_data = await self.extractor.extract_data(text)
+            extracted_data = await self.extraction_pool.extract(text)
             
-            logger.debug(f"消息文本: {text[:100]}...")  # 只显示前100个字符
+            events.debug("消息文本", message_id=message.id, text=lazy(truncate, text, 100))
             
             # 构建消息数据
             message_data = {
@@ -623,42 +1043,20 @@ class TelegramMonitor:
             if message_type == 'telegram.edit':
                 message_data['data']['edit_date'] = int(message.edit_date.timestamp() * 1000) if message.edit_date else None
             
-            await self._send_message(message_data)
+            if trace is not None:
+                trace.mark('telegram.date', message_data['data']['date']).mark('stream.extracted')
+            
+            STAGE_SECONDS.labels('extract').observe(time.perf_counter() - start)
+            return message_data
             
         except Exception as e:
             logger.error(f"处理消息时出错: {e}", exc_info=True)
+            return None
     
-    async def _handle_delete(self, event):
-        """处理删除事件"""
+    async def _handle_delete(self, event, monitored_chat: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """处理删除事件，返回待发布的消息数据"""
         try:
-            # 检查是否是监控的聊天
             chat_id = event.chat_id
-            monitoring_config = self.config.get_monitoring_config()
-            all_chats = monitoring_config.get('groups', []) + monitoring_config.get('channels', [])
-            
-            # 使用相同的 ID 标准化逻辑
-            def normalize_chat_id(id_value):
-                """标准化聊天 ID，处理 -100 前缀"""
-                if isinstance(id_value, str):
-                    id_value = int(id_value)
-                
-                # 如果是负数且以 -100 开头，提取实际 ID
-                if id_value < 0 and str(abs(id_value)).startswith('100'):
-                    return abs(id_value) - 1000000000000  # 移除 -100 前缀
-                return abs(id_value)  # 统一使用正数比较
-            
-            normalized_event_id = normalize_chat_id(chat_id)
-            
-            monitored_chat = None
-            for chat in all_chats:
-                config_id = normalize_chat_id(chat['id'])
-                if config_id == normalized_event_id:
-                    monitored_chat = chat
-                    break
-            
-            if not monitored_chat:
-                logger.debug(f"删除事件：聊天 ID {chat_id} 不在监控列表中，跳过")
-                return
             
             # 构建删除消息数据
             message_data = {
@@ -674,10 +1072,11 @@ class TelegramMonitor:
                 }
             }
             
-            await self._send_message(message_data)
+            return message_data
             
         except Exception as e:
             logger.error(f"处理删除事件时出错: {e}")
+            return None
     
     def _extract_entities(self, message) -> List[Dict[str, Any]]:
         """提取消息实体"""
@@ -726,22 +1125,15 @@ class TelegramMonitor:
         
         return media_data
     
-    async def _send_message(self, message_data: Dict[str, Any]):
-        """发送消息到队列或控制台"""
-        message_json = json.dumps(message_data, ensure_ascii=False, separators=(',', ':'))
+    async def _send_message(self, message_data: Dict[str, Any], trace: Optional[TraceContext] = None):
+        """序列化一次后提交到所有输出端"""
+        payload = encode_message(message_data)
         
-        # 发送到 NATS
-        if self.nats_client:
+        for sink in self.sinks:
             try:
-                nats_config = self.config.get_nats_config()
-                subject = nats_config.get('subject', 'telegram.messages')
-                await self.nats_client.publish(subject, message_json.encode())
-                logger.debug(f"消息已发送到 NATS: {subject}")
+                await sink.emit(message_data, payload, trace)
             except Exception as e:
-                logger.error(f"发送到 NATS 失败: {e}")
-        
-        # 控制台输出
-        print(f"[{datetime.now().isoformat()}] {message_json}")
+                logger.error(f"提交到输出端 {sink.name} 失败: {e}")
 
 async def main():
     """主函数"""
@@ -797,7 +1189,8 @@ async def main():
         await client.disconnect()
     
     elif command == 'start':
-        # 监控模式
+        # 监控模式，日志在后台线程中写入
+        setup_logging(config.get_logging_config())
         monitor = TelegramMonitor(config)
         
         # 验证配置
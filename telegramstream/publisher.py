@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+NATS 消息发布器
+预先解析 subject，批量发布后按间隔显式 flush，可选 JetStream 异步确认，
+并统计吞吐量和延迟（core 模式为 flush 往返时间，JetStream 模式为 PubAck 延迟）。消息体默认为 JSON，可配置为 msgpack（带 Content-Type 头）
+"""
+
+import asyncio
+import sys
+import time
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# 公共模块位于仓库根目录
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from common import codec
+
+logger = logging.getLogger(__name__)
+
+def encode_message(message_data: Dict[str, Any]) -> bytes:
+    """序列化消息为 UTF-8 JSON（common.codec，优先使用 orjson）"""
+    return codec.dumps(message_data)
+
+# 延迟统计的含义: core 模式没有逐条确认，记录的是每次 flush 的往返时间
+LATENCY_FLUSH_RTT = 'flush_rtt'
+LATENCY_PUB_ACK = 'pub_ack'
+LATENCY_LABELS = {LATENCY_FLUSH_RTT: 'flush 往返延迟', LATENCY_PUB_ACK: 'PubAck 确认延迟'}
+
+class LatencyStats:
+    """保留最近 N 个样本的延迟统计"""
+    
+    def __init__(self, max_samples: int = 1000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+    
+    def record(self, latency_ms: float):
+        self.samples.append(latency_ms)
+        self.count += 1
+    
+    def summary(self) -> Dict[str, float]:
+        if not self.samples:
+            return {'count': self.count, 'avg_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+        
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'avg_ms': sum(ordered) / len(ordered),
+            'p50_ms': ordered[len(ordered) // 2],
+            'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            'max_ms': ordered[-1]
+        }
+
+class ThroughputMeter:
+    """按秒分桶统计最近一段时间的吞吐量"""
+    
+    def __init__(self, window_seconds: int = 10):
+        self.window_seconds = window_seconds
+        self.buckets = deque()  # [second, count]
+    
+    def mark(self, count: int = 1):
+        second = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([second, count])
+        while self.buckets and self.buckets[0][0] <= second - self.window_seconds:
+            self.buckets.popleft()
+    
+    def rate(self) -> float:
+        """最近窗口内每秒消息数"""
+        cutoff = int(time.monotonic()) - self.window_seconds
+        total = sum(count for second, count in self.buckets if second > cutoff)
+        return total / self.window_seconds
+
+class NatsPublisher:
+    """
+    NATS 发布器
+    
+    Core NATS 模式: publish() 只写入客户端缓冲，不等待服务器往返；
+    每隔 flush_interval 秒或积累 flush_threshold 条消息后显式 flush 一次。
+    延迟统计记录的是每次 flush 的往返时间（一批消息一个样本），不是逐条消息的确认延迟
+    
+    JetStream 模式: 每条消息异步等待 PubAck，同时等待确认的消息数
+    不超过 max_pending_acks
+    
+    wire_format 为 msgpack 时 publish() 的消息体应由 encode() 生成，发布时附加 Content-Type 头
+    """
+    
+    def __init__(self, nats_client, subject: str,
+                 flush_interval: float = 0.05,
+                 flush_threshold: int = 100,
+                 flush_timeout: float = 5.0,
+                 jetstream: bool = False,
+                 ack_timeout: float = 5.0,
+                 max_pending_acks: int = 1000,
+                 wire_format: str = codec.FORMAT_JSON):
+        self.nats_client = nats_client
+        self.subject = subject
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.flush_timeout = flush_timeout
+        self.ack_timeout = ack_timeout
+        self.max_pending_acks = max_pending_acks
+        self.wire_format = codec.check_format(wire_format)
+        self._content_headers = codec.content_headers(wire_format)
+        
+        self._js = nats_client.jetstream() if jetstream else None
+        self._ack_slots = asyncio.Semaphore(max_pending_acks)
+        self._pending_acks = set()
+        self._unflushed = 0
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self.throughput = ThroughputMeter()
+        self.latency = LatencyStats()
+        self.stats = {
+            'published': 0,
+            'publish_errors': 0,
+            'flushes': 0,
+            'ack_errors': 0
+        }
+    
+    @property
+    def mode(self) -> str:
+        return 'jetstream' if self._js else 'core'
+    
+    @property
+    def latency_kind(self) -> str:
+        """延迟统计的含义: flush_rtt（core）或 pub_ack（JetStream）"""
+        return LATENCY_PUB_ACK if self._js else LATENCY_FLUSH_RTT
+    
+    def encode(self, message_data: Dict[str, Any]) -> bytes:
+        """按发布器的线上格式序列化消息"""
+        return codec.encode(message_data, self.wire_format)
+    
+    def start(self):
+        """启动定时 flush 协程"""
+        if self._js is None and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def publish(self, payload: bytes, headers: Optional[Dict[str, str]] = None):
+        """发布一条消息，不等待服务器确认"""
+        if self._content_headers:
+            headers = {**(headers or {}), **self._content_headers}
+        if self._js is not None:
+            await self._ack_slots.acquire()
+            task = asyncio.create_task(self._publish_jetstream(payload, headers, time.monotonic()))
+            self._pending_acks.add(task)
+            task.add_done_callback(self._pending_acks.discard)
+            return
+        
+        try:
+            await self.nats_client.publish(self.subject, payload, headers=headers)
+        except Exception:
+            self.stats['publish_errors'] += 1
+            raise
+        
+        self.stats['published'] += 1
+        self.throughput.mark()
+        self._unflushed += 1
+        if self._unflushed >= self.flush_threshold:
+            await self.flush()
+    
+    async def _publish_jetstream(self, payload: bytes, headers: Optional[Dict[str, str]], start_time: float):
+        """JetStream 发布并等待 PubAck"""
+        try:
+            await self._js.publish(self.subject, payload, timeout=self.ack_timeout, headers=headers)
+            self.stats['published'] += 1
+            self.throughput.mark()
+            self.latency.record((time.monotonic() - start_time) * 1000)
+        except Exception as e:
+            self.stats['ack_errors'] += 1
+            logger.error(f"JetStream 发布失败: {e}")
+        finally:
+            self._ack_slots.release()
+    
+    async def flush(self):
+        """显式 flush，等待服务器处理完已发布的消息"""
+        async with self._flush_lock:
+            if self._unflushed == 0:
+                return
+            count = self._unflushed
+            self._unflushed = 0
+            start_time = time.monotonic()
+            try:
+                await self.nats_client.flush(timeout=self.flush_timeout)
+                self.stats['flushes'] += 1
+                self.latency.record((time.monotonic() - start_time) * 1000)
+            except Exception as e:
+                self.stats['ack_errors'] += 1
+                logger.error(f"NATS flush 失败 ({count} 条消息未确认): {e}")
+    
+    async def _flush_loop(self):
+        """按间隔 flush"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    async def close(self):
+        """等待所有消息确认后停止"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._pending_acks:
+            await asyncio.gather(*self._pending_acks, return_exceptions=True)
+        await self.flush()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取发布统计信息"""
+        return {
+            **self.stats,
+            'mode': self.mode,
+            'subject': self.subject,
+            'wire_format': self.wire_format,
+            'throughput_per_sec': self.throughput.rate(),
+            'pending_acks': len(self._pending_acks),
+            'unflushed': self._unflushed,
+            'latency_kind': self.latency_kind,
+            'latency': self.latency.summary()
+        }
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+发送者实体缓存
+按 sender_id 缓存 Telethon 实体，避免每条消息都调用 get_sender()
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SenderCache:
+    """
+    带 TTL 的 LRU 发送者缓存
+    
+    过期的条目不会立即删除：读取时仍然返回旧实体并标记为过期，
+    由调用方在热路径之外异步刷新
+    """
+    
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        
+        # sender_id -> (entity, cached_at)
+        self._entries: "OrderedDict[int, Tuple[Any, float]]" = OrderedDict()
+        
+        # 统计信息
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+    
+    def get(self, sender_id: int) -> Tuple[Optional[Any], bool]:
+        """
+        获取缓存的实体
+        
+        Returns:
+            (entity, is_fresh)，未命中时返回 (None, False)
+        """
+        entry = self._entries.get(sender_id)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None, False
+        
+        self._entries.move_to_end(sender_id)
+        entity, cached_at = entry
+        if self._clock() - cached_at > self.ttl_seconds:
+            self.stats['stale_hits'] += 1
+            return entity, False
+        
+        self.stats['hits'] += 1
+        return entity, True
+    
+    def put(self, sender_id: int, entity: Any):
+        """写入或刷新实体"""
+        if sender_id is None or entity is None:
+            return
+        
+        self._entries[sender_id] = (entity, self._clock())
+        self._entries.move_to_end(sender_id)
+        
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def __contains__(self, sender_id: int) -> bool:
+        return sender_id in self._entries
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        lookups = self.stats['hits'] + self.stats['stale_hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hit_rate': (self.stats['hits'] + self.stats['stale_hits']) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+消息输出端
+支持 NATS、滚动文件和标准输出，每个输出端使用有界缓冲和后台批量写入，
+阻塞的写操作放到线程池中执行，不占用事件循环
+"""
+
+import asyncio
+import os
+import sys
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class OutputSink:
+    """
+    输出端基类
+    
+    emit() 只负责把消息放入有界缓冲，后台协程批量取出并调用 _write_batch()。
+    缓冲满时按 overflow 策略处理: block 等待（反压），drop 丢弃并计数
+    """
+    
+    name = 'sink'
+    
+    def __init__(self, buffer_size: int = 10000, batch_size: int = 100, overflow: str = 'drop'):
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"不支持的缓冲溢出策略: {overflow}")
+        
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+        
+        # 统计信息
+        self.stats = {
+            'written': 0,
+            'dropped': 0,
+            'errors': 0
+        }
+    
+    def start(self):
+        """启动后台写入协程"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    def accepts(self, message_data: Dict[str, Any]) -> bool:
+        """是否输出这条消息（子类可实现采样）"""
+        return True
+    
+    def _prepare(self, message_data: Dict[str, Any], payload: bytes, trace=None) -> Any:
+        """把消息转换为写入批次中的元素"""
+        return payload
+    
+    async def emit(self, message_data: Dict[str, Any], payload: bytes, trace=None):
+        """提交一条消息，trace 为链路追踪记录（只有 NATS 输出端写入消息头）"""
+        if not self.accepts(message_data):
+            return
+        
+        item = self._prepare(message_data, payload, trace)
+        if self.overflow == 'block':
+            await self._queue.put(item)
+            return
+        
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] == 1 or self.stats['dropped'] % 1000 == 0:
+                logger.warning(f"输出端 {self.name} 缓冲已满，累计丢弃 {self.stats['dropped']} 条消息")
+    
+    async def _run(self):
+        """批量取出缓冲中的消息并写入"""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            try:
+                await self._write_batch(batch)
+                self.stats['written'] += len(batch)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"输出端 {self.name} 写入失败: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    async def _write_batch(self, batch: List[Any]):
+        """写入一批消息"""
+        raise NotImplementedError
+    
+    async def close(self, timeout: float = 5.0):
+        """等待缓冲写完后关闭"""
+        if self._task:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"输出端 {self.name} 关闭超时，{self._queue.qsize()} 条消息未写入")
+            self._task.cancel()
+            self._task = None
+        await self._close()
+    
+    async def _close(self):
+        """释放资源"""
+        pass
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取输出端统计信息"""
+        return {
+            **self.stats,
+            'buffered': self._queue.qsize(),
+            'buffer_size': self.buffer_size
+        }
+
+class NatsSink(OutputSink):
+    """NATS 输出端，通过 NatsPublisher 批量发布（发布器使用 msgpack 时重新编码，其他输出端仍写入 JSON）"""
+    
+    name = 'nats'
+    
+    def __init__(self, publisher, **kwargs):
+        kwargs.setdefault('overflow', 'block')
+        super().__init__(**kwargs)
+        self.publisher = publisher
+    
+    def _prepare(self, message_data: Dict[str, Any], payload: bytes, trace=None) -> Tuple[bytes, Any]:
+        if self.publisher.wire_format != 'json':
+            payload = self.publisher.encode(message_data)
+        return payload, trace
+    
+    async def _write_batch(self, batch: List[Tuple[bytes, Any]]):
+        for payload, trace in batch:
+            # 发布时间在真正交给 NATS 客户端时记录，包含输出端缓冲的等待时间
+            headers = trace.mark('stream.published').inject({}) if trace is not None else None
+            await self.publisher.publish(payload, headers)
+        logger.debug("%d 条消息已发送到 NATS: %s", len(batch), self.publisher.subject)
+
+class StdoutSink(OutputSink):
+    """
+    标准输出端
+    
+    sample_rate 控制输出比例（0-1），按固定间隔采样而不是随机采样，
+    例如 0.01 表示每 100 条输出 1 条
+    """
+    
+    name = 'console'
+    
+    def __init__(self, sample_rate: float = 1.0, stream=None, **kwargs):
+        super().__init__(**kwargs)
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.stream = stream or sys.stdout
+        self._credit = 0.0
+    
+    def accepts(self, message_data: Dict[str, Any]) -> bool:
+        self._credit += self.sample_rate
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            return True
+        return False
+    
+    def _prepare(self, message_data: Dict[str, Any], payload: bytes, trace=None) -> str:
+        return f"[{datetime.now().isoformat()}] {payload.decode()}\n"
+    
+    async def _write_batch(self, batch: List[str]):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_lines, batch)
+    
+    def _write_lines(self, lines: List[str]):
+        self.stream.write(''.join(lines))
+        self.stream.flush()
+
+class RotatingFileSink(OutputSink):
+    """按大小滚动的 JSON Lines 文件输出端"""
+    
+    name = 'file'
+    
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, backup_count: int = 5, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = None
+    
+    def _prepare(self, message_data: Dict[str, Any], payload: bytes, trace=None) -> bytes:
+        return payload + b'\n'
+    
+    async def _write_batch(self, batch: List[bytes]):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_lines, batch)
+    
+    def _write_lines(self, lines: List[bytes]):
+        data = b''.join(lines)
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        
+        if self.max_bytes and self._file.tell() > 0 and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        
+        self._file.write(data)
+        self._file.flush()
+    
+    def _rotate(self):
+        """滚动文件: path -> path.1 -> path.2 ..."""
+        self._file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.path}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'ab')
+    
+    async def _close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+def create_sinks(output_config: Dict[str, Any], nats_publisher=None) -> List[OutputSink]:
+    """
+    根据配置创建输出端
+    
+    生产模式 (production: true) 下控制台输出默认关闭，显式开启时默认按 1% 采样
+    """
+    production = output_config.get('production', False)
+    buffer_size = output_config.get('buffer_size', 10000)
+    sinks: List[OutputSink] = []
+    
+    if nats_publisher is not None:
+        sinks.append(NatsSink(nats_publisher, buffer_size=buffer_size))
+    
+    file_config = output_config.get('file') or {}
+    if file_config.get('enabled', False):
+        sinks.append(RotatingFileSink(
+            file_config.get('path', 'messages.jsonl'),
+            max_bytes=file_config.get('max_bytes', 100 * 1024 * 1024),
+            backup_count=file_config.get('backup_count', 5),
+            buffer_size=buffer_size
+        ))
+    
+    # 只有注释的配置段解析为 None
+    console_config = output_config.get('console') or {}
+    if console_config.get('enabled', not production):
+        default_rate = 0.01 if production else 1.0
+        sample_rate = console_config.get('sample_rate', default_rate)
+        if sample_rate > 0:
+            sinks.append(StdoutSink(sample_rate=sample_rate, buffer_size=buffer_size))
+    
+    return sinks
@@ -1,7 +1,7 @@
 import time
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 import re
 
 try:
@@ -58,6 +58,11 @@ class CoinGeckoSymbolMatcher:
             elif not self.symbols_data:  # 如果是首次获取失败
                 logger.warning("首次获取CoinGecko数据失败，将使用空数据")
     
+    async def get_symbols_data(self) -> List[Dict[str, Any]]:
+        """获取最新的数字货币数据（必要时刷新）"""
+        await self._ensure_data_fresh()
+        return self.symbols_data
+    
     async def find_symbols_in_text(self, text: str) -> List[Dict[str, Any]]:
         """
         在文本中查找匹配的数字货币symbol和name
@@ -71,95 +76,12 @@ class CoinGeckoSymbolMatcher:
         if not text:
             return []
         
-        await self._ensure_data_fresh()
-        
-        if not self.symbols_data:
-            logger.debug("CoinGecko数据为空，跳过符号匹配")
-            return []
-        
-        # 清理文本：移除URL和邮箱地址，避免误匹配
-        cleaned_text = self._clean_text_for_matching(text)
-        
-        found_symbols = []
-        text_upper = cleaned_text.upper()
-        
-        # 创建已匹配symbol的集合，避免重复
-        matched_symbols = set()
-        
-        for coin_data in self.symbols_data:
-            symbol = coin_data.get('symbol', '').upper()
-            name = coin_data.get('name', '').upper()
-            coin_id = coin_data.get('id', '')
-            
-            # 匹配symbol (作为独立单词，大小写不敏感)
-            if symbol and len(symbol) >= 2:  # 只匹配至少2个字符的symbol
-                pattern = r'\b' + re.escape(symbol) + r'\b'
-                if re.search(pattern, text_upper) and symbol not in matched_symbols:
-                    found_symbols.append(coin_data)
-                    matched_symbols.add(symbol)
-                    logger.debug(f"匹配到symbol: {symbol} -> {coin_data.get('name')}")
-                    continue
-            
-            # 匹配name (作为独立单词，大小写不敏感)
-            if name and len(name) >= 3:  # 只匹配至少3个字符的name
-                # 对于复合词名称，分别匹配每个词
-                name_words = name.split()
-                if len(name_words) == 1:
-                    # 单词名称直接匹配
-                    pattern = r'\b' + re.escape(name) + r'\b'
-                    if re.search(pattern, text_upper) and coin_id not in [s.get('id') for s in found_symbols]:
-                        found_symbols.append(coin_data)
-                        logger.debug(f"匹配到name: {name} -> {coin_data.get('symbol')}")
-                else:
-                    # 复合词名称匹配完整短语
-                    pattern = r'\b' + re.escape(name) + r'\b'
-                    if re.search(pattern, text_upper) and coin_id not in [s.get('id') for s in found_symbols]:
-                        found_symbols.append(coin_data)
-                        logger.debug(f"匹配到复合name: {name} -> {coin_data.get('symbol')}")
-        
-        logger.debug(f"在文本中找到 {len(found_symbols)} 个匹配的数字货币")
-        return found_symbols
+        symbols_data = await self.get_symbols_data()
+        return match_symbols_in_text(text, symbols_data)
     
     def _clean_text_for_matching(self, text: str) -> str:
-        """
-        清理文本，移除URL和邮箱地址，避免误匹配
-        
-        Args:
-            text: 原始文本
-            
-        Returns:
-            清理后的文本
-        """
-        # URL 匹配模式（更全面的匹配）
-        url_patterns = [
-            r'https?://[^\s]+',  # http/https URLs
-            r'www\.[^\s]+',      # www URLs
-            r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?:/[^\s]*)?',  # 域名格式
-        ]
-        
-        # 邮箱匹配模式
-        email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-        
-        # 文件扩展名模式（避免匹配.html, .com等）
-        file_extension_pattern = r'\b\w+\.[a-zA-Z]{2,4}\b'
-        
-        cleaned_text = text
-        
-        # 移除URL
-        for pattern in url_patterns:
-            cleaned_text = re.sub(pattern, ' ', cleaned_text, flags=re.IGNORECASE)
-        
-        # 移除邮箱地址
-        cleaned_text = re.sub(email_pattern, ' ', cleaned_text)
-        
-        # 移除文件扩展名（如 .html, .com 等）
-        cleaned_text = re.sub(file_extension_pattern, ' ', cleaned_text)
-        
-        # 移除多余的空格
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
-        
-        logger.debug(f"文本清理: '{text[:100]}...' -> '{cleaned_text[:100]}...'")
-        return cleaned_text
+        """清理文本，移除URL和邮箱地址，避免误匹配"""
+        return clean_text_for_matching(text)
     
     def get_cache_info(self) -> Dict[str, Any]:
         """获取缓存信息（用于调试）"""
@@ -170,6 +92,108 @@ class CoinGeckoSymbolMatcher:
             'aiohttp_available': AIOHTTP_AVAILABLE
         }
 
+def match_symbols_in_text(text: str, symbols_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    在文本中匹配数字货币symbol和name（纯CPU计算，可在线程池/进程池中运行）
+    
+    Args:
+        text: 要搜索的文本
+        symbols_data: CoinGecko数字货币数据列表
+        
+    Returns:
+        匹配到的数字货币数据列表
+    """
+    if not text:
+        return []
+    
+    if not symbols_data:
+        logger.debug("CoinGecko数据为空，跳过符号匹配")
+        return []
+    
+    # 清理文本：移除URL和邮箱地址，避免误匹配
+    cleaned_text = clean_text_for_matching(text)
+    
+    found_symbols = []
+    text_upper = cleaned_text.upper()
+    
+    # 创建已匹配symbol的集合，避免重复
+    matched_symbols = set()
+    
+    for coin_data in symbols_data:
+        symbol = coin_data.get('symbol', '').upper()
+        name = coin_data.get('name', '').upper()
+        coin_id = coin_data.get('id', '')
+        
+        # 匹配symbol (作为独立单词，大小写不敏感)
+        if symbol and len(symbol) >= 2:  # 只匹配至少2个字符的symbol
+            pattern = r'\b' + re.escape(symbol) + r'\b'
+            if re.search(pattern, text_upper) and symbol not in matched_symbols:
+                found_symbols.append(coin_data)
+                matched_symbols.add(symbol)
+                logger.debug("匹配到symbol: %s -> %s", symbol, coin_data.get('name'))
+                continue
+        
+        # 匹配name (作为独立单词，大小写不敏感)
+        if name and len(name) >= 3:  # 只匹配至少3个字符的name
+            # 对于复合词名称，分别匹配每个词
+            name_words = name.split()
+            if len(name_words) == 1:
+                # 单词名称直接匹配
+                pattern = r'\b' + re.escape(name) + r'\b'
+                if re.search(pattern, text_upper) and coin_id not in [s.get('id') for s in found_symbols]:
+                    found_symbols.append(coin_data)
+                    logger.debug("匹配到name: %s -> %s", name, coin_data.get('symbol'))
+            else:
+                # 复合词名称匹配完整短语
+                pattern = r'\b' + re.escape(name) + r'\b'
+                if re.search(pattern, text_upper) and coin_id not in [s.get('id') for s in found_symbols]:
+                    found_symbols.append(coin_data)
+                    logger.debug("匹配到复合name: %s -> %s", name, coin_data.get('symbol'))
+    
+    logger.debug("在文本中找到 %d 个匹配的数字货币", len(found_symbols))
+    return found_symbols
+
+def clean_text_for_matching(text: str) -> str:
+    """
+    清理文本，移除URL和邮箱地址，避免误匹配
+    
+    Args:
+        text: 原始文本
+    
+    Returns:
+        清理后的文本
+    """
+    # URL 匹配模式（更全面的匹配）
+    url_patterns = [
+        r'https?://[^\s]+',  # http/https URLs
+        r'www\.[^\s]+',      # www URLs
+        r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?:/[^\s]*)?',  # 域名格式
+    ]
+    
+    # 邮箱匹配模式
+    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+    
+    # 文件扩展名模式（避免匹配.html, .com等）
+    file_extension_pattern = r'\b\w+\.[a-zA-Z]{2,4}\b'
+    
+    cleaned_text = text
+    
+    # 移除URL
+    for pattern in url_patterns:
+        cleaned_text = re.sub(pattern, ' ', cleaned_text, flags=re.IGNORECASE)
+    
+    # 移除邮箱地址
+    cleaned_text = re.sub(email_pattern, ' ', cleaned_text)
+    
+    # 移除文件扩展名（如 .html, .com 等）
+    cleaned_text = re.sub(file_extension_pattern, ' ', cleaned_text)
+    
+    # 移除多余的空格
+    cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
+    
+    logger.debug("文本清理: '%.100s...' -> '%.100s...'", text, cleaned_text)
+    return cleaned_text
+
 # 全局实例
 _symbol_matcher = CoinGeckoSymbolMatcher()
 
@@ -191,6 +215,17 @@ async def find_crypto_symbols(text: str) -> List[Dict[str, Any]]:
     """
     return await _symbol_matcher.find_symbols_in_text(text)
 
+async def get_symbols_data() -> List[Dict[str, Any]]:
+    """
+    获取当前的CoinGecko数字货币数据（必要时刷新）
+    
+    配合 match_symbols_in_text 使用，可以把符号匹配放到工作池中执行
+    
+    Returns:
+        数字货币数据列表
+    """
+    return await _symbol_matcher.get_symbols_data()
+
 def get_symbol_cache_info() -> Dict[str, Any]:
     """
     获取符号缓存信息
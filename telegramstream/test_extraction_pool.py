@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+测试 ExtractionPool 的三种执行模式，以及提取乱序完成时按到达顺序发布
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import main
+from ingest_queue import IngestQueue
+
+EXAMPLE_CONFIG = Path(__file__).resolve().parent / 'config.yml.example'
+
+SYMBOLS_V1 = [
+    {'id': 'bitcoin', 'symbol': 'btc', 'name': 'Bitcoin'},
+    {'id': 'ethereum', 'symbol': 'eth', 'name': 'Ethereum'},
+]
+SYMBOLS_V2 = SYMBOLS_V1 + [{'id': 'solana', 'symbol': 'sol', 'name': 'Solana'}]
+
+TEXTS = [
+    'Buy $BTC now 🚀',
+    'ETH and SOL breakout https://example.com',
+    '0x742d35Cc6634C0532925a3b844Bc454e4438f44e',
+]
+
+class FakeSymbols:
+    """替代 CoinGecko 数据源，current 换成新列表相当于一次刷新"""
+    
+    def __init__(self, data):
+        self.current = data
+    
+    async def __call__(self):
+        return self.current
+
+def test_extraction_modes():
+    """inline / thread / process 三种模式的结果与同步提取一致"""
+    async def run():
+        extractor = main.MessageExtractor()
+        expected = [extractor.extract_data_sync(text, SYMBOLS_V1) for text in TEXTS]
+        
+        for mode in main.ExtractionPool.MODES:
+            pool = main.ExtractionPool(extractor, mode=mode, max_workers=2, symbols_provider=FakeSymbols(SYMBOLS_V1))
+            try:
+                results = await asyncio.gather(*(pool.extract(text) for text in TEXTS))
+                assert results == expected, f"{mode} 模式结果不一致"
+                assert await pool.extract('') == {}
+            finally:
+                pool.shutdown()
+    
+    asyncio.run(run())
+    print("✅ inline / thread / process 提取结果一致")
+
+def test_process_pool_reloads_symbols():
+    """进程池只在 CoinGecko 数据变化时重建，工作进程使用新数据"""
+    async def run():
+        symbols = FakeSymbols(SYMBOLS_V1)
+        pool = main.ExtractionPool(main.MessageExtractor(), mode='process', max_workers=1, symbols_provider=symbols)
+        try:
+            result = await pool.extract(TEXTS[1])
+            executor = pool.executor
+            assert result['symbols'] == ['ETH'], result['symbols']
+            
+            # 数据未变化时复用同一个进程池
+            await pool.extract(TEXTS[0])
+            assert pool.executor is executor and pool.symbols_version == 1
+            
+            symbols.current = SYMBOLS_V2
+            result = await pool.extract(TEXTS[1])
+            assert pool.executor is not executor and pool.symbols_version == 2
+            assert result['symbols'] == ['ETH', 'SOL'], result['symbols']
+        finally:
+            pool.shutdown()
+    
+    asyncio.run(run())
+    print("✅ CoinGecko 数据刷新后重建进程池")
+
+def test_ordered_handoff():
+    """处理任务乱序完成时，仍按接收顺序发布"""
+    async def run():
+        monitor = main.TelegramMonitor(main.TelegramConfig(str(EXAMPLE_CONFIG)))
+        monitor.ingest_queue = IngestQueue(max_size=100)
+        monitor._publish_queue = asyncio.Queue(maxsize=4)
+        published = []
+        
+        # 越早到达的消息处理越慢
+        async def handle_message(event, message_type, monitored_chat, trace=None):
+            await asyncio.sleep(0.01 * (10 - event))
+            return {'message_id': event} if event != 3 else None
+        
+        async def send_message(message_data, trace=None):
+            published.append(message_data['message_id'])
+        
+        monitor._handle_message = handle_message
+        monitor._send_message = send_message
+        
+        tasks = [asyncio.create_task(monitor._publish_loop()), asyncio.create_task(monitor._dispatch_loop())]
+        for i in range(10):
+            await monitor.ingest_queue.put((i, 'telegram.message', {}, None))
+        while len(published) < 9:
+            await asyncio.sleep(0.01)
+        
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+        assert published == [0, 1, 2, 4, 5, 6, 7, 8, 9], published
+    
+    asyncio.run(run())
+    print("✅ 乱序完成的消息按到达顺序发布")
+
+if __name__ == '__main__':
+    try:
+        test_extraction_modes()
+        test_process_pool_reloads_symbols()
+        test_ordered_handoff()
+        print("\n🎉 所有提取工作池测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
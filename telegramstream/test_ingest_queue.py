@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+测试 ingest_queue.py 的溢出策略和统计
+"""
+
+import asyncio
+import sys
+
+from ingest_queue import IngestQueue, PRIORITY_LOW, PRIORITY_NORMAL
+
+def test_drop_oldest():
+    """drop_oldest 策略：队列满时丢弃最早的消息"""
+    async def run():
+        queue = IngestQueue(max_size=3, overflow_policy='drop_oldest')
+        for i in range(5):
+            assert await queue.put(i)
+        
+        items = [await queue.get() for _ in range(queue.qsize())]
+        assert items == [2, 3, 4], items
+        assert queue.get_stats()['dropped'] == 2
+    
+    asyncio.run(run())
+    print("✅ drop_oldest 策略测试通过")
+
+def test_drop_low_priority():
+    """drop_low_priority 策略：优先丢弃低优先级群组的消息"""
+    async def run():
+        queue = IngestQueue(max_size=3, overflow_policy='drop_low_priority')
+        await queue.put('normal-1', PRIORITY_NORMAL)
+        await queue.put('low-1', PRIORITY_LOW)
+        await queue.put('normal-2', PRIORITY_NORMAL)
+        
+        # 普通消息挤掉低优先级消息
+        assert await queue.put('normal-3', PRIORITY_NORMAL)
+        # 队列中没有低优先级消息时，新的低优先级消息被丢弃
+        assert not await queue.put('low-2', PRIORITY_LOW)
+        
+        items = [await queue.get() for _ in range(queue.qsize())]
+        assert items == ['normal-1', 'normal-2', 'normal-3'], items
+        assert queue.get_stats()['dropped'] == 2
+    
+    asyncio.run(run())
+    print("✅ drop_low_priority 策略测试通过")
+
+def test_block():
+    """block 策略：队列满时写入方等待消费者"""
+    async def run():
+        queue = IngestQueue(max_size=2, overflow_policy='block')
+        await queue.put(1)
+        await queue.put(2)
+        
+        blocked_put = asyncio.create_task(queue.put(3))
+        await asyncio.sleep(0.05)
+        assert not blocked_put.done(), "队列满时 put 应该阻塞"
+        
+        assert await queue.get() == 1
+        await asyncio.wait_for(blocked_put, timeout=1)
+        
+        stats = queue.get_stats()
+        assert stats['blocked_puts'] == 1
+        assert stats['dropped'] == 0
+        assert stats['depth'] == 2
+        assert stats['lag_max_ms'] >= 50
+    
+    asyncio.run(run())
+    print("✅ block 策略测试通过")
+
+def main():
+    """主测试函数"""
+    print("开始测试 ingest_queue.py 功能...\n")
+    test_drop_oldest()
+    test_drop_low_priority()
+    test_block()
+    print("\n🎉 所有测试通过！")
+
+if __name__ == '__main__':
+    try:
+        main()
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
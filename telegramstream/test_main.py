@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+main.py 冒烟测试: 模块可以导入，Telethon 事件处理器能够注册（不连接 Telegram）
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+from telethon import TelegramClient
+from telethon.events import MessageDeleted, MessageEdited, NewMessage
+from telethon.sessions import MemorySession
+
+import main
+from common.logging_util import EventLogger
+
+EXAMPLE_CONFIG = Path(__file__).resolve().parent / 'config.yml.example'
+
+async def _register():
+    monitor = main.TelegramMonitor(main.TelegramConfig(str(EXAMPLE_CONFIG)))
+    monitor.client = TelegramClient(MemorySession(), 1, 'test')
+    monitor._register_handlers()
+    return [type(builder) for _, builder in monitor.client.list_event_handlers()]
+
+def test_register_handlers():
+    """结构化日志 events 不能覆盖 Telethon 的事件类型，新消息、编辑、删除三个处理器都注册到客户端"""
+    assert isinstance(main.events, EventLogger)
+    assert main.telethon_events.NewMessage is NewMessage
+    
+    builders = asyncio.run(_register())
+    assert builders == [NewMessage, MessageEdited, MessageDeleted], builders
+    print("✅ 事件处理器注册")
+
+if __name__ == '__main__':
+    try:
+        test_register_handlers()
+        print("\n🎉 所有 main.py 冒烟测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+测试 publisher.py 的 flush 策略、JetStream 确认背压、错误计数和延迟统计（不连接 NATS）
+"""
+
+import asyncio
+import sys
+
+from publisher import LATENCY_FLUSH_RTT, LATENCY_PUB_ACK, LatencyStats, NatsPublisher
+
+class FakeJetStream:
+    """PubAck 在 release 后才返回，fail 为 True 时发布失败"""
+    
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.fail = False
+        self.published = []
+    
+    async def publish(self, subject, payload, timeout=None, headers=None):
+        await self.release.wait()
+        if self.fail:
+            raise TimeoutError('nats: timeout')
+        self.published.append(payload)
+
+class FakeNats:
+    def __init__(self):
+        self.published = []
+        self.flushes = 0
+        self.fail_publish = False
+        self.fail_flush = False
+        self.js = FakeJetStream()
+    
+    async def publish(self, subject, payload, headers=None):
+        if self.fail_publish:
+            raise ConnectionError('nats: connection closed')
+        self.published.append((subject, payload, headers))
+    
+    async def flush(self, timeout=None):
+        if self.fail_flush:
+            raise TimeoutError('nats: flush timeout')
+        self.flushes += 1
+    
+    def jetstream(self):
+        return self.js
+
+def test_latency_stats():
+    """只保留最近 N 个样本，count 统计全部样本"""
+    stats = LatencyStats(max_samples=10)
+    assert stats.summary() == {'count': 0, 'avg_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+    
+    for latency in range(1, 101):
+        stats.record(float(latency))
+    summary = stats.summary()
+    assert summary['count'] == 100 and len(stats.samples) == 10
+    assert (summary['avg_ms'], summary['p50_ms'], summary['p95_ms'], summary['max_ms']) == (95.5, 96.0, 100.0, 100.0)
+    print("✅ 延迟统计")
+
+def test_flush_threshold():
+    """积累 flush_threshold 条消息后 flush，没有未 flush 的消息时不重复 flush"""
+    async def run():
+        nats_client = FakeNats()
+        publisher = NatsPublisher(nats_client, 'telegram.messages', flush_threshold=3, flush_interval=60)
+        for i in range(7):
+            await publisher.publish(b'%d' % i)
+        
+        assert nats_client.flushes == 2 and publisher._unflushed == 1
+        await publisher.close()
+        await publisher.flush()
+        
+        stats = publisher.get_stats()
+        assert nats_client.flushes == 3 and stats['flushes'] == 3 and stats['published'] == 7
+        assert stats['unflushed'] == 0 and stats['mode'] == 'core'
+        # core 模式每次 flush 一个样本，延迟是 flush 往返时间
+        assert stats['latency_kind'] == LATENCY_FLUSH_RTT and stats['latency']['count'] == 3
+    
+    asyncio.run(run())
+    print("✅ 按条数 flush，延迟标记为 flush 往返")
+
+def test_flush_interval():
+    """消息数未达到阈值时由定时协程 flush"""
+    async def run():
+        nats_client = FakeNats()
+        publisher = NatsPublisher(nats_client, 'telegram.messages', flush_threshold=100, flush_interval=0.01)
+        publisher.start()
+        await publisher.publish(b'a')
+        await publisher.publish(b'b')
+        assert nats_client.flushes == 0
+        
+        await asyncio.sleep(0.05)
+        assert nats_client.flushes == 1 and publisher._unflushed == 0
+        await publisher.close()
+        assert publisher._flush_task is None
+    
+    asyncio.run(run())
+    print("✅ 按间隔 flush")
+
+def test_core_errors():
+    """发布失败计入 publish_errors 并抛出，flush 失败计入 ack_errors"""
+    async def run():
+        nats_client = FakeNats()
+        publisher = NatsPublisher(nats_client, 'telegram.messages', flush_threshold=2)
+        
+        nats_client.fail_publish = True
+        try:
+            await publisher.publish(b'a')
+            raise AssertionError("发布失败应抛出异常")
+        except ConnectionError:
+            pass
+        nats_client.fail_publish = False
+        
+        nats_client.fail_flush = True
+        await publisher.publish(b'b')
+        await publisher.publish(b'c')
+        
+        stats = publisher.get_stats()
+        assert stats['publish_errors'] == 1 and stats['ack_errors'] == 1, stats
+        assert stats['published'] == 2 and stats['flushes'] == 0 and stats['unflushed'] == 0
+    
+    asyncio.run(run())
+    print("✅ core 模式错误计数")
+
+def test_jetstream_backpressure():
+    """等待 PubAck 的消息达到 max_pending_acks 时 publish() 阻塞"""
+    async def run():
+        nats_client = FakeNats()
+        publisher = NatsPublisher(nats_client, 'telegram.messages', jetstream=True, max_pending_acks=2)
+        await publisher.publish(b'a')
+        await publisher.publish(b'b')
+        
+        blocked = asyncio.create_task(publisher.publish(b'c'))
+        await asyncio.sleep(0.01)
+        assert not blocked.done(), "超过 max_pending_acks 时应阻塞"
+        assert publisher.get_stats()['pending_acks'] == 2
+        
+        nats_client.js.release.set()
+        await blocked
+        await publisher.close()
+        
+        stats = publisher.get_stats()
+        assert nats_client.js.published == [b'a', b'b', b'c']
+        assert stats['published'] == 3 and stats['pending_acks'] == 0 and stats['mode'] == 'jetstream'
+        assert stats['latency_kind'] == LATENCY_PUB_ACK and stats['latency']['count'] == 3
+        assert nats_client.flushes == 0, "JetStream 模式不需要 flush"
+    
+    asyncio.run(run())
+    print("✅ JetStream 确认背压")
+
+def test_jetstream_errors():
+    """PubAck 失败计入 ack_errors，并释放确认槽位"""
+    async def run():
+        nats_client = FakeNats()
+        nats_client.js.fail = True
+        nats_client.js.release.set()
+        publisher = NatsPublisher(nats_client, 'telegram.messages', jetstream=True, max_pending_acks=1)
+        for payload in (b'a', b'b', b'c'):
+            await asyncio.wait_for(publisher.publish(payload), timeout=1)
+        await publisher.close()
+        
+        stats = publisher.get_stats()
+        assert stats['ack_errors'] == 3 and stats['published'] == 0 and stats['latency']['count'] == 0, stats
+    
+    asyncio.run(run())
+    print("✅ JetStream 错误计数")
+
+if __name__ == '__main__':
+    try:
+        test_latency_stats()
+        test_flush_threshold()
+        test_flush_interval()
+        test_core_errors()
+        test_jetstream_backpressure()
+        test_jetstream_errors()
+        print("\n🎉 所有发布器测试通过！")
+    except AssertionError as e:
+        print(f"\n💥 测试失败: {e}")
+        sys.exit(1)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试 sender_cache.py 的 LRU 淘汰和 TTL 过期
+"""
+
+import sys
+
+from sender_cache import SenderCache
+
+class FakeClock:
+    """可手动推进的时钟"""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self) -> float:
+        return self.now
+
+def test_ttl():
+    """过期条目仍然返回，但标记为需要刷新"""
+    clock = FakeClock()
+    cache = SenderCache(max_size=10, ttl_seconds=60, clock=clock)
+    cache.put(1, 'alice')
+    
+    assert cache.get(1) == ('alice', True)
+    clock.now = 61
+    assert cache.get(1) == ('alice', False)
+    
+    cache.put(1, 'alice-refreshed')
+    assert cache.get(1) == ('alice-refreshed', True)
+    assert cache.get(2) == (None, False)
+    
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['stale_hits'], stats['misses']) == (2, 1, 1), stats
+    print("✅ TTL 测试通过")
+
+def test_lru_eviction():
+    """超过容量时淘汰最久未使用的条目"""
+    cache = SenderCache(max_size=2, ttl_seconds=60, clock=FakeClock())
+    cache.put(1, 'alice')
+    cache.put(2, 'bob')
+    cache.get(1)  # alice 变为最近使用
+    cache.put(3, 'carol')
+    
+    assert 1 in cache and 3 in cache
+    assert 2 not in cache
+    assert cache.get_stats()['evictions'] == 1
+    print("✅ LRU 淘汰测试通过")
+
+if __name__ == '__main__':
+    try:
+        test_ttl()
+        test_lru_eviction()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
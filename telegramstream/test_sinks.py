@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+测试 sinks.py 的采样、文件滚动和缓冲溢出
+"""
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import yaml
+
+from sinks import RotatingFileSink, StdoutSink, create_sinks
+
+def test_stdout_sampling():
+    """控制台输出按固定间隔采样"""
+    async def run():
+        stream = io.StringIO()
+        sink = StdoutSink(sample_rate=0.25, stream=stream)
+        sink.start()
+        for i in range(100):
+            await sink.emit({}, f'{{"n":{i}}}'.encode())
+        await sink.close()
+        assert len(stream.getvalue().splitlines()) == 25
+    
+    asyncio.run(run())
+    print("✅ 控制台采样测试通过")
+
+def test_file_rotation():
+    """文件超过 max_bytes 时滚动，保留 backup_count 个备份"""
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'messages.jsonl')
+            sink = RotatingFileSink(path, max_bytes=100, backup_count=2, batch_size=1)
+            sink.start()
+            for i in range(10):
+                await sink.emit({}, b'x' * 39)  # 加换行 40 字节，每个文件 2 条
+            await sink.close()
+            
+            assert sorted(os.listdir(tmp)) == ['messages.jsonl', 'messages.jsonl.1', 'messages.jsonl.2']
+            assert os.path.getsize(path) == 80
+    
+    asyncio.run(run())
+    print("✅ 文件滚动测试通过")
+
+def test_bounded_buffer():
+    """缓冲满时丢弃而不是无限增长"""
+    async def run():
+        sink = StdoutSink(stream=io.StringIO(), buffer_size=5)
+        # 不启动写入协程，模拟写入阻塞
+        for _ in range(8):
+            await sink.emit({}, b'{}')
+        stats = sink.get_stats()
+        assert stats['buffered'] == 5 and stats['dropped'] == 3, stats
+    
+    asyncio.run(run())
+    print("✅ 有界缓冲测试通过")
+
+def test_production_mode():
+    """生产模式下默认不输出到控制台"""
+    sinks = create_sinks({'production': True})
+    assert not any(isinstance(sink, StdoutSink) for sink in sinks)
+    
+    sinks = create_sinks({'production': True, 'console': {'enabled': True}})
+    assert [sink.sample_rate for sink in sinks] == [0.01]
+    
+    # 示例配置不覆盖控制台默认值，只改 production 即可关闭控制台输出
+    with open(Path(__file__).resolve().parent / 'config.yml.example', encoding='utf-8') as f:
+        output_config = yaml.safe_load(f)['output']
+    assert [type(sink) for sink in create_sinks(output_config)] == [StdoutSink]
+    assert create_sinks({**output_config, 'production': True}) == []
+    print("✅ 生产模式测试通过")
+
+if __name__ == '__main__':
+    try:
+        test_stdout_sampling()
+        test_file_rotation()
+        test_bounded_buffer()
+        test_production_mode()
+        print("\n🎉 所有测试通过！")
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)